@@ -8,4 +8,7 @@ done
 
 echo "PostgreSQL started"
 
-celery -A manage.celery worker --loglevel=INFO
\ No newline at end of file
+python manage.py compile-ontology
+
+python manage.py run-worker --queue bulk &
+exec python manage.py run-worker --queue interactive
\ No newline at end of file
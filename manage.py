@@ -1,8 +1,11 @@
 # manage.py
 
 
+import os
+import time
 import unittest
 
+import click
 import coverage
 
 from flask.cli import FlaskGroup
@@ -55,6 +58,252 @@ def create_data():
     pass
 
 
+@cli.command()
+def compile_ontology():
+    """Compiles ontology files for fast loading by workers."""
+    from project.server.extractor.ontologies import compile_ontology, get_skills_resource_dir
+
+    skills_resource_dir = get_skills_resource_dir()
+    artifact_path, ontology = compile_ontology(skills_resource_dir)
+    print("Compiled {} skills, {} patterns to {}".format(
+        len(ontology.skill_nodes), len(ontology.skill_matcher.patterns), artifact_path))
+
+
+@cli.command()
+@click.option("--words", default=100000, help="Number of words of generated document.")
+@click.option("--repeat", default=3, help="Number of runs, the best time is reported.")
+def bench_matcher(words, repeat):
+    """Benchmarks skill matcher against regex scan per skill."""
+    COV.stop()  # tracing would slow down pure python code only
+
+    from project.server.extractor.benchmarks import bench_matcher, generate_content
+    from project.server.extractor.ontologies import (
+        get_skills_resource_dir, load_skill_matcher_from_rdf_resources)
+
+    skills_resource_dir = get_skills_resource_dir()
+    skill_matcher = load_skill_matcher_from_rdf_resources(skills_resource_dir)
+    content = generate_content(skill_matcher, words)
+
+    result = bench_matcher(skill_matcher, content, repeat=repeat)
+    for key, value in result.items():
+        print("{}: {}".format(key, value))
+
+
+@cli.command()
+def migrate_index():
+    """Creates or migrates the Elasticsearch index to the current mappings."""
+    from project.server.extractor.mappings import migrate_index
+
+    index = migrate_index()
+    if index is None:
+        print("Index {} is up to date".format(app.config["ELASTICSEARCH_INDEX"]))
+    else:
+        print("Index {} points to {}".format(app.config["ELASTICSEARCH_INDEX"], index))
+
+
+@cli.command()
+@click.option("--query", "-q", multiple=True, default=["java", "develop", "ava", "code conv"],
+              help="Query to search, may be repeated.")
+@click.option("--repeat", default=5, help="Number of runs, the median time is reported.")
+def bench_search(query, repeat):
+    """Benchmarks search on n-gram fields against wildcard search."""
+    COV.stop()
+    from project.server.extractor.benchmarks import bench_search
+
+    for item in bench_search(query, repeat=repeat):
+        print(", ".join("{}: {}".format(key, value) for key, value in item.items()))
+
+
+@cli.command()
+@click.option("--files", default=50, help="Number of files uploaded each way.")
+@click.option("--size", default=20000, help="Size of each file in bytes.")
+def bench_upload(files, size):
+    """Benchmarks single uploads against batch upload of files and of a zip archive."""
+    COV.stop()
+    from project.server.extractor.benchmarks import bench_upload
+
+    for key, value in bench_upload(n_files=files, file_size=size).items():
+        print("{}: {}".format(key, value))
+
+
+@cli.command()
+@click.option("--documents", default=50, help="Number of synthetic documents.")
+@click.option("--words", default=5000, help="Number of words of each document.")
+@click.option("--labels", default=1000, help="Number of skill labels of the synthetic ontology.")
+@click.option("--pdf-ratio", default=0.5, help="Ratio of documents written as PDF.")
+@click.option("--batch-size", default=10, help="Number of documents of each batch task.")
+@click.option("--repeat", default=3, help="Number of runs, best and median times are reported.")
+@click.option("--seed", default=0, help="Seed of the synthetic corpus and ontology.")
+@click.option("--database-url", default="sqlite://",
+              help="Empty database to run on, in-memory sqlite by default.")
+@click.option("--output", "-o", default=None, help="File to write the JSON result to.")
+@click.option("--baseline", default=None, help="JSON result of an earlier run to compare to.")
+@click.option("--max-regression", default=0.1,
+              help="Exit with 1 if a stage is slower than the baseline by this ratio.")
+def bench(documents, words, labels, pdf_ratio, batch_size, repeat, seed, database_url, output,
+          baseline, max_regression):
+    """Benchmarks extraction stages on a synthetic corpus, without Elasticsearch or broker."""
+    COV.stop()
+    import json
+    from project.server.extractor.benchmarks import compare_results, run_suite
+
+    result = run_suite(n_documents=documents, n_words=words, n_labels=labels,
+                       pdf_ratio=pdf_ratio, batch_size=batch_size, repeat=repeat, seed=seed,
+                       database_url=database_url)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if output is not None:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            comparisons = compare_results(result, json.load(f), max_regression=max_regression)
+        for item in comparisons:
+            print("{}: {:.4f}s, baseline {:.4f}s, {}{}".format(
+                item["stage"], item["seconds"], item["baseline_seconds"],
+                "n/a" if item["change"] is None else "{:+.1%}".format(item["change"]),
+                " REGRESSION" if item["regression"] else ""))
+        if any(item["regression"] for item in comparisons):
+            sys.exit(1)
+
+
+@cli.command()
+@click.option("--chunk-size", default=1000, help="Number of documents read by each query.")
+@click.option("--batch-size", default=50, help="Number of documents of each task.")
+@click.option("--checkpoint", default="reextract.checkpoint",
+              help="File to save the last queued document id, to restart from.")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint, start from first document.")
+@click.option("--sync", is_flag=True, help="Run tasks in this process instead of queue them.")
+def reextract(chunk_size, batch_size, checkpoint, restart, sync):
+    """Re-extracts skills of all documents."""
+    from project.server.models import Document, DocumentJob
+    from project.server.extractor.jobs import set_jobs_state
+    from project.server.extractor.services import iter_document_ids, queue_task, reextract_skills
+
+    after_id = 0
+    if not restart and os.path.isfile(checkpoint):
+        with open(checkpoint) as f:
+            after_id = int(f.read().strip() or 0)
+        print("Restart after document id {}".format(after_id))
+
+    total = Document.query.filter(Document.id > after_id).count()
+    n_done = 0
+    started = time.time()
+
+    for ids in iter_document_ids(chunk_size=chunk_size, after_id=after_id):
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            set_jobs_state(batch, DocumentJob.QUEUED)
+            if sync:
+                reextract_skills(batch)
+            else:
+                queue_task(reextract_skills, (batch,), bulk=True)
+
+        n_done += len(ids)
+        with open(checkpoint, "w") as f:
+            f.write(str(ids[-1]))
+
+        elapsed = time.time() - started
+        print("{}/{} documents {}, {:.1f} documents/s, last id {}".format(
+            n_done, total, "extracted" if sync else "queued",
+            n_done / elapsed if elapsed > 0 else 0, ids[-1]))
+
+    print("Done {} documents in {:.1f}s".format(n_done, time.time() - started))
+
+
+@cli.command()
+@click.option("--queue", type=click.Choice(["interactive", "bulk"]), default="interactive")
+def run_worker(queue):
+    """Runs a celery worker of a queue with the concurrency of the queue in config."""
+    concurrency = app.config["{}_WORKER_CONCURRENCY".format(queue.upper())]
+    celery.worker_main(["worker", "--loglevel=INFO", "--queues", queue,
+                        "--concurrency", str(concurrency),
+                        "--hostname", "{}@%h".format(queue)])
+
+
+@cli.command()
+@click.option("--samples", default=20, help="Number of interactive tasks measured each time.")
+@click.option("--bulk-documents", default=2000, help="Number of documents of the bulk job.")
+@click.option("--batch-size", default=50, help="Number of documents of a bulk task.")
+def load_test(samples, bulk_documents, batch_size):
+    """Measures interactive extraction latency without then during a bulk re-extraction."""
+    COV.stop()
+    from project.server.extractor.benchmarks import bench_queue_latency
+
+    result = bench_queue_latency(n_samples=samples, bulk_documents=bulk_documents,
+                                 batch_size=batch_size)
+    for name in ("baseline", "with_bulk"):
+        print("{}: {}".format(name, ", ".join(
+            "{}: {:.3f}s".format(key, value) for key, value in result[name].items())))
+    print("bulk tasks queued: {}".format(result["bulk_tasks"]))
+
+
+@cli.command()
+@click.option("--metric", "-m", multiple=True, help="Histogram to summarize, may be repeated.")
+def metrics(metric):
+    """Prints p50 and p99 of stage timings dumped by web and worker processes."""
+    from project.server.metrics import get_metrics_dir, registry, summarize_histograms
+
+    snapshot = registry.collect(get_metrics_dir(), max_age=app.config["METRICS_MAX_AGE"])
+    for item in summarize_histograms(snapshot):
+        if len(metric) > 0 and item["metric"] not in metric:
+            continue
+        print(", ".join("{}: {}".format(key, "{:.4f}".format(value) if isinstance(value, float)
+                                        else value) for key, value in item.items()))
+
+
+@cli.command()
+@click.option("--replay", "replay_ids", type=int, multiple=True,
+              help="Queue the task of a dead letter again and delete dead letters of its document.")
+@click.option("--replay-all", is_flag=True, help="Replay all dead letters.")
+@click.option("--purge", is_flag=True, help="Delete all dead letters.")
+@click.option("--limit", default=50, help="Number of dead letters listed.")
+def dead_letters(replay_ids, replay_all, purge, limit):
+    """Lists, replays or purges tasks of documents which failed for good."""
+    import json
+    from project.server.models import DeadLetter, DocumentJob
+    from project.server.extractor.jobs import set_jobs_state
+    from project.server.extractor.services import queue_task
+
+    if purge:
+        n = DeadLetter.query.delete()
+        db.session.commit()
+        print("Deleted {} dead letters".format(n))
+        return
+
+    if replay_all or len(replay_ids) > 0:
+        query = DeadLetter.query
+        if not replay_all:
+            query = query.filter(DeadLetter.id.in_(replay_ids))
+        dead_letters = query.order_by(DeadLetter.id).all()
+
+        # Delete dead letters of the documents first, so their circuit is closed
+        document_ids = set(dead_letter.document_id for dead_letter in dead_letters)
+        DeadLetter.query.filter(DeadLetter.document_id.in_(document_ids)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        set_jobs_state(document_ids, DocumentJob.QUEUED)
+
+        replayed = set()
+        for dead_letter in dead_letters:
+            key = (dead_letter.task_name, dead_letter.args)
+            if key in replayed:
+                continue
+            replayed.add(key)
+            queue_task(celery.tasks[dead_letter.task_name], tuple(json.loads(dead_letter.args)))
+        print("Replayed {} tasks of {} documents".format(len(replayed), len(document_ids)))
+        return
+
+    dead_letters = DeadLetter.query.order_by(DeadLetter.id.desc()).limit(limit).all()
+    for dead_letter in dead_letters:
+        print("{} {} {} document {} retries {} {}: {}".format(
+            dead_letter.id, dead_letter.created_on, dead_letter.task_name,
+            dead_letter.document_id, dead_letter.retries, dead_letter.error_type,
+            (dead_letter.error or "")[:200]))
+    print("{} dead letters".format(DeadLetter.query.count()))
+
+
 @cli.command()
 def test():
     """Runs the unit tests without test coverage."""
@@ -15,6 +15,7 @@ from flask_migrate import Migrate
 
 from celery import Celery
 from project.server.factory import init_celery
+from project.server.es_client import ElasticsearchClient
 
 celery = Celery('skills_extractor', broker='amqp://localhost:5672')
 
@@ -25,6 +26,7 @@ toolbar = DebugToolbarExtension()
 bootstrap = Bootstrap()
 db = SQLAlchemy()
 migrate = Migrate()
+es_client = ElasticsearchClient()
 
 
 def create_app(script_info=None):
@@ -42,6 +44,9 @@ def create_app(script_info=None):
     )
     app.config.from_object(app_settings)
 
+    from project.server.extractor.uploads import UploadRequest
+    app.request_class = UploadRequest
+
     init_celery(app=app, celery=celery)
 
     # logging
@@ -56,6 +61,10 @@ def create_app(script_info=None):
     bootstrap.init_app(app)
     db.init_app(app)
     migrate.init_app(app, db)
+    es_client.init_app(app)
+
+    from project.server.metrics import registry as metrics_registry
+    metrics_registry.init_app(app)
 
     # register blueprints
     from project.server.user.views import user_blueprint
@@ -2,6 +2,8 @@
 
 import os
 
+from kombu import Queue
+
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -15,10 +17,90 @@ class BaseConfig(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     WTF_CSRF_ENABLED = False
     UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
-    MAX_CONTENT_LENGTH = os.getenv("MAX_CONTENT_LENGTH", 100 * 1024 * 1024)
+    DOCUMENTS_PAGE_SIZE = int(os.getenv("DOCUMENTS_PAGE_SIZE", 50))
+    DOCUMENTS_COUNT_CACHE_TTL = int(os.getenv("DOCUMENTS_COUNT_CACHE_TTL", 60))  # seconds
+    SKILLS_AGGREGATIONS_CACHE_TTL = int(os.getenv("SKILLS_AGGREGATIONS_CACHE_TTL", 60))  # seconds
+    # ontology (.ttl) files, relative to the app package
+    ONTOLOGY_RESOURCE_FOLDER = os.getenv("ONTOLOGY_RESOURCE_FOLDER", "resources/ontologies")
+    ONTOLOGY_ARTIFACT_FOLDER = os.getenv("ONTOLOGY_ARTIFACT_FOLDER", "ontologies")
+    # seconds between checks of ontology files for changes, negative to never reload
+    ONTOLOGY_CHECK_INTERVAL = float(os.getenv("ONTOLOGY_CHECK_INTERVAL", 10))
+    MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", 100 * 1024 * 1024))  # bytes
+    # request body and zip archive of a batch upload, each file is at most MAX_CONTENT_LENGTH
+    BATCH_UPLOAD_MAX_CONTENT_LENGTH = int(os.getenv("BATCH_UPLOAD_MAX_CONTENT_LENGTH",
+                                                    1024 * 1024 * 1024))  # bytes
+    BATCH_UPLOAD_MAX_FILES = int(os.getenv("BATCH_UPLOAD_MAX_FILES", 500))
+    # seconds between reads of job states by a status request, and longest wait of a
+    # long poll or server-sent events stream, clients reconnect after it
+    JOB_STATUS_POLL_INTERVAL = float(os.getenv("JOB_STATUS_POLL_INTERVAL", 1))
+    JOB_STATUS_MAX_WAIT = float(os.getenv("JOB_STATUS_MAX_WAIT", 30))
+    # characters of document content sent to the index, skills are matched on the whole content
+    INDEX_CONTENT_MAX_LENGTH = int(os.getenv("INDEX_CONTENT_MAX_LENGTH", 10 * 1024 * 1024))
+    TEXT_CACHE_FOLDER = os.getenv("TEXT_CACHE_FOLDER", "text_cache")
+    # web and worker processes dump their metrics to METRICS_FOLDER every METRICS_DUMP_INTERVAL
+    # seconds (negative to never), /metrics sums dumps newer than METRICS_MAX_AGE seconds
+    METRICS_FOLDER = os.getenv("METRICS_FOLDER", "metrics")
+    METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", 10))
+    METRICS_MAX_AGE = float(os.getenv("METRICS_MAX_AGE", 24 * 3600))
+    TEXT_CACHE_MAX_SIZE = int(os.getenv("TEXT_CACHE_MAX_SIZE", 1024 * 1024 * 1024))  # 0 to disable
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 100))  # else serial
+    PDF_PARALLEL_CHUNK_PAGES = int(os.getenv("PDF_PARALLEL_CHUNK_PAGES", 20))
+    PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", 0))  # 0 for number of CPUs
+    # contents longer than MATCH_PARALLEL_MIN_LENGTH characters are matched by chunks in a
+    # process pool, 0 to disable; not in daemonic processes as celery prefork children
+    MATCH_PARALLEL_MIN_LENGTH = int(os.getenv("MATCH_PARALLEL_MIN_LENGTH", 4 * 1024 * 1024))
+    MATCH_PARALLEL_CHUNK_LENGTH = int(os.getenv("MATCH_PARALLEL_CHUNK_LENGTH", 1024 * 1024))
+    MATCH_PARALLEL_WORKERS = int(os.getenv("MATCH_PARALLEL_WORKERS", 0))  # 0 for number of CPUs
     CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "amqp://localhost:5672")
     CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "amqp://localhost:5672")
+    # Uploads go to "interactive" queue, re-extraction of all documents to "bulk" queue,
+    # so a bulk job does not delay skills of new uploads. Run a worker for each queue:
+    # python manage.py run-worker --queue interactive, python manage.py run-worker --queue bulk
+    CELERY_DEFAULT_QUEUE = "interactive"
+    CELERY_QUEUES = (
+        Queue("interactive", routing_key="interactive", queue_arguments={"x-max-priority": 10}),
+        Queue("bulk", routing_key="bulk", queue_arguments={"x-max-priority": 10}),
+    )
+    CELERY_ROUTES = {
+        "tasks.index_and_extract_skills": {"queue": "interactive", "routing_key": "interactive"},
+        "tasks.index_and_extract_skills_batch": {"queue": "interactive",
+                                                 "routing_key": "interactive"},
+        "tasks.reextract_skills": {"queue": "bulk", "routing_key": "bulk"},
+    }
+    CELERYD_PREFETCH_MULTIPLIER = 1  # a worker reserves one task at once, so priorities apply
+    INTERACTIVE_TASK_PRIORITY = int(os.getenv("INTERACTIVE_TASK_PRIORITY", 9))  # 0 to 9
+    BULK_TASK_PRIORITY = int(os.getenv("BULK_TASK_PRIORITY", 0))
+    # transient errors are retried after TASK_RETRY_BASE_DELAY * 2^retries seconds with
+    # jitter, capped to TASK_RETRY_MAX_DELAY, until TASK_RETRY_DEADLINE seconds after
+    # the first try; other errors are saved as dead letters right away
+    TASK_RETRY_BASE_DELAY = float(os.getenv("TASK_RETRY_BASE_DELAY", 5))
+    TASK_RETRY_MAX_DELAY = float(os.getenv("TASK_RETRY_MAX_DELAY", 600))
+    TASK_MAX_RETRIES = int(os.getenv("TASK_MAX_RETRIES", 10))
+    TASK_RETRY_DEADLINE = float(os.getenv("TASK_RETRY_DEADLINE", 6 * 3600))
+    # a document with DOCUMENT_CIRCUIT_THRESHOLD dead letters in DOCUMENT_CIRCUIT_COOLDOWN
+    # seconds is skipped
+    DOCUMENT_CIRCUIT_THRESHOLD = int(os.getenv("DOCUMENT_CIRCUIT_THRESHOLD", 3))
+    DOCUMENT_CIRCUIT_COOLDOWN = float(os.getenv("DOCUMENT_CIRCUIT_COOLDOWN", 24 * 3600))
+    # worker processes of each queue
+    INTERACTIVE_WORKER_CONCURRENCY = int(os.getenv("INTERACTIVE_WORKER_CONCURRENCY", 4))
+    BULK_WORKER_CONCURRENCY = int(os.getenv("BULK_WORKER_CONCURRENCY", 2))
     ELASTICSEARCH_HOST = os.getenv("ELASTICSEARCH_HOST", "http://localhost:9200")
+    ELASTICSEARCH_MAXSIZE = int(os.getenv("ELASTICSEARCH_MAXSIZE", 10))  # connections per node
+    ELASTICSEARCH_TIMEOUT = float(os.getenv("ELASTICSEARCH_TIMEOUT", 10))  # seconds
+    ELASTICSEARCH_MAX_RETRIES = int(os.getenv("ELASTICSEARCH_MAX_RETRIES", 3))
+    ELASTICSEARCH_RETRY_ON_TIMEOUT = os.getenv(
+        "ELASTICSEARCH_RETRY_ON_TIMEOUT", "true").lower() == "true"
+    ELASTICSEARCH_BULK_SIZE = int(os.getenv("ELASTICSEARCH_BULK_SIZE", 500))  # actions per bulk
+    # "local" matches skills on the parsed text, "elasticsearch" queries skills on the index
+    SKILLS_EXTRACT_MODE = os.getenv("SKILLS_EXTRACT_MODE", "local")
+    EXTRACT_BATCH_WORKERS = int(os.getenv("EXTRACT_BATCH_WORKERS", 4))  # threads of a batch task
+    # uploaded documents are queued by batches of at most UPLOAD_BATCH_SIZE, or after
+    # UPLOAD_BATCH_WINDOW seconds; window 0 to queue each document right away
+    UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", 20))
+    UPLOAD_BATCH_WINDOW = float(os.getenv("UPLOAD_BATCH_WINDOW", 0.5))
+    SKILLS_TOP_N = int(os.getenv("SKILLS_TOP_N", 5))  # skills of a document kept in "skills"
+    # score of a skill is n_match * (1 + SKILLS_TITLE_WEIGHT * matches in title)
+    SKILLS_TITLE_WEIGHT = float(os.getenv("SKILLS_TITLE_WEIGHT", 2))
 
 
 class DevelopmentConfig(BaseConfig):
@@ -0,0 +1,115 @@
+# project/server/es_client.py
+
+
+import os
+import threading
+
+from elasticsearch import Elasticsearch, Transport
+
+from project.server.metrics import elasticsearch_request_seconds
+
+# Requests without an endpoint such as _search, by HTTP method
+DOCUMENT_OPERATIONS = {"PUT": "index", "POST": "index", "GET": "get", "HEAD": "exists",
+                       "DELETE": "delete"}
+
+
+class TimedTransport(Transport):
+    """
+    Transport which times each request by operation, e.g. search, bulk or index
+    """
+
+    def perform_request(self, method, url, *args, **kwargs):
+        with elasticsearch_request_seconds.time(operation=get_operation(method, url)):
+            return super().perform_request(method, url, *args, **kwargs)
+
+
+def get_operation(method, url) -> str:
+    for segment in url.split("?", 1)[0].split("/"):
+        if segment.startswith("_") and segment not in ("_doc", "_create"):
+            return segment[1:]
+    return DOCUMENT_OPERATIONS.get(method, method.lower())
+
+
+class ElasticsearchClient(object):
+    """
+    One Elasticsearch client for each process, shared by request handlers and celery tasks.
+
+    The client keeps its connection pool, so HTTP connections are reused between calls.
+    It is created lazily and again after fork, as connections must not be shared
+    between processes.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.n_clients = 0  # clients created by this process
+        self.n_checkouts = 0  # calls of get_client
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["elasticsearch"] = self
+
+    def get_client(self) -> Elasticsearch:
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    self._client = self.create_client()
+                    self._pid = pid
+                    self.n_clients += 1
+        self.n_checkouts += 1
+        return self._client
+
+    def set_client(self, client: Elasticsearch) -> Elasticsearch:
+        """
+        Use client in this process instead of the current client, e.g. an in-process
+        stand-in of benchmarks. None to create a client from config again.
+        - **return**::
+            :return: client replaced, to set back, None if it was not created yet
+        """
+
+        with self._lock:
+            previous = self._client if self._pid == os.getpid() else None
+            self._client = client
+            self._pid = os.getpid() if client is not None else None
+        return previous
+
+    def create_client(self) -> Elasticsearch:
+        config = self.app.config
+        return Elasticsearch(
+            config["ELASTICSEARCH_HOST"],
+            maxsize=config["ELASTICSEARCH_MAXSIZE"],
+            timeout=config["ELASTICSEARCH_TIMEOUT"],
+            max_retries=config["ELASTICSEARCH_MAX_RETRIES"],
+            retry_on_timeout=config["ELASTICSEARCH_RETRY_ON_TIMEOUT"],
+            transport_class=TimedTransport,
+        )
+
+    def metrics(self) -> dict:
+        """
+        Connection reuse of this process.
+        - **return**::
+            :return: dict of clients created, client checkouts, HTTP connections opened
+                and HTTP requests sent
+        """
+
+        n_connections = 0
+        n_requests = 0
+        if self._client is not None and self._pid == os.getpid():
+            for connection in self._client.transport.connection_pool.connections:
+                pool = getattr(connection, "pool", None)
+                n_connections += getattr(pool, "num_connections", 0)
+                n_requests += getattr(pool, "num_requests", 0)
+
+        return {
+            "pid": os.getpid(),
+            "clients": self.n_clients,
+            "checkouts": self.n_checkouts,
+            "connections": n_connections,
+            "requests": n_requests,
+            "connection_reuse_ratio": 1 - n_connections / n_requests if n_requests > 0 else None,
+        }
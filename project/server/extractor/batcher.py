@@ -0,0 +1,61 @@
+# project/server/extractor/batcher.py
+
+import atexit
+import threading
+from typing import Callable, List
+
+from flask import current_app as app
+
+
+class IdBatcher(object):
+    """
+    Coalesce ids added one by one into batches, a batch is sent when max_size ids
+    are buffered or window seconds after its first id was added.
+    """
+
+    def __init__(self, send: Callable[[List], None]):
+        self.send = send
+        self.ids = []
+        self._timer = None
+        self._app = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def add(self, id, max_size: int, window: float):
+        if max_size <= 1 or window <= 0:
+            self.send([id])
+            return
+
+        with self._lock:
+            self._app = app._get_current_object()
+            self.ids.append(id)
+            if len(self.ids) < max_size:
+                if self._timer is None:
+                    self._timer = threading.Timer(window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            ids = self._take()
+
+        self.send(ids)
+
+    def flush(self):
+        with self._lock:
+            ids = self._take()
+        if len(ids) == 0:
+            return
+
+        with self._app.app_context():
+            try:
+                self.send(ids)
+            except Exception as e:
+                app.logger.warning("Error {}: Failed send batch of ids {}".format(
+                    e.__class__.__name__, ids))
+
+    def _take(self) -> List:
+        ids = self.ids
+        self.ids = []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return ids
@@ -0,0 +1,11 @@
+# project/server/extractor/benchmarks/__init__.py
+
+from project.server.extractor.benchmarks.corpora import (  # noqa: F401
+    FILLER_WORDS, generate_documents, generate_ontology_ttl, generate_text)
+from project.server.extractor.benchmarks.matching import (  # noqa: F401
+    bench_matcher, generate_content, regex_match)
+from project.server.extractor.benchmarks.live import (  # noqa: F401
+    bench_queue_latency, bench_search, bench_upload, measure_task_latency, summarize_latencies)
+from project.server.extractor.benchmarks.stand_in import (  # noqa: F401
+    InProcessConnection, InProcessStore, create_stand_in_client)
+from project.server.extractor.benchmarks.suite import compare_results, run_suite  # noqa: F401
@@ -0,0 +1,154 @@
+# project/server/extractor/benchmarks/corpora.py
+
+import os
+import random
+from typing import List
+
+FILLER_WORDS = ["the", "team", "project", "experience", "years", "with", "and", "of",
+                "developer", "worked", "on", "system", "design", "using", "for", "in"]
+SYLLABLES = ["ka", "lo", "mi", "ren", "tor", "vex", "qua", "zil", "dor", "pa", "sun", "ix",
+             "bel", "cro", "fa", "gri", "hu", "jen", "nor", "so"]
+ONTOLOGY_URI = "https://github.com/jerryquickly/skills_extractor/ontologies/rd/bench"
+TTL_HEADER = """@prefix : <{uri}#> .
+@prefix owl: <http://www.w3.org/2002/07/owl#> .
+@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+@base <{uri}> .
+
+<{uri}> rdf:type owl:Ontology .
+
+""".format(uri=ONTOLOGY_URI)
+PDF_WORDS_PER_LINE = 12
+PDF_LINES_PER_PAGE = 50
+
+
+def generate_text(terms: List[str], n_words: int, skill_ratio=0.01, seed=0) -> str:
+    """
+    Generate text of n_words words which some of them are terms (skill names or labels)
+    """
+
+    rand = random.Random(seed)
+    words = []
+    for i in range(n_words):
+        if len(terms) > 0 and rand.random() < skill_ratio:
+            words.append(rand.choice(terms))
+        else:
+            words.append(rand.choice(FILLER_WORDS))
+    return " ".join(words)
+
+
+def generate_labels(n_labels: int, seed=0) -> List[str]:
+    """
+    Distinct made-up skill labels of one to three words, so they are matched
+    like real labels but never by filler words
+    """
+
+    rand = random.Random(seed)
+    labels = []
+    seen = set()
+    while len(labels) < n_labels:
+        words = ["".join(rand.choice(SYLLABLES) for i in range(rand.randint(2, 4)))
+                 for j in range(rand.choice([1, 1, 1, 2, 3]))]
+        label = " ".join(words)
+        if label not in seen:
+            seen.add(label)
+            labels.append(label)
+    return labels
+
+
+def generate_ontology_ttl(path, n_labels: int, seed=0) -> List[str]:
+    """
+    Write an ontology file of n_labels skill classes, each one has a label and a
+    category, in the format of the ontology files of resources/ontologies
+    - **return**::
+        :return: labels of the skills
+    """
+
+    labels = generate_labels(n_labels, seed=seed)
+    n_categories = max(1, n_labels // 50)
+
+    with open(path, "w") as f:
+        f.write(TTL_HEADER)
+        for i in range(n_categories):
+            f.write(":Category_{} rdf:type owl:Class .\n\n".format(i))
+        for i, label in enumerate(labels):
+            f.write(":Skill_{} rdf:type owl:Class ;\n".format(i))
+            f.write("    rdfs:subClassOf :Category_{} ;\n".format(i % n_categories))
+            f.write("    rdfs:label \"{}\"^^xsd:string .\n\n".format(label))
+    return labels
+
+
+def write_text_pdf(path, text: str):
+    """
+    Write text to a minimal PDF of one text object for each page, which
+    PyPDF2 extractText reads back line by line
+    """
+
+    words = text.split()
+    lines = [" ".join(words[i:i + PDF_WORDS_PER_LINE])
+             for i in range(0, len(words), PDF_WORDS_PER_LINE)] or [""]
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)]
+
+    def escape(line):
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    n_objects = 3 + 2 * len(pages)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join("{} 0 R".format(4 + 2 * i) for i in range(len(pages))), len(pages)),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, page in enumerate(pages):
+        stream = "BT /F1 10 Tf 12 TL 50 800 Td\n{}\nET".format(
+            "\nT*\n".join("({}) Tj".format(escape(line)) for line in page))
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       "/Resources << /Font << /F1 3 0 R >> >> "
+                       "/Contents {} 0 R >>".format(5 + 2 * i))
+        objects.append("<< /Length {} >>\nstream\n{}\nendstream".format(
+            len(stream.encode("latin-1")), stream))
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(data))
+        data += "{} 0 obj\n{}\nendobj\n".format(i + 1, obj).encode("latin-1")
+    xref_offset = len(data)
+    data += "xref\n0 {}\n0000000000 65535 f \n".format(n_objects + 1).encode("latin-1")
+    for offset in offsets:
+        data += "{:010d} 00000 n \n".format(offset).encode("latin-1")
+    data += "trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n".format(
+        n_objects + 1, xref_offset).encode("latin-1")
+
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def generate_documents(dir, n_documents: int, n_words: int, terms: List[str], skill_ratio=0.01,
+                       pdf_ratio=0.5, seed=0) -> List[dict]:
+    """
+    Write n_documents documents of n_words words each to dir, pdf_ratio of them as
+    PDF and the others as text files, all with different content
+    - **return**::
+        :return: dicts of content_type, title, filename and path of the documents
+    """
+
+    os.makedirs(dir, exist_ok=True)
+    rand = random.Random(seed)
+    documents = []
+    for i in range(n_documents):
+        text = generate_text(terms, n_words, skill_ratio=skill_ratio, seed=seed * 1000003 + i)
+        title = "Bench document {} {}".format(i, rand.choice(terms) if terms else "")
+        if rand.random() < pdf_ratio:
+            filename = "bench-{}.pdf".format(i)
+            content_type = "application/pdf"
+            write_text_pdf(os.path.join(dir, filename), text)
+        else:
+            filename = "bench-{}.txt".format(i)
+            content_type = "text/plain"
+            with open(os.path.join(dir, filename), "w") as f:
+                f.write(text)
+        documents.append({"content_type": content_type, "title": title.strip(),
+                          "filename": filename, "path": os.path.join(dir, filename)})
+    return documents
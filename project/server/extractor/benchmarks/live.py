@@ -0,0 +1,147 @@
+# project/server/extractor/benchmarks/live.py
+
+import io
+import time
+import timeit
+import zipfile
+from typing import List
+
+from flask import current_app as app
+
+from project.server import db
+from project.server.models import Document, User
+
+from project.server.extractor.indexes import (
+    search_index_content, search_index_content_by_wildcard)
+from project.server.extractor.benchmarks.corpora import FILLER_WORDS
+
+
+def bench_search(queries: List[str], repeat=5) -> List[dict]:
+    """
+    Compare latency of search on n-gram fields with wildcard query string search.
+    - **return**::
+        :return: for each query, median seconds of each way and number of hits
+    """
+
+    result = []
+    for q in queries:
+        item = {"query": q}
+        for name, search in (("ngram", search_index_content),
+                             ("wildcard", search_index_content_by_wildcard)):
+            seconds = timeit.repeat(lambda: search(q), number=1, repeat=repeat)
+            item[name + "_seconds"] = sorted(seconds)[len(seconds) // 2]
+            item[name + "_hits"] = len(search(q))
+        result.append(item)
+    return result
+
+
+def measure_task_latency(document_ids: List[int], n_samples: int, timeout=600) -> List[float]:
+    """
+    Seconds from queueing index_and_extract_skills of a document as an upload does
+    to its result, one task at once
+    """
+
+    from project.server.extractor.services import index_and_extract_skills, queue_task
+
+    latencies = []
+    for i in range(n_samples):
+        started = time.time()
+        queue_task(index_and_extract_skills, (document_ids[i % len(document_ids)],)) \
+            .get(timeout=timeout)
+        latencies.append(time.time() - started)
+    return latencies
+
+
+def summarize_latencies(latencies: List[float]) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "max": latencies[-1],
+    }
+
+
+def bench_queue_latency(n_samples=20, bulk_documents=2000, batch_size=50) -> dict:
+    """
+    Latency of interactive tasks on an idle queue, then while re-extraction tasks of
+    bulk_documents documents wait in the bulk queue. Needs running workers of both
+    queues and documents in database.
+    - **return**::
+        :return: dict of latency summary of each run and number of bulk tasks
+    """
+
+    from project.server.extractor.services import queue_task, reextract_skills
+
+    rows = db.session.query(Document.id).order_by(Document.id.desc()).limit(bulk_documents).all()
+    document_ids = [row[0] for row in rows]
+    if len(document_ids) == 0:
+        raise ValueError("No document to extract, upload some documents first")
+
+    baseline = measure_task_latency(document_ids, n_samples)
+
+    bulk_ids = [document_ids[i % len(document_ids)] for i in range(bulk_documents)]
+    n_bulk_tasks = 0
+    for i in range(0, len(bulk_ids), batch_size):
+        queue_task(reextract_skills, (bulk_ids[i:i + batch_size],), bulk=True)
+        n_bulk_tasks += 1
+
+    with_bulk = measure_task_latency(document_ids, n_samples)
+
+    return {
+        "baseline": summarize_latencies(baseline),
+        "with_bulk": summarize_latencies(with_bulk),
+        "bulk_tasks": n_bulk_tasks,
+    }
+
+
+def bench_upload(n_files=50, file_size=20000, email="bench@skills-extractor.local",
+                 password="bench_password") -> dict:
+    """
+    Compare throughput of uploading n_files text files one by one, then by one batch
+    upload of all files, then by one batch upload of a zip archive of them. Documents
+    are created for a bench user and queued to extract, as uploads of users are.
+    - **return**::
+        :return: dict of seconds and files per second of each way
+    """
+
+    if User.query.filter_by(email=email).first() is None:
+        db.session.add(User(email=email, password=password))
+        db.session.commit()
+
+    words = (" ".join(FILLER_WORDS) + " ").encode("utf-8")
+    content = (words * (file_size // len(words) + 1))[:file_size]
+    filenames = ["bench-{}.txt".format(i) for i in range(n_files)]
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as f:
+        for filename in filenames:
+            f.writestr(filename, content)
+    archive = archive.getvalue()
+
+    def upload_single(client):
+        for filename in filenames:
+            client.post("/upload", data=dict(file=(io.BytesIO(content), filename)),
+                        content_type="multipart/form-data")
+
+    def upload_batch(client):
+        files = [(io.BytesIO(content), filename) for filename in filenames]
+        client.post("/upload/batch", data=dict(files=files), content_type="multipart/form-data")
+
+    def upload_zip(client):
+        client.post("/upload/batch", data=dict(files=[(io.BytesIO(archive), "bench.zip")]),
+                    content_type="multipart/form-data")
+
+    result = {"files": n_files, "file_size": file_size}
+    for name, upload in (("single", upload_single), ("batch", upload_batch), ("zip", upload_zip)):
+        with app.test_client() as client:
+            client.post("/login", data=dict(email=email, password=password))
+            n_documents = Document.query.count()
+            started = time.time()
+            upload(client)
+            seconds = time.time() - started
+            db.session.remove()
+            if Document.query.count() - n_documents != n_files:
+                raise ValueError("Upload {} did not create {} documents".format(name, n_files))
+        result[name + "_seconds"] = seconds
+        result[name + "_files_per_second"] = n_files / seconds if seconds > 0 else None
+    return result
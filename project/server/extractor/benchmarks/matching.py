@@ -0,0 +1,58 @@
+# project/server/extractor/benchmarks/matching.py
+
+import re
+import timeit
+from typing import List, Tuple
+
+from project.server.extractor.matcher import SkillMatcher
+from project.server.extractor.benchmarks.corpora import generate_text
+
+
+def regex_match(skill_matcher: SkillMatcher, content: str) -> List[Tuple[str, int]]:
+    """
+    Match skills as extract_skills_in_document did before SkillMatcher:
+    compile and run one regex for each skill name and label.
+    """
+
+    content_lower = content.lower()
+    result = []
+    for skill in skill_matcher.terms:
+        regex = re.compile(r"\b{}\b".format(re.escape(skill.lower())))
+        n_match = len(regex.findall(content_lower))
+        if n_match > 0:
+            result.append((skill, n_match))
+    return result
+
+
+def generate_content(skill_matcher: SkillMatcher, n_words: int, skill_ratio=0.01,
+                     seed=0) -> str:
+    """
+    Generate text of n_words words which some of them are skill names or labels
+    """
+
+    return generate_text(skill_matcher.terms, n_words, skill_ratio=skill_ratio, seed=seed)
+
+
+def bench_matcher(skill_matcher: SkillMatcher, content: str, repeat=3) -> dict:
+    """
+    Compare time of SkillMatcher with regex scan per skill on the same content.
+    - **return**::
+        :return: dict of best time in seconds of each way and whether results are equal
+    """
+
+    regex_result = regex_match(skill_matcher, content)
+    matcher_result = skill_matcher.match(content)
+
+    regex_seconds = min(timeit.repeat(
+        lambda: regex_match(skill_matcher, content), number=1, repeat=repeat))
+    matcher_seconds = min(timeit.repeat(
+        lambda: skill_matcher.match(content), number=1, repeat=repeat))
+
+    return {
+        "n_patterns": len(skill_matcher.patterns),
+        "content_length": len(content),
+        "regex_seconds": regex_seconds,
+        "matcher_seconds": matcher_seconds,
+        "speedup": regex_seconds / matcher_seconds if matcher_seconds > 0 else None,
+        "equal": regex_result == matcher_result,
+    }
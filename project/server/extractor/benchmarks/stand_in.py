@@ -0,0 +1,270 @@
+# project/server/extractor/benchmarks/stand_in.py
+
+import json
+import threading
+from typing import List, Tuple
+
+from elasticsearch import Connection, Elasticsearch
+
+from project.server.es_client import TimedTransport
+
+STAND_IN_VERSION = "7.17.0"
+RESPONSE_HEADERS = {"content-type": "application/json", "x-elastic-product": "Elasticsearch"}
+
+
+class StandInError(Exception):
+
+    def __init__(self, status, error_type, reason=None):
+        super().__init__(reason or error_type)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+
+class InProcessStore(object):
+    """
+    Indices of the in-process Elasticsearch stand-in: documents by id of each index
+    and indices of each alias. Documents are kept as sent, nothing is analyzed.
+    """
+
+    def __init__(self):
+        self.indices = dict()  # dict by index name to dict by id to (version, source)
+        self.aliases = dict()  # dict by alias to set of index names
+        self.lock = threading.RLock()
+
+    def resolve(self, name, create=False) -> List[str]:
+        if name in self.indices:
+            return [name]
+        if name in self.aliases:
+            return sorted(self.aliases[name])
+        if create:
+            # Writes create missing indices as Elasticsearch does by default
+            self.indices[name] = dict()
+            return [name]
+        raise StandInError(404, "index_not_found_exception", "no such index [{}]".format(name))
+
+    def write_index(self, name) -> str:
+        indices = self.resolve(name, create=True)
+        if len(indices) > 1:
+            raise StandInError(400, "illegal_argument_exception",
+                               "alias [{}] has more than one index".format(name))
+        return indices[0]
+
+
+class InProcessConnection(Connection):
+    """
+    Connection which serves requests from an InProcessStore instead of sending them,
+    so the index, get, update, mget, bulk and search requests of the extraction
+    pipeline run without an Elasticsearch node. Queries other than match_all, ids,
+    term and terms are rejected with 400.
+    """
+
+    def __init__(self, store: InProcessStore = None, **kwargs):
+        super().__init__(**kwargs)
+        self.store = store if store is not None else InProcessStore()
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(),
+                        headers=None):
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        params = dict((key, value.decode("utf-8") if isinstance(value, bytes) else value)
+                      for key, value in (params or {}).items())
+
+        try:
+            with self.store.lock:
+                status, data = self.route(method, url.split("?", 1)[0], params, body)
+        except StandInError as e:
+            status = e.status
+            data = {"error": {"type": e.error_type, "reason": e.reason}, "status": e.status}
+
+        raw_data = json.dumps(data) if data is not None else ""
+        if not (200 <= status < 300) and status not in ignore:
+            self._raise_error(status, raw_data)
+        return status, dict(RESPONSE_HEADERS), raw_data
+
+    def route(self, method, path, params: dict, body: str) -> Tuple[int, dict]:
+        segments = [segment for segment in path.split("/") if segment]
+
+        if len(segments) == 0:
+            return 200, {"name": "stand-in", "cluster_name": "stand-in",
+                         "version": {"number": STAND_IN_VERSION, "build_flavor": "default"},
+                         "tagline": "You Know, for Search"}
+        if segments[-1] == "_bulk":
+            return self.bulk(segments[0] if len(segments) > 1 else None, body)
+        if len(segments) == 1:
+            return self.index_request(method, segments[0], body)
+
+        index, endpoint = segments[0], segments[-1]
+        if endpoint == "_refresh":
+            self.store.resolve(index)
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if endpoint == "_search":
+            return self.search(index, json.loads(body) if body else {})
+        if endpoint == "_mget":
+            return self.mget(index, json.loads(body), params)
+        if endpoint == "_update" or (len(segments) == 3 and segments[1] == "_update"):
+            id = segments[2] if segments[1] == "_update" else segments[-2]
+            return self.update(index, id, json.loads(body))
+        if len(segments) == 3 and (segments[1] in ("_doc", "_create")
+                                   or not segments[1].startswith("_")):
+            return self.document_request(method, index, segments[2], body)
+
+        raise StandInError(400, "illegal_argument_exception",
+                           "{} {} is not supported by the stand-in".format(method, path))
+
+    def index_request(self, method, index, body: str) -> Tuple[int, dict]:
+        store = self.store
+        if method == "HEAD":
+            store.resolve(index)
+            return 200, None
+        if method == "PUT":
+            if index in store.indices or index in store.aliases:
+                raise StandInError(400, "resource_already_exists_exception",
+                                   "index [{}] already exists".format(index))
+            store.indices[index] = dict()
+            for alias in (json.loads(body) if body else {}).get("aliases", {}):
+                store.aliases.setdefault(alias, set()).add(index)
+            return 200, {"acknowledged": True, "shards_acknowledged": True, "index": index}
+        if method == "DELETE":
+            for name in store.resolve(index):
+                del store.indices[name]
+                for indices in store.aliases.values():
+                    indices.discard(name)
+            return 200, {"acknowledged": True}
+        raise StandInError(400, "illegal_argument_exception",
+                           "{} /{} is not supported by the stand-in".format(method, index))
+
+    def document_request(self, method, index, id, body: str) -> Tuple[int, dict]:
+        if method in ("PUT", "POST"):
+            return self.index_doc(index, id, json.loads(body))
+
+        name = self.store.resolve(index)[0]
+        doc = self.store.indices[name].get(id)
+        if method == "DELETE":
+            if doc is None:
+                return 404, {"_index": name, "_id": id, "result": "not_found"}
+            del self.store.indices[name][id]
+            return 200, {"_index": name, "_id": id, "result": "deleted"}
+        if doc is None:
+            return 404, {"_index": name, "_type": "_doc", "_id": id, "found": False}
+        return 200, self.hit(name, id, doc, found=True)
+
+    def index_doc(self, index, id, source: dict) -> Tuple[int, dict]:
+        name = self.store.write_index(index)
+        docs = self.store.indices[name]
+        version = docs[id][0] + 1 if id in docs else 1
+        docs[id] = (version, source)
+        return (200 if version > 1 else 201), {
+            "_index": name, "_type": "_doc", "_id": id, "_version": version,
+            "result": "updated" if version > 1 else "created",
+            "_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    def update(self, index, id, body: dict) -> Tuple[int, dict]:
+        if "doc" not in body:
+            raise StandInError(400, "illegal_argument_exception",
+                               "only partial updates by doc are supported by the stand-in")
+
+        name = self.store.write_index(index)
+        docs = self.store.indices[name]
+        if id not in docs:
+            raise StandInError(404, "document_missing_exception",
+                               "[_doc][{}]: document missing".format(id))
+        version, source = docs[id]
+        docs[id] = (version + 1, dict(source, **body["doc"]))
+        return 200, {"_index": name, "_type": "_doc", "_id": id, "_version": version + 1,
+                     "result": "updated",
+                     "_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    def bulk(self, default_index, body: str) -> Tuple[int, dict]:
+        lines = [line for line in body.splitlines() if line.strip()]
+        items = []
+        i = 0
+        while i < len(lines):
+            action = json.loads(lines[i])
+            op_type, meta = next(iter(action.items()))
+            index = meta.get("_index", default_index)
+            id = str(meta["_id"])
+            i += 1
+
+            try:
+                if op_type in ("index", "create"):
+                    status, result = self.index_doc(index, id, json.loads(lines[i]))
+                    i += 1
+                elif op_type == "update":
+                    status, result = self.update(index, id, json.loads(lines[i]))
+                    i += 1
+                else:
+                    status, result = self.document_request("DELETE", index, id, None)
+                result["status"] = status
+            except StandInError as e:
+                if op_type in ("index", "create", "update"):
+                    i += 1
+                result = {"_index": index, "_id": id, "status": e.status,
+                          "error": {"type": e.error_type, "reason": e.reason}}
+            items.append({op_type: result})
+
+        return 200, {"took": 0, "errors": any("error" in next(iter(item.values()))
+                                              for item in items), "items": items}
+
+    def mget(self, index, body: dict, params: dict) -> Tuple[int, dict]:
+        ids = body.get("ids") or [doc["_id"] for doc in body.get("docs", [])]
+        includes = params.get("_source_includes")
+        name = self.store.resolve(index)[0]
+        docs = self.store.indices[name]
+        return 200, {"docs": [
+            self.hit(name, str(id), docs[str(id)], includes=includes, found=True)
+            if str(id) in docs else {"_index": name, "_id": str(id), "found": False}
+            for id in ids]}
+
+    def search(self, index, body: dict) -> Tuple[int, dict]:
+        query = body.get("query", {"match_all": {}})
+        hits = []
+        for name in self.store.resolve(index):
+            for id, doc in self.store.indices[name].items():
+                if self.matches(query, id, doc[1]):
+                    hits.append(self.hit(name, id, doc, includes=body.get("_source")))
+
+        start = body.get("from", 0)
+        return 200, {"took": 0, "timed_out": False,
+                     "hits": {"total": {"value": len(hits), "relation": "eq"},
+                              "max_score": 1.0 if hits else None,
+                              "hits": hits[start:start + body.get("size", 10)]}}
+
+    def matches(self, query: dict, id, source: dict) -> bool:
+        if len(query) != 1:
+            raise StandInError(400, "parsing_exception", "one query clause is supported")
+        query_type, clause = next(iter(query.items()))
+        if query_type == "match_all":
+            return True
+        if query_type == "ids":
+            return id in [str(value) for value in clause["values"]]
+        if query_type in ("term", "terms"):
+            field, values = next(iter(clause.items()))
+            if query_type == "term":
+                values = [values["value"] if isinstance(values, dict) else values]
+            return source.get(field) in values
+        raise StandInError(400, "parsing_exception",
+                           "query {} is not supported by the stand-in".format(query_type))
+
+    @staticmethod
+    def hit(name, id, doc: tuple, includes=None, found=None) -> dict:
+        version, source = doc
+        if isinstance(includes, str):
+            includes = includes.split(",")
+        if isinstance(includes, list):
+            source = dict((key, value) for key, value in source.items() if key in includes)
+        hit = {"_index": name, "_type": "_doc", "_id": id, "_version": version,
+               "_score": 1.0, "_source": source}
+        if found is not None:
+            hit["found"] = found
+        return hit
+
+
+def create_stand_in_client(store: InProcessStore = None) -> Elasticsearch:
+    """
+    Elasticsearch client of an in-process stand-in, timed as the client of es_client
+    """
+
+    return Elasticsearch([{"host": "stand-in"}], connection_class=InProcessConnection,
+                         store=store if store is not None else InProcessStore(),
+                         transport_class=TimedTransport, max_retries=0)
@@ -0,0 +1,248 @@
+# project/server/extractor/benchmarks/suite.py
+
+import os
+import sys
+import time
+import shutil
+import platform
+import datetime
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from statistics import median
+from typing import Callable, List
+
+from flask import current_app as app
+from sqlalchemy.engine.url import make_url
+
+from project.server import db, es_client
+from project.server.models import Document, User
+from project.server.extractor.benchmarks.corpora import generate_documents, generate_ontology_ttl
+from project.server.extractor.benchmarks.stand_in import InProcessStore, create_stand_in_client
+from project.server.extractor.contents import is_pdf, iter_document_content
+from project.server.extractor.indexes import extract_skills_in_content
+from project.server.extractor.mappings import checked_indexes
+from project.server.extractor.ontologies import (
+    compile_ontology, get_ontology, load_ontology, ontology_registries)
+from project.server.extractor.services import (
+    DocumentService, index_and_extract_skills_batch, rank_skill_extracts)
+
+SUITE_VERSION = 1  # increase when stages or their measure change, results are not comparable
+BENCH_INDEX = "bench"
+BENCH_EMAIL = "bench@skills-extractor.local"
+
+
+@contextmanager
+def bench_app(work_dir, database_url="sqlite://"):
+    """
+    Point the app to the database of database_url, in-memory by default, the stand-in
+    Elasticsearch and the ontology of work_dir, then restore it. Text cache is
+    disabled so each run parses the documents.
+    """
+
+    overrides = {
+        "SQLALCHEMY_DATABASE_URI": database_url,
+        "TEXT_CACHE_MAX_SIZE": 0,
+        "ONTOLOGY_RESOURCE_FOLDER": os.path.join(work_dir, "ontologies"),
+        "ONTOLOGY_ARTIFACT_FOLDER": os.path.join(work_dir, "artifacts"),
+        "ONTOLOGY_CHECK_INTERVAL": -1,
+        "ELASTICSEARCH_INDEX": BENCH_INDEX,
+        "SKILLS_EXTRACT_MODE": "local",
+        "METRICS_DUMP_INTERVAL": -1,
+    }
+    config = app.config
+    saved = dict((key, config.get(key)) for key in overrides)
+    store = InProcessStore()
+
+    db.session.remove()
+    config.update(overrides)
+    client = es_client.set_client(create_stand_in_client(store))
+    try:
+        db.create_all()
+        yield store
+    finally:
+        db.session.remove()
+        if database_url != saved["SQLALCHEMY_DATABASE_URI"]:
+            db.engine.dispose()
+        config.update(saved)
+        es_client.set_client(client)
+        checked_indexes.discard(BENCH_INDEX)
+        ontology_registries.pop(overrides["ONTOLOGY_RESOURCE_FOLDER"], None)
+
+
+def time_runs(run: Callable, repeat: int) -> List[float]:
+    seconds = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def summarize_runs(seconds: List[float], **amounts) -> dict:
+    """
+    Best and median seconds of runs, and each amount per second of the best run
+    """
+
+    best = min(seconds)
+    result = {"seconds": best, "median_seconds": median(seconds), "runs": len(seconds)}
+    for name, amount in amounts.items():
+        result[name] = amount
+        result[name + "_per_second"] = amount / best if best > 0 else None
+    return result
+
+
+def get_version_info() -> dict:
+    """
+    What the results were measured on: git revision of the tree, python and machine
+    """
+
+    try:
+        revision = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=app.root_path,
+            stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        "suite": SUITE_VERSION,
+        "git_revision": revision,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+    }
+
+
+def run_suite(n_documents=50, n_words=5000, n_labels=1000, pdf_ratio=0.5, skill_ratio=0.01,
+              batch_size=10, repeat=3, seed=0, database_url="sqlite://", work_dir=None) -> dict:
+    """
+    Benchmark extraction stages on a synthetic ontology of n_labels skills and
+    n_documents synthetic documents of n_words words: ontology compile and load,
+    text extraction, matching, ranking, then end to end throughput of the batch
+    task against an in-process Elasticsearch stand-in. Inputs depend on the
+    parameters and seed only, so results of two trees are comparable.
+    Tables are created in the database of database_url, pass an empty database.
+    - **return**::
+        :return: dict of version info, params and results of each stage, best and
+            median seconds of repeat runs with throughput of the best run
+    """
+
+    params = {"documents": n_documents, "words": n_words, "labels": n_labels,
+              "pdf_ratio": pdf_ratio, "skill_ratio": skill_ratio, "batch_size": batch_size,
+              "repeat": repeat, "seed": seed, "database": make_url(database_url).drivername}
+    remove_work_dir = work_dir is None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="skills-bench-")
+
+    try:
+        with bench_app(work_dir, database_url=database_url) as store:
+            results = run_stages(work_dir, store, params)
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {"version": get_version_info(), "params": params, "results": results}
+
+
+def run_stages(work_dir, store: InProcessStore, params: dict) -> dict:
+    repeat = params["repeat"]
+    results = dict()
+
+    resource_dir = app.config["ONTOLOGY_RESOURCE_FOLDER"]
+    artifact_dir = app.config["ONTOLOGY_ARTIFACT_FOLDER"]
+    os.makedirs(resource_dir, exist_ok=True)
+    generate_ontology_ttl(os.path.join(resource_dir, "bench.ttl"), params["labels"],
+                          seed=params["seed"])
+
+    seconds = time_runs(lambda: compile_ontology(resource_dir, artifact_dir), repeat)
+    results["ontology_compile"] = summarize_runs(seconds, labels=params["labels"])
+    seconds = time_runs(lambda: load_ontology(resource_dir, artifact_dir), repeat)
+    results["ontology_load"] = summarize_runs(seconds, labels=params["labels"])
+
+    # Tasks get the ontology of the registry, loaded once here as by a worker
+    ontology = get_ontology(resource_dir)
+    rows = generate_documents(os.path.join(work_dir, "documents"), params["documents"],
+                              params["words"], ontology.skill_matcher.terms,
+                              skill_ratio=params["skill_ratio"],
+                              pdf_ratio=params["pdf_ratio"], seed=params["seed"])
+    user = User(email=BENCH_EMAIL, password="bench_password")
+    db.session.add(user)
+    db.session.commit()
+    ids = DocumentService().create_many(rows, user.id)
+    documents = Document.query.filter(Document.id.in_(ids)).order_by(Document.id).all()
+
+    contents = dict()  # parts of each document, to match without parsing
+
+    def extract_texts():
+        for document in documents:
+            contents[document.id] = list(iter_document_content(document))
+
+    seconds = time_runs(extract_texts, repeat)
+    n_bytes = sum(os.path.getsize(row["path"]) for row in rows)
+    n_characters = sum(sum(len(part) for part in parts) for parts in contents.values())
+    results["text_extraction"] = summarize_runs(
+        seconds, documents=len(documents), bytes=n_bytes, characters=n_characters,
+        pages=sum(len(contents[document.id]) for document in documents if is_pdf(document)))
+
+    skill_extracts = dict()
+
+    def match():
+        for document in documents:
+            skill_extracts[document.id] = extract_skills_in_content(
+                contents[document.id], ontology=ontology)
+
+    seconds = time_runs(match, repeat)
+    results["matching"] = summarize_runs(
+        seconds, documents=len(documents), characters=n_characters,
+        skills=sum(len(extracts) for extracts in skill_extracts.values()))
+
+    def rank():
+        for document in documents:
+            rank_skill_extracts(document, skill_extracts[document.id], ontology.skill_matcher)
+
+    seconds = time_runs(rank, repeat)
+    results["ranking"] = summarize_runs(seconds, documents=len(documents))
+
+    failed = []
+
+    def extract_batches():
+        failed.clear()
+        for i in range(0, len(ids), params["batch_size"]):
+            result = index_and_extract_skills_batch(ids[i:i + params["batch_size"]])
+            failed.append(result["failed"] + result["bulk_errors"])
+
+    seconds = time_runs(extract_batches, repeat)
+    indexed = sum(len(docs) for docs in store.indices.values())
+    results["end_to_end"] = summarize_runs(seconds, documents=len(documents), bytes=n_bytes)
+    results["end_to_end"].update(failed=sum(failed), indexed=indexed)
+    if sum(failed) > 0 or indexed != len(documents):
+        app.logger.warning("{} documents failed, {} of {} indexed by the benchmark".format(
+            sum(failed), indexed, len(documents)))
+
+    return results
+
+
+def compare_results(result: dict, baseline: dict, max_regression=0.1) -> List[dict]:
+    """
+    Compare best seconds of each stage to a baseline result of the same params.
+    - **return**::
+        :return: for each stage of both, dict of stage, seconds, baseline seconds,
+            relative change and whether it is slower than max_regression
+    """
+
+    if result["params"] != baseline["params"] \
+            or result["version"]["suite"] != baseline["version"]["suite"]:
+        raise ValueError("Baseline was measured with other params or suite version")
+
+    comparisons = []
+    for stage, stage_result in result["results"].items():
+        if stage not in baseline["results"]:
+            continue
+        seconds = stage_result["seconds"]
+        baseline_seconds = baseline["results"][stage]["seconds"]
+        change = seconds / baseline_seconds - 1 if baseline_seconds > 0 else None
+        comparisons.append({"stage": stage, "seconds": seconds,
+                            "baseline_seconds": baseline_seconds, "change": change,
+                            "regression": change is not None and change > max_regression})
+    return comparisons
@@ -0,0 +1,173 @@
+# project/server/extractor/contents.py
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, List
+
+import PyPDF2
+from flask import current_app as app
+
+from project.server.models import Document
+from project.server.extractor.text_cache import hash_file, text_cache
+
+TEXT_READ_SIZE = 1024 * 1024  # characters read each time from text documents
+
+
+class ContentStream(object):
+    """
+    Pass parts (pages) of a document content through, count words and keep the
+    first max_length characters to index, so the whole content is never in memory.
+    """
+
+    def __init__(self, parts: Iterable[str], max_length: int = None):
+        self.parts = parts
+        self.max_length = max_length
+        self.n_words = 0
+        self.n_parts = 0
+        self.length = 0
+        self.kept = []
+        self.kept_length = 0
+        self._last_is_space = True
+
+    def __iter__(self) -> Iterator[str]:
+        for part in self.parts:
+            self.n_parts += 1
+            if len(part) == 0:
+                yield part
+                continue
+
+            self.length += len(part)
+            self.n_words += len(part.split())
+            # parts are joined without separator, a word may continue on the next part
+            if not self._last_is_space and not part[0].isspace():
+                self.n_words -= 1
+            self._last_is_space = part[-1].isspace()
+
+            if self.max_length is None or self.kept_length < self.max_length:
+                keep = part if self.max_length is None \
+                    else part[:self.max_length - self.kept_length]
+                self.kept.append(keep)
+                self.kept_length += len(keep)
+
+            yield part
+
+    def get_content(self) -> str:
+        """
+        Content read so far, at most max_length characters, None if nothing was read
+        """
+
+        if self.n_parts == 0:
+            return None
+        return "".join(self.kept)
+
+
+def get_document_path(document: Document) -> str:
+    path = document.path
+    if path is not None and not os.path.isabs(path):
+        path = os.path.join(app.instance_path, path)
+    return path
+
+
+def is_pdf(document: Document) -> bool:
+    return document.content_type.endswith("/pdf") or document.content_type.endswith("x-pdf")
+
+
+def iter_document_content(document: Document) -> Iterator[str]:
+    """
+    Read content of a document part by part: pages of pdf, chunks of text files.
+    Text of a file already parsed is read from text cache. Errors are logged and
+    stop the iteration.
+    """
+
+    path = get_document_path(document)
+
+    app.logger.debug('iter_document_content from {}'.format(path))
+
+    if path is None or not os.path.isabs(path):
+        return
+
+    try:
+        if not text_cache.enabled:
+            yield from iter_document_file_content(document, path)
+            return
+
+        content_hash = document.content_hash or hash_file(path)
+        cached_parts = text_cache.iter_text(content_hash)
+        if cached_parts is not None:
+            app.logger.debug('Read cached text of {}'.format(path))
+            yield from cached_parts
+        else:
+            yield from text_cache.write_through(
+                content_hash, iter_document_file_content(document, path))
+    except (IOError, FileNotFoundError) as e:
+        app.logger.warning("Error {}: Failed read file {}".format(
+            e.__class__.__name__, document.filename))
+
+
+def iter_document_file_content(document: Document, path) -> Iterator[str]:
+    if is_pdf(document):
+        yield from iter_document_content_by_PyPDF2(path)
+    else:
+        with open(path, "r") as f:
+            for chunk in iter(lambda: f.read(TEXT_READ_SIZE), ""):
+                yield chunk
+
+
+def iter_document_content_by_PyPDF2(path) -> Iterator[str]:
+    """
+    Read text of pdf pages in order. Pages of large documents are extracted by a
+    process pool, a few chunks of pages at once to bound memory.
+    """
+
+    app.logger.debug('iter_document_content_by_PyPDF2 from {}'.format(path))
+
+    with open(path, 'rb') as pdfFileObject:
+        pdfReader = PyPDF2.PdfFileReader(pdfFileObject)
+        count = pdfReader.numPages
+        app.logger.debug('Document has {} page'.format(count))
+
+        if count < app.config["PDF_PARALLEL_MIN_PAGES"]:
+            for i in range(count):
+                yield pdfReader.getPage(i).extractText()
+            return
+
+    yield from iter_pdf_pages_text_parallel(path, count)
+
+
+def iter_pdf_pages_text_parallel(path, count) -> Iterator[str]:
+    chunk_pages = app.config["PDF_PARALLEL_CHUNK_PAGES"]
+    max_workers = app.config["PDF_PARALLEL_WORKERS"] or os.cpu_count() or 1
+    ranges = [(start, min(start + chunk_pages, count)) for start in range(0, count, chunk_pages)]
+
+    n_done = 0  # chunks of pages yielded
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = []
+            next_range = 0
+            while n_done < len(ranges):
+                # At most 2 chunks for each worker are extracted or wait to be read
+                while next_range < len(ranges) and len(futures) < max_workers * 2:
+                    start, stop = ranges[next_range]
+                    futures.append(executor.submit(extract_pdf_pages_text, path, start, stop))
+                    next_range += 1
+
+                pages_text = futures.pop(0).result()
+                n_done += 1
+                yield from pages_text
+    except (AssertionError, OSError, BrokenProcessPool) as e:
+        # e.g. daemonic celery prefork children are not allowed to have children
+        app.logger.debug("Error {}: Extract pages of {} serially".format(
+            e.__class__.__name__, path))
+        for start, stop in ranges[n_done:]:
+            yield from extract_pdf_pages_text(path, start, stop)
+
+
+def extract_pdf_pages_text(path, start, stop) -> List[str]:
+    """
+    Text of pages [start, stop) of a pdf file, run in process pool workers
+    """
+
+    with open(path, 'rb') as pdfFileObject:
+        pdfReader = PyPDF2.PdfFileReader(pdfFileObject)
+        return [pdfReader.getPage(i).extractText() for i in range(start, stop)]
@@ -1,18 +1,33 @@
-import os
-import re
-from typing import List
+import datetime
+from typing import List, Tuple
 
 from flask import current_app as app
-from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import NotFoundError as ElasticsearchNotFoundError
-from project.server.extractor.ontologies import load_skill_nodes_from_rdf_resources
+from project.server import es_client
+from project.server.extractor.matcher import SkillMatcher
+from project.server.extractor.ontologies import Ontology, get_ontology, get_skills_resource_dir
+from project.server.extractor.parallel import count_in_content
 
 
 class SkillExtract(object):
-    def __init__(self, name, match_str, n_match):
+    def __init__(self, name, match_str, n_match, ontology_version=None):
         self.name = name
         self.match_str = match_str
         self.n_match = n_match
+        self.ontology_version = ontology_version
+
+
+class DocumentHit(object):
+    """
+    Document found by search, with its stored skills
+    """
+
+    def __init__(self, id, title, created_on, skills=None, score=None):
+        self.id = id
+        self.title = title
+        self.created_on = created_on
+        self.skills = skills
+        self.score = score
 
 
 def extract_skills_in_document(document_id) -> List[SkillExtract]:
@@ -22,24 +37,21 @@ def extract_skills_in_document(document_id) -> List[SkillExtract]:
         :return: List of SkillExtract or empty
     """
 
-    skills_resource_dir = os.path.join(app.root_path, "resources/ontologies")
-    skill_nodes = load_skill_nodes_from_rdf_resources(skills_resource_dir)
+    skills_resource_dir = get_skills_resource_dir()
+    ontology = get_ontology(skills_resource_dir)  # same version until the end
+    skill_matcher = ontology.skill_matcher
 
-    if len(skill_nodes) == 0:
+    if len(skill_matcher.skill_nodes) == 0:
         app.logger.debug("There is no skill to query")
         return []
 
-    result = set()
     es_index = app.config["ELASTICSEARCH_INDEX"]
 
-    skill_nodes = list(skill_nodes)  # set to list
+    skill_nodes = skill_matcher.skill_nodes
     skill_nodes_len = len(skill_nodes)
-    skill_nodes_dict = dict()  # dict by skill name/label to skill_node
-    for skill_node in skill_nodes:
-        skill_nodes_dict[skill_node.name] = skill_node
-        if skill_node.labels is not None:
-            for label in skill_node.labels:
-                skill_nodes_dict[label] = skill_node
+
+    content = None
+    matched_skills = []  # skills of pages which match the document
 
     page_index = 0
     page_size = 100
@@ -60,23 +72,11 @@ def extract_skills_in_document(document_id) -> List[SkillExtract]:
                             document_ids=[document_id])
 
         for doc in res['hits']['hits']:
-            content_lower = doc['_source']['content'].lower()
-            for skill in skills_page:
-                skill_node = skill_nodes_dict.get(skill)
-                regex = re.compile(r"\b{}\b".format(re.escape(skill.lower())))
-                n_match = len(regex.findall(content_lower))
-
-                if n_match > 0:
-                    if skill_node is not None and skill_node.type == "NamedIndividual":
-                        skill_extracts = [SkillExtract(
-                            name=parent, match_str=skill, n_match=n_match)
-                            for parent in skill_node.parents]
-                        result.update(skill_extracts)
-                    else:
-                        skill_extract = SkillExtract(name=skill, match_str=skill, n_match=n_match)
-                        result.add(skill_extract)
-
-    result = sorted(result, key=lambda item: item.n_match, reverse=True)
+            content = doc['_source']['content']
+            matched_skills.extend(skills_page)
+
+    result = match_skills_in_content(skill_matcher, content, skills=matched_skills,
+                                     ontology_version=ontology.version)
 
     skills_names = set(item.name for item in result)
     app.logger.debug("Extract {} skills on document id {}. Skills: {}".format(
@@ -85,10 +85,55 @@ def extract_skills_in_document(document_id) -> List[SkillExtract]:
     return result
 
 
+def extract_skills_in_content(content, ontology: Ontology = None) -> List[SkillExtract]:
+    """
+    Extract skill in content of a document without querying Elasticsearch,
+    content is a str or an iterable of str parts (pages) read one by one.
+    - **return**::
+        :return: List of SkillExtract or empty
+    """
+
+    if ontology is None:
+        skills_resource_dir = get_skills_resource_dir()
+        ontology = get_ontology(skills_resource_dir)
+
+    if len(ontology.skill_nodes) == 0:
+        app.logger.debug("There is no skill to match")
+        return []
+
+    return match_skills_in_content(ontology.skill_matcher, content,
+                                   ontology_version=ontology.version)
+
+
+def match_skills_in_content(skill_matcher: SkillMatcher, content,
+                            skills: List[str] = None,
+                            ontology_version=None) -> List[SkillExtract]:
+    """
+    Match skills in content by one scan and return founded skills.
+    - **return**::
+        :return: List of SkillExtract or empty
+    """
+
+    result = []
+    counts = count_in_content(skill_matcher, content)
+    for skill, n_match in skill_matcher.match_counts(counts, terms=skills):
+        skill_node = skill_matcher.term_nodes.get(skill)
+        if skill_node is not None and skill_node.type == "NamedIndividual":
+            skill_extracts = [SkillExtract(
+                name=parent, match_str=skill, n_match=n_match, ontology_version=ontology_version)
+                for parent in skill_node.parents]
+            result.extend(skill_extracts)
+        else:
+            skill_extract = SkillExtract(name=skill, match_str=skill, n_match=n_match,
+                                         ontology_version=ontology_version)
+            result.append(skill_extract)
+
+    return sorted(result, key=lambda item: item.n_match, reverse=True)
+
+
 def search_skills(skills: List[str], index="prod-index", doc_type="document",
                   default_field="content", document_ids: List = None):
-    es_host = app.config["ELASTICSEARCH_HOST"]
-    es = Elasticsearch(es_host)
+    es = es_client.get_client()
 
     strs_quoted = []
     # quotes for query exactly word
@@ -119,8 +164,7 @@ def search_skills(skills: List[str], index="prod-index", doc_type="document",
 
 def exists_skill(skill: str, document_id, index="prod-index", doc_type="document",
                  default_field="content") -> bool:
-    es_host = app.config["ELASTICSEARCH_HOST"]
-    es = Elasticsearch(es_host)
+    es = es_client.get_client()
 
     # quotes for query exactly word
     str_quoted = skill.translate(str.maketrans('"', '\"'))
@@ -146,7 +190,8 @@ def exists_skill(skill: str, document_id, index="prod-index", doc_type="document
 
 
 def search_index_content(q: str, offset=0, limit=50) -> List[str]:
-    """Search document from index.
+    """Search document from index by full text of title and content, or
+    substring of them on their n-gram fields.
 
     Returns
     -------
@@ -157,25 +202,83 @@ def search_index_content(q: str, offset=0, limit=50) -> List[str]:
     if len(q) == 0:
         return list()
 
-    es_host = app.config["ELASTICSEARCH_HOST"]
-    index = app.config["ELASTICSEARCH_INDEX"]
+    return search_index_ids(build_content_query(q), offset=offset, limit=limit)
 
-    es = Elasticsearch(es_host)
-    result = list()
+
+def search_index_content_by_wildcard(q: str, offset=0, limit=50) -> List[str]:
+    """Search document from index by *q* query string, as before n-gram fields.
+    Kept to compare latency.
+
+    Returns
+    -------
+    list
+        a list of document id or empty.
+    """
+
+    if len(q) == 0:
+        return list()
 
     q = q.replace("*", r"\*")
     q = "*{}*".format(q)
 
+    return search_index_ids({
+        "query_string": {
+            "query": q,
+            "fields": ["title", "content"]
+        }
+    }, offset=offset, limit=limit)
+
+
+def build_content_query(q: str) -> dict:
+    """
+    Query documents whose title or content contain q as words, ranked by relevance,
+    or as substring. Substring needs at least 3 characters (trigram fields).
+    """
+
+    should = [{
+        "multi_match": {
+            "query": q,
+            "fields": ["title^2", "content"]
+        }
+    }]
+
+    if len(q) >= 3:
+        # Consecutive trigrams of q, same as q is a substring
+        should.append({
+            "multi_match": {
+                "query": q,
+                "type": "phrase",
+                "fields": ["title.ngram^2", "content.ngram"]
+            }
+        })
+    else:
+        should.append({
+            "multi_match": {
+                "query": q,
+                "type": "phrase_prefix",
+                "fields": ["title^2", "content"]
+            }
+        })
+
+    return {
+        "bool": {
+            "should": should,
+            "minimum_should_match": 1
+        }
+    }
+
+
+def search_index_ids(query: dict, offset=0, limit=50) -> List[str]:
+    index = app.config["ELASTICSEARCH_INDEX"]
+
+    es = es_client.get_client()
+    result = list()
+
     try:
         res = es.search(index=index, body={
             "from": offset, "size": limit,
-            "_source": ["_id"],
-            "query": {
-                "query_string": {
-                    "query": q,
-                    "fields": ["title", "content"]
-                }
-            }
+            "_source": False,
+            "query": query
         })
 
         for doc in res['hits']['hits']:
@@ -187,5 +290,155 @@ def search_index_content(q: str, offset=0, limit=50) -> List[str]:
     return result
 
 
+def search_user_documents(q: str, user_id, size=50,
+                          after: str = None) -> Tuple[List[DocumentHit], str]:
+    """
+    Search documents of a user by content, most relevant first. The user is a filter
+    of the query, so it is cached by Elasticsearch and only documents of the user are scored.
+    Pages follow each other by search_after cursor, skills come with the hits.
+    - **return**::
+        :return: (hits, cursor of next page or None)
+    """
+
+    if len(q) == 0:
+        return [], None
+
+    index = app.config["ELASTICSEARCH_INDEX"]
+    body = {
+        "size": size,
+        "_source": ["title", "created_on", "skills"],
+        "query": {
+            "bool": {
+                "must": build_content_query(q),
+                "filter": [{"term": {"created_by": user_id}}]
+            }
+        },
+        "sort": [{"_score": "desc"}, {"id": "desc"}]
+    }
+    search_after = parse_search_cursor(after)
+    if search_after is not None:
+        body["search_after"] = search_after
+
+    es = es_client.get_client()
+    hits = []
+    try:
+        res = es.search(index=index, body=body)
+    except ElasticsearchNotFoundError as ex:
+        app.logger.warning("{}. Elasticsearch is not start or index has not created yet".format(ex))
+        return hits, None
+
+    for doc in res['hits']['hits']:
+        source = doc['_source']
+        hits.append(DocumentHit(id=int(doc["_id"]), title=source.get("title"),
+                                created_on=parse_index_datetime(source.get("created_on")),
+                                skills=source.get("skills"), score=doc["sort"][0]))
+
+    next_cursor = None
+    if len(hits) == size:
+        next_cursor = format_search_cursor(res['hits']['hits'][-1]["sort"])
+    return hits, next_cursor
+
+
+def format_search_cursor(sort_values: List) -> str:
+    return "{!r}_{}".format(float(sort_values[0]), int(sort_values[1]))
+
+
+def parse_search_cursor(cursor: str) -> List:
+    """
+    [score, id] of a search cursor, None if cursor is empty or invalid
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        score, id = cursor.rsplit("_", 1)
+        return [float(score), int(id)]
+    except ValueError:
+        app.logger.debug("Invalid search cursor {}".format(cursor))
+        return None
+
+
+def parse_index_datetime(value: str) -> datetime.datetime:
+    if value is None:
+        return None
+
+    for date_format in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    return value
+
+
+def build_skills_aggregations_body(user_id=None, skill: str = None, size=20,
+                                   after: str = None) -> dict:
+    """
+    Search body counting documents by skill: "skills" on the ranked top skills,
+    "extracted_skills" on all extracted skills, and "all_skills" pages of every
+    extracted skill by name. Documents are of a user if user_id is passed, and have
+    the skill if skill is passed (co-occurrence with the skill).
+    """
+
+    filters = []
+    if user_id is not None:
+        filters.append({"term": {"created_by": user_id}})
+    if skill is not None:
+        filters.append({"term": {"skill_extracts.name.keyword": skill}})
+
+    composite = {
+        "size": size,
+        "sources": [{"skill": {"terms": {"field": "skill_extracts.name.keyword"}}}]
+    }
+    if after is not None:
+        composite["after"] = {"skill": after}
+
+    exclude = [skill] if skill is not None else []
+    return {
+        "size": 0,
+        "query": {"bool": {"filter": filters}},
+        "aggs": {
+            "skills": {"terms": {"field": "skills.keyword", "size": size,
+                                 "exclude": exclude}},
+            "extracted_skills": {"terms": {"field": "skill_extracts.name.keyword", "size": size,
+                                           "exclude": exclude}},
+            "all_skills": {"composite": composite}
+        }
+    }
+
+
+def aggregate_index_skills(user_id=None, skill: str = None, size=20, after: str = None) -> dict:
+    """
+    Count documents by skill on Elasticsearch.
+    - **return**::
+        :return: dict of skills, extracted_skills and all_skills lists of {name, documents},
+            after is the skill to continue all_skills from, None at the end
+    """
+
+    index = app.config["ELASTICSEARCH_INDEX"]
+    body = build_skills_aggregations_body(user_id=user_id, skill=skill, size=size, after=after)
+
+    es = es_client.get_client()
+    result = {"skills": [], "extracted_skills": [], "all_skills": [], "after": None}
+    try:
+        res = es.search(index=index, body=body)
+    except ElasticsearchNotFoundError as ex:
+        app.logger.warning("{}. Elasticsearch is not start or index has not created yet".format(ex))
+        return result
+
+    aggregations = res["aggregations"]
+    for name in ("skills", "extracted_skills"):
+        result[name] = [{"name": bucket["key"], "documents": bucket["doc_count"]}
+                        for bucket in aggregations[name]["buckets"]]
+
+    all_skills = aggregations["all_skills"]
+    result["all_skills"] = [{"name": bucket["key"]["skill"], "documents": bucket["doc_count"]}
+                            for bucket in all_skills["buckets"]]
+    if len(all_skills["buckets"]) == size and "after_key" in all_skills:
+        result["after"] = all_skills["after_key"]["skill"]
+
+    return result
+
+
 if __name__ == "__main__":
     extract_skills_in_document(65)
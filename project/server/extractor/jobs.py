@@ -0,0 +1,184 @@
+# project/server/extractor/jobs.py
+
+import time
+import datetime
+from typing import Iterable, Iterator, List, Tuple
+
+from flask import current_app as app
+from sqlalchemy import and_, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from project.server import db
+from project.server.models import Document, DocumentJob
+from project.server.metrics import jobs_total, queue_wait_seconds
+
+FINAL_STATES = set([DocumentJob.INDEXED, DocumentJob.FAILED])
+STATE_TIME_COLUMNS = {
+    DocumentJob.QUEUED: "queued_on",
+    DocumentJob.PARSING: "parsing_on",
+    DocumentJob.MATCHING: "matching_on",
+    DocumentJob.INDEXED: "finished_on",
+    DocumentJob.FAILED: "finished_on",
+}
+CURSOR_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def set_jobs_state(document_ids: Iterable[int], state: str, error: str = None):
+    """
+    Set the state of the jobs of documents by its own connection and transaction, so
+    states are visible while the task's session is not committed yet. Jobs of documents
+    uploaded before jobs were tracked are created. Errors are logged only, a job state
+    never fails the extraction.
+    """
+
+    document_ids = list(set(id for id in document_ids if id is not None))
+    if len(document_ids) == 0:
+        return
+
+    now = datetime.datetime.now()
+    values = {"state": state, "error": error, "updated_on": now, STATE_TIME_COLUMNS[state]: now}
+    if state == DocumentJob.QUEUED:
+        values.update(parsing_on=None, matching_on=None, finished_on=None)
+
+    table = DocumentJob.__table__
+    try:
+        with db.engine.begin() as connection:
+            if state == DocumentJob.PARSING:
+                # Queue wait of jobs which start now
+                for row in connection.execute(select([table.c.queued_on]).where(and_(
+                        table.c.document_id.in_(document_ids),
+                        table.c.state == DocumentJob.QUEUED))):
+                    queue_wait_seconds.observe(max(0, (now - row[0]).total_seconds()))
+
+            jobs_total.inc(len(document_ids), state=state)
+            result = connection.execute(table.update().where(
+                table.c.document_id.in_(document_ids)).values(**values))
+            if result.rowcount >= len(document_ids):
+                return
+
+            existing = set(row[0] for row in connection.execute(select([table.c.document_id])
+                           .where(table.c.document_id.in_(document_ids))))
+            connection.execute(table.insert(), [
+                dict(values, document_id=id, queued_on=values.get("queued_on", now))
+                for id in document_ids if id not in existing])
+    except SQLAlchemyError as e:
+        app.logger.warning("Error {}: Failed set jobs of documents {} {}: {}".format(
+            e.__class__.__name__, document_ids, state, e))
+
+
+def iter_marking_matching(document_id: int, parts: Iterable[str]) -> Iterator[str]:
+    """
+    Pass parts of a document content through, its job is matching from the first part
+    since parts are matched as they are parsed
+    """
+
+    first = True
+    for part in parts:
+        if first:
+            set_jobs_state([document_id], DocumentJob.MATCHING)
+            first = False
+        yield part
+
+
+def find_jobs(document_ids: List[int], user_id=None) -> List[DocumentJob]:
+    """
+    Jobs of the documents, of a user if user_id is passed
+    """
+
+    if len(document_ids) == 0:
+        return []
+
+    query = DocumentJob.query.filter(DocumentJob.document_id.in_(document_ids))
+    if user_id is not None:
+        query = query.join(Document, Document.id == DocumentJob.document_id) \
+            .filter(Document.created_by == user_id)
+    return query.order_by(DocumentJob.document_id).all()
+
+
+def wait_for_jobs(document_ids: List[int], user_id=None, since: datetime.datetime = None,
+                  timeout: float = 0) -> Tuple[List[DocumentJob], datetime.datetime]:
+    """
+    Long poll jobs of documents: poll them every JOB_STATUS_POLL_INTERVAL seconds until
+    one was updated after since, all of them are finished, or timeout seconds.
+    - **return**::
+        :return: all jobs, and the last update time of them to pass as since of the next call
+    """
+
+    deadline = time.time() + timeout
+    while True:
+        jobs = find_jobs(document_ids, user_id=user_id)
+        cursor = max([job.updated_on for job in jobs], default=since)
+        if since is None or (cursor is not None and cursor > since) \
+                or all(job.state in FINAL_STATES for job in jobs) or time.time() >= deadline:
+            return jobs, cursor
+
+        # End the transaction, so the next poll reads states committed by workers
+        db.session.rollback()
+        time.sleep(min(app.config["JOB_STATUS_POLL_INTERVAL"], max(0, deadline - time.time())))
+
+
+def iter_job_events(document_ids: List[int], user_id=None, since: datetime.datetime = None,
+                    timeout: float = 0) -> Iterator[Tuple[List[DocumentJob], datetime.datetime]]:
+    """
+    Yield (jobs updated after since, cursor) each time jobs are updated, until all
+    of them are finished or timeout seconds
+    """
+
+    deadline = time.time() + timeout
+    while True:
+        jobs, cursor = wait_for_jobs(document_ids, user_id=user_id, since=since,
+                                     timeout=max(0, deadline - time.time()))
+        updated = [job for job in jobs if since is None or job.updated_on > since]
+        if len(updated) > 0:
+            yield updated, cursor
+        since = cursor
+
+        if all(job.state in FINAL_STATES for job in jobs) or time.time() >= deadline:
+            return
+        db.session.rollback()
+
+
+def format_jobs_cursor(updated_on: datetime.datetime) -> str:
+    if updated_on is None:
+        return None
+    return updated_on.strftime(CURSOR_DATETIME_FORMAT)
+
+
+def parse_jobs_cursor(cursor: str) -> datetime.datetime:
+    """
+    Update time of a jobs cursor, None if cursor is empty or invalid
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        return datetime.datetime.strptime(cursor, CURSOR_DATETIME_FORMAT)
+    except ValueError:
+        app.logger.debug("Invalid jobs cursor {}".format(cursor))
+        return None
+
+
+def job_to_dict(job: DocumentJob) -> dict:
+    """
+    State of a job with the seconds it spent in each state, None for states not reached
+    """
+
+    def seconds(start, end):
+        if start is None or end is None:
+            return None
+        return (end - start).total_seconds()
+
+    return {
+        "document_id": job.document_id,
+        "state": job.state,
+        "error": job.error,
+        "queued_on": job.queued_on.isoformat(),
+        "updated_on": job.updated_on.isoformat(),
+        "timings": {
+            "queued": seconds(job.queued_on, job.parsing_on),
+            "parsing": seconds(job.parsing_on, job.matching_on),
+            "matching": seconds(job.matching_on or job.parsing_on, job.finished_on),
+            "total": seconds(job.queued_on, job.finished_on),
+        }
+    }
@@ -0,0 +1,152 @@
+# project/server/extractor/mappings.py
+
+from flask import current_app as app
+
+from project.server import es_client
+
+# Increase when INDEX_SETTINGS or INDEX_MAPPINGS change, then run manage.py migrate-index
+INDEX_MAPPING_VERSION = 1
+
+INDEX_SETTINGS = {
+    "analysis": {
+        "tokenizer": {
+            "trigram": {
+                "type": "ngram",
+                "min_gram": 3,
+                "max_gram": 3,
+                "token_chars": ["letter", "digit"]
+            }
+        },
+        "analyzer": {
+            "trigram": {
+                "type": "custom",
+                "tokenizer": "trigram",
+                "filter": ["lowercase"]
+            }
+        }
+    }
+}
+
+# Fields "ngram" are for substring search, main fields for full text relevance
+INDEX_MAPPINGS = {
+    "document": {
+        "properties": {
+            "id": {"type": "long"},
+            "title": {
+                "type": "text",
+                "fields": {
+                    "ngram": {"type": "text", "analyzer": "trigram"}
+                }
+            },
+            "content": {
+                "type": "text",
+                "fields": {
+                    "ngram": {"type": "text", "analyzer": "trigram"}
+                }
+            },
+            "content_type": {"type": "keyword"},
+            "created_on": {"type": "date"},
+            "created_by": {"type": "long"},
+            "n_words": {"type": "long"},
+            "ontology_version": {"type": "keyword"},
+            "skills": {
+                "type": "text",
+                "fields": {
+                    "keyword": {"type": "keyword", "ignore_above": 256}
+                }
+            },
+            "skill_extracts": {
+                "properties": {
+                    "name": {
+                        "type": "text",
+                        "fields": {
+                            "keyword": {"type": "keyword", "ignore_above": 256}
+                        }
+                    },
+                    "match_str": {"type": "keyword", "ignore_above": 256},
+                    "n_match": {"type": "long"},
+                    "ontology_version": {"type": "keyword"}
+                }
+            },
+            "skill_extracts_exception": {"type": "text"}
+        }
+    }
+}
+
+checked_indexes = set()  # aliases known to exist in this process
+
+
+def get_versioned_index(alias, version=INDEX_MAPPING_VERSION) -> str:
+    return "{}-v{}".format(alias, version)
+
+
+def create_index(index, alias=None):
+    es = es_client.get_client()
+    body = {
+        "settings": INDEX_SETTINGS,
+        "mappings": INDEX_MAPPINGS
+    }
+    if alias is not None:
+        body["aliases"] = {alias: {}}
+    es.indices.create(index=index, body=body, include_type_name=True)
+
+
+def ensure_index(alias=None):
+    """
+    Create the index of ELASTICSEARCH_INDEX with the app mappings if it does not exist yet,
+    so the first write does not create it with dynamic mappings
+    """
+
+    if alias is None:
+        alias = app.config["ELASTICSEARCH_INDEX"]
+    if alias in checked_indexes:
+        return
+
+    es = es_client.get_client()
+    if not es.indices.exists(index=alias):
+        app.logger.info("Create index {} for {}".format(get_versioned_index(alias), alias))
+        create_index(get_versioned_index(alias), alias=alias)
+
+    checked_indexes.add(alias)
+
+
+def migrate_index(alias=None) -> str:
+    """
+    Create the index of current mapping version, copy documents of ELASTICSEARCH_INDEX to it
+    by the reindex API, then point ELASTICSEARCH_INDEX to it. Documents written during
+    the copy are not copied.
+    - **return**::
+        :return: name of the new index, None if ELASTICSEARCH_INDEX is up to date
+    """
+
+    if alias is None:
+        alias = app.config["ELASTICSEARCH_INDEX"]
+    target = get_versioned_index(alias)
+
+    es = es_client.get_client()
+    if es.indices.exists_alias(name=alias, index=target):
+        return None
+
+    actions = []
+    if es.indices.exists(index=alias):
+        if not es.indices.exists(index=target):
+            create_index(target)
+
+        app.logger.info("Reindex {} to {}".format(alias, target))
+        es.reindex(body={"source": {"index": alias}, "dest": {"index": target}},
+                   wait_for_completion=True, refresh=True, request_timeout=24 * 3600)
+
+        if es.indices.exists_alias(name=alias):
+            for index in es.indices.get_alias(name=alias):
+                actions.append({"remove": {"index": index, "alias": alias}})
+        else:
+            # Index created before mappings were managed, replace it by the alias
+            actions.append({"remove_index": {"index": alias}})
+    elif not es.indices.exists(index=target):
+        create_index(target)
+
+    actions.append({"add": {"index": target, "alias": alias}})
+    es.indices.update_aliases(body={"actions": actions})
+    checked_indexes.add(alias)
+
+    return target
@@ -0,0 +1,221 @@
+# project/server/extractor/matcher.py
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+def is_word_char(ch: str) -> bool:
+    """
+    Same definition of word character as regex \\w on str patterns
+    """
+
+    return ch.isalnum() or ch == "_"
+
+
+class SkillMatcher(object):
+    """
+    Aho-Corasick automaton over every skill name and label of the ontology.
+
+    Find all skills in a text by one pass, with the same result as running
+    re.findall(r"\\b<skill>\\b") for each skill on the lowercased text.
+    """
+
+    def __init__(self, skill_nodes: Iterable):
+        self.skill_nodes = list(skill_nodes)
+
+        # Skill names and labels in ontology order, duplicates are kept like the
+        # regex scan which run one time for each of them
+        self.terms = []
+        self.term_nodes = dict()  # dict by skill name/label to skill_node
+        for skill_node in self.skill_nodes:
+            self.terms.append(skill_node.name)
+            self.term_nodes[skill_node.name] = skill_node
+            if skill_node.labels is not None:
+                for label in skill_node.labels:
+                    self.terms.append(label)
+                    self.term_nodes[label] = skill_node
+
+        self.patterns = []  # distinct lowercase patterns
+        pattern_ids = dict()
+        for term in self.terms:
+            pattern = term.lower()
+            if len(pattern) > 0 and pattern not in pattern_ids:
+                pattern_ids[pattern] = len(self.patterns)
+                self.patterns.append(pattern)
+        self.pattern_ids = pattern_ids
+
+        self.pattern_lens = [len(p) for p in self.patterns]
+        self.pattern_word_start = [is_word_char(p[0]) for p in self.patterns]
+        self.pattern_word_end = [is_word_char(p[-1]) for p in self.patterns]
+
+        self._build_automaton()
+
+    def _build_automaton(self):
+        goto = [dict()]
+        outputs = [[]]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append(dict())
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(pattern_id)
+
+        # Breadth first to set fail links, output of a state includes output of its fail state
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        i = 0
+        while i < len(queue):
+            state = queue[i]
+            i += 1
+            for ch, next_state in goto[state].items():
+                queue.append(next_state)
+                f = fail[state]
+                while f != 0 and ch not in goto[f]:
+                    f = fail[f]
+                fail_state = goto[f].get(ch, 0)
+                fail[next_state] = fail_state if fail_state != next_state else 0
+                outputs[next_state].extend(outputs[fail[next_state]])
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = [tuple(output) for output in outputs]
+
+    def count(self, content) -> Dict[str, int]:
+        """
+        Count matches of each lowercase pattern in content, content is a str or
+        an iterable of str parts (pages) which are matched as they were joined.
+        - **return**::
+            :return: dict by lowercase pattern to number of match, only patterns found
+        """
+
+        if not content or len(self.patterns) == 0:
+            return dict()
+        if isinstance(content, str):
+            content = [content]
+
+        counts = dict()
+        last_ends = dict()  # non-overlapping matches per pattern as re.findall
+        word_end = self.pattern_word_end
+        for pattern_id, start, end, after in self._iter_candidates(content):
+            # \b at end of the match
+            if after == word_end[pattern_id]:
+                continue
+            if start < last_ends.get(pattern_id, 0):
+                continue
+            last_ends[pattern_id] = end
+            counts[pattern_id] = counts.get(pattern_id, 0) + 1
+
+        return dict((self.patterns[pattern_id], n) for pattern_id, n in counts.items())
+
+    def find_starts(self, text: str, offset=0, start=0, stop=None) -> Dict[int, List[int]]:
+        """
+        Positions of matches in a chunk of a lowercase content, overlapping matches
+        included. text begins at position offset of the content, and must hold one
+        character before start (unless start is 0) and the longest pattern plus one
+        character after stop (unless stop is the end of the content).
+        - **return**::
+            :return: dict by pattern id to sorted start positions in [start, stop)
+        """
+
+        result = dict()
+        if not text or len(self.patterns) == 0:
+            return result
+
+        word_end = self.pattern_word_end
+        for pattern_id, match_start, end, after in self._iter_candidates([text]):
+            match_start += offset
+            if after == word_end[pattern_id] or match_start < start \
+                    or (stop is not None and match_start >= stop):
+                continue
+            result.setdefault(pattern_id, []).append(match_start)
+        return result
+
+    def _iter_candidates(self, content: Iterable[str]) -> Iterator[Tuple[int, int, int, bool]]:
+        """
+        (pattern id, start, end, whether the next character is a word character) of
+        each occurrence of a pattern with \\b before it, in order of end
+        """
+
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        lens = self.pattern_lens
+        word_start = self.pattern_word_start
+        tail_len = max(lens)
+
+        state = 0
+        offset = 0  # position of text in the whole content
+        tail = ""  # end of previous parts, to check \b before a match
+        pending = []  # matches at end of previous part, wait for the next character
+        for part in content:
+            if not part:
+                continue
+            text = part.lower()
+            text_len = len(text)
+
+            if pending:
+                after = is_word_char(text[0])
+                for pattern_id, start, end in pending:
+                    yield pattern_id, start, end, after
+                pending = []
+
+            buffer = tail + text
+            base = offset - len(tail)  # position of buffer in the whole content
+            for i, ch in enumerate(text):
+                next_state = goto[state].get(ch)
+                while next_state is None and state != 0:
+                    state = fail[state]
+                    next_state = goto[state].get(ch)
+                state = 0 if next_state is None else next_state
+
+                found = outputs[state]
+                if not found:
+                    continue
+
+                end = offset + i + 1
+                for pattern_id in found:
+                    start = end - lens[pattern_id]
+                    # \b at start of the match
+                    before = start > 0 and is_word_char(buffer[start - 1 - base])
+                    if before == word_start[pattern_id]:
+                        continue
+                    if i + 1 < text_len:
+                        yield pattern_id, start, end, is_word_char(text[i + 1])
+                    else:
+                        pending.append((pattern_id, start, end))
+
+            offset += text_len
+            tail = buffer[-tail_len:]
+
+        for pattern_id, start, end in pending:
+            yield pattern_id, start, end, False
+
+    def match(self, content, terms: Iterable[str] = None) -> List[Tuple[str, int]]:
+        """
+        Match skill names and labels in content, a str or an iterable of str parts.
+        - **return**::
+            :return: List of (term, number of match) which number of match > 0
+        """
+
+        return self.match_counts(self.count(content), terms=terms)
+
+    def match_counts(self, counts: Dict[str, int],
+                     terms: Iterable[str] = None) -> List[Tuple[str, int]]:
+        """
+        (term, number of match) of counts by lowercase pattern, as match
+        """
+
+        if terms is None:
+            terms = self.terms
+
+        result = []
+        for term in terms:
+            n_match = counts.get(term.lower(), 0)
+            if n_match > 0:
+                result.append((term, n_match))
+        return result
@@ -1,7 +1,11 @@
 # project/server/extractor/ontologies.py
 
-from os import listdir
-from os.path import isfile, join
+import hashlib
+import pickle
+import threading
+import time
+from os import getpid, listdir, makedirs, remove, replace, stat
+from os.path import basename, isabs, isfile, join
 
 from flask import current_app as app
 
@@ -9,9 +13,14 @@ import rdflib
 from rdflib.namespace import OWL, RDF, RDFS, ClosedNamespace
 from rdflib import URIRef, Graph
 
-from typing import Iterable, Set
+from typing import Iterable, List, Set, Tuple
 
-skill_nodes_cache = None
+from project.server.metrics import stage_seconds
+from project.server.extractor.matcher import SkillMatcher
+
+ontology_registries = dict()  # dict by resource directory to OntologyRegistry
+
+ONTOLOGY_ARTIFACT_VERSION = 1  # increase when OntNode or SkillMatcher change
 
 
 class OntNode(object):
@@ -33,18 +42,130 @@ class OntNode(object):
             return self.name
 
 
+class Ontology(object):
+    """
+    Skills of the ontology files at one version, version is the hash of the files
+    """
+
+    def __init__(self, version, skill_matcher: SkillMatcher):
+        self.version = version
+        self.skill_matcher = skill_matcher
+
+    @property
+    def skill_nodes(self) -> List[OntNode]:
+        return self.skill_matcher.skill_nodes
+
+
+class OntologyRegistry(object):
+    """
+    Current ontology of a resource directory. Ontology files are checked for changes
+    at most every ONTOLOGY_CHECK_INTERVAL seconds, then the ontology is reloaded in
+    background and replaced. Callers keep using the Ontology they got until they finish.
+    """
+
+    def __init__(self, skills_resource_dir):
+        self.skills_resource_dir = skills_resource_dir
+        self.ontology = None
+        self._signature = None
+        self._checked_at = 0
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    def get(self) -> Ontology:
+        if self.ontology is None:
+            with self._lock:
+                if self.ontology is None:
+                    self._signature = get_ontology_files_signature(self.skills_resource_dir)
+                    self._checked_at = time.time()
+                    with stage_seconds.time(stage="ontology_load"):
+                        self.ontology = load_ontology(self.skills_resource_dir)
+            return self.ontology
+
+        check_interval = app.config["ONTOLOGY_CHECK_INTERVAL"]
+        if check_interval >= 0 and time.time() - self._checked_at >= check_interval:
+            self.check()
+
+        return self.ontology
+
+    def check(self):
+        """
+        Start reload in background if ontology files were changed
+        """
+
+        with self._lock:
+            if self._reloading:
+                return
+            self._checked_at = time.time()
+            signature = get_ontology_files_signature(self.skills_resource_dir)
+            if signature == self._signature:
+                return
+            self._reloading = True
+
+        thread = threading.Thread(target=self.reload, args=(app._get_current_object(), signature))
+        thread.daemon = True
+        thread.start()
+
+    def reload(self, flask_app, signature):
+        try:
+            with flask_app.app_context():
+                with stage_seconds.time(stage="ontology_load"):
+                    ontology = load_ontology(self.skills_resource_dir)
+                if self.ontology is None or ontology.version != self.ontology.version:
+                    app.logger.info("Reload ontology {} version {}".format(
+                        self.skills_resource_dir, ontology.version))
+                self.ontology = ontology
+                self._signature = signature
+        except Exception as e:
+            flask_app.logger.warning("Error {}: Failed reload ontology {}: {}".format(
+                e.__class__.__name__, self.skills_resource_dir, e))
+        finally:
+            self._reloading = False
+
+
+def get_ontology(skills_resource_dir) -> Ontology:
+    """
+    Current ontology of resource directory, reloaded when its files change
+    """
+
+    registry = ontology_registries.get(skills_resource_dir)
+    if registry is None:
+        registry = ontology_registries.setdefault(
+            skills_resource_dir, OntologyRegistry(skills_resource_dir))
+    return registry.get()
+
+
 def load_skill_nodes_from_rdf_resources(skills_resource_dir) -> Set[OntNode]:
     """
     Load skills in rdf format from resource directory and return as list node
     """
 
-    global skill_nodes_cache
-    if skill_nodes_cache is not None:
-        return skill_nodes_cache
+    return set(get_ontology(skills_resource_dir).skill_nodes)
+
+
+def load_skill_matcher_from_rdf_resources(skills_resource_dir) -> SkillMatcher:
+    """
+    Skill matcher of the current ontology of resource directory
+    """
+
+    return get_ontology(skills_resource_dir).skill_matcher
+
 
+def get_ontology_files_signature(skills_resource_dir) -> Tuple:
+    """
+    Names, sizes and modified times of ontology files, cheap to check for changes
+    """
+
+    signature = []
+    for ont_file in list_ontology_files(skills_resource_dir):
+        stat_result = stat(ont_file)
+        signature.append((ont_file, stat_result.st_size, stat_result.st_mtime_ns))
+    return tuple(signature)
+
+
+def list_ontology_files(skills_resource_dir) -> List[str]:
     ont_files = []
     try:
-        for f in listdir(skills_resource_dir):
+        for f in sorted(listdir(skills_resource_dir)):
             f_path = join(skills_resource_dir, f)
             if isfile(f_path) and f_path.endswith(".ttl"):
                 ont_files.append(f_path)
@@ -52,9 +173,122 @@ def load_skill_nodes_from_rdf_resources(skills_resource_dir) -> Set[OntNode]:
         app.logger.info("Please copy *.ttl file to directory {}".format(skills_resource_dir))
         raise
 
+    return ont_files
+
+
+def hash_ontology_files(ont_files: List[str]) -> str:
+    """
+    Hash of names and contents of ontology files, the compiled ontology is rebuilt
+    when it changes
+    """
+
+    sha256 = hashlib.sha256(str(ONTOLOGY_ARTIFACT_VERSION).encode("utf-8"))
+    for ont_file in ont_files:
+        sha256.update(basename(ont_file).encode("utf-8"))
+        with open(ont_file, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_skills_resource_dir() -> str:
+    resource_dir = app.config["ONTOLOGY_RESOURCE_FOLDER"]
+    if not isabs(resource_dir):
+        resource_dir = join(app.root_path, resource_dir)
+    return resource_dir
+
+
+def get_ontology_artifact_dir() -> str:
+    artifact_dir = app.config["ONTOLOGY_ARTIFACT_FOLDER"]
+    if not isabs(artifact_dir):
+        artifact_dir = join(app.instance_path, artifact_dir)
+    return artifact_dir
+
+
+def get_ontology_artifact_path(artifact_dir, source_hash) -> str:
+    return join(artifact_dir, "ontology-{}.pickle".format(source_hash))
+
+
+def load_ontology(skills_resource_dir, artifact_dir=None) -> Ontology:
+    """
+    Load ontology from the compiled ontology of resource directory,
+    compile ontology files if they were changed or never compiled
+    """
+
+    ont_files = list_ontology_files(skills_resource_dir)
     if len(ont_files) == 0:
         app.logger.debug("Ontology (.ttl) files is not found")
-        return set()
+        return Ontology(None, SkillMatcher([]))
+
+    if artifact_dir is None:
+        artifact_dir = get_ontology_artifact_dir()
+
+    source_hash = hash_ontology_files(ont_files)
+    artifact_path = get_ontology_artifact_path(artifact_dir, source_hash)
+
+    if isfile(artifact_path):
+        try:
+            with open(artifact_path, "rb") as f:
+                artifact = pickle.load(f)
+            if artifact["version"] == ONTOLOGY_ARTIFACT_VERSION \
+                    and artifact["hash"] == source_hash:
+                app.logger.debug("Load compiled ontology {}".format(artifact_path))
+                return Ontology(source_hash, artifact["matcher"])
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError,
+                KeyError, TypeError) as e:
+            app.logger.warning("Error {}: Failed load compiled ontology {}".format(
+                e.__class__.__name__, artifact_path))
+
+    artifact_path, ontology = compile_ontology(skills_resource_dir, artifact_dir)
+    return ontology
+
+
+def compile_ontology(skills_resource_dir, artifact_dir=None) -> Tuple[str, Ontology]:
+    """
+    Parse ontology files of resource directory and save nodes with the skill matcher
+    built from them, to a file named by hash of the ontology files
+    - **return**::
+        :return: path of the compiled ontology, None if it could not be saved, and ontology
+    """
+
+    ont_files = list_ontology_files(skills_resource_dir)
+    if artifact_dir is None:
+        artifact_dir = get_ontology_artifact_dir()
+
+    source_hash = hash_ontology_files(ont_files)
+    skill_matcher = SkillMatcher(parse_skill_nodes(ont_files))
+    artifact = {
+        "version": ONTOLOGY_ARTIFACT_VERSION,
+        "hash": source_hash,
+        "matcher": skill_matcher
+    }
+
+    artifact_path = get_ontology_artifact_path(artifact_dir, source_hash)
+    try:
+        makedirs(artifact_dir, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(artifact_path, getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(tmp_path, artifact_path)
+
+        # Older compiled ontologies are not used anymore
+        for f in listdir(artifact_dir):
+            f_path = join(artifact_dir, f)
+            if f.startswith("ontology-") and f.endswith(".pickle") and f_path != artifact_path:
+                remove(f_path)
+    except OSError as e:
+        app.logger.warning("Error {}: Failed save compiled ontology {}".format(
+            e.__class__.__name__, artifact_path))
+        return None, Ontology(source_hash, skill_matcher)
+
+    app.logger.info("Compiled ontology files {} to {}".format(ont_files, artifact_path))
+    return artifact_path, Ontology(source_hash, skill_matcher)
+
+
+def parse_skill_nodes(ont_files: List[str]) -> Set[OntNode]:
+    """
+    Parse skills in rdf format of ontology files and return as list node
+    """
 
     app.logger.debug('Load ontology files: {}'.format(ont_files))
 
@@ -67,6 +301,13 @@ def load_skill_nodes_from_rdf_resources(skills_resource_dir) -> Set[OntNode]:
             base_namespace_uri = get_namespace_uri(
                 g=graph, namespace_prefix=None)
 
+            # Custom properties
+            RDF_SKILL_PROPERTY = ClosedNamespace(
+                uri=URIRef(str(base_namespace_uri)),
+                terms=[
+                    "difficulty", "keywordOnly"]
+            )
+
             triples = graph.triples((None, RDF.type, None))
             for s, p, o in triples:
                 if not (o == OWL.NamedIndividual) and not (o == OWL.Class):
@@ -95,13 +336,6 @@ def load_skill_nodes_from_rdf_resources(skills_resource_dir) -> Set[OntNode]:
                         1] != ontNode.name]
                     ontNode.parents = parents
 
-                # Custom properties
-                RDF_SKILL_PROPERTY = ClosedNamespace(
-                    uri=URIRef(str(base_namespace_uri)),
-                    terms=[
-                        "difficulty", "keywordOnly"]
-                )
-
                 triples_difficulty = graph.triples(
                     (s, RDF_SKILL_PROPERTY.difficulty, None))
                 for s2, p2, o2 in triples_difficulty:
@@ -123,7 +357,6 @@ def load_skill_nodes_from_rdf_resources(skills_resource_dir) -> Set[OntNode]:
             app.logger.debug("Parse file {} exception".format(ont_file))
             raise
 
-    skill_nodes_cache = skills
     return skills
 
 
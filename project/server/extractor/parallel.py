@@ -0,0 +1,206 @@
+# project/server/extractor/parallel.py
+
+import os
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List
+
+from flask import current_app as app
+
+from project.server.extractor.matcher import SkillMatcher
+
+_skill_matcher = None  # matcher of pool workers, inherited from the parent by fork
+
+
+class MatcherPool(object):
+    """
+    Process pool to match chunks of large documents. Workers are forked after the
+    ontology was loaded, so they share its SkillMatcher copy-on-write instead of
+    loading it or receiving it by pickle. The pool is created again when the
+    ontology is reloaded.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._skill_matcher = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_executor(self, skill_matcher: SkillMatcher, max_workers: int) -> ProcessPoolExecutor:
+        global _skill_matcher
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # Pool of the parent process is not usable after fork
+                self._executor = None
+            if self._executor is not None and self._skill_matcher is skill_matcher:
+                return self._executor
+
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            _skill_matcher = skill_matcher
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+            self._skill_matcher = skill_matcher
+            self._pid = os.getpid()
+            return self._executor
+
+    def discard(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self._skill_matcher = None
+
+
+matcher_pool = MatcherPool()
+
+
+def count_in_content(skill_matcher: SkillMatcher, content) -> Dict[str, int]:
+    """
+    Count matches of each lowercase pattern as SkillMatcher.count, chunks of contents
+    longer than MATCH_PARALLEL_MIN_LENGTH characters are matched by a process pool
+    """
+
+    min_length = app.config["MATCH_PARALLEL_MIN_LENGTH"]
+    if not content or isinstance(content, str) or min_length <= 0 \
+            or multiprocessing.current_process().daemon:
+        # e.g. daemonic celery prefork children are not allowed to have children
+        return skill_matcher.count(content)
+
+    parts = iter(content)
+    head = []
+    head_length = 0
+    for part in parts:
+        head.append(part)
+        head_length += len(part)
+        if head_length >= min_length:
+            break
+    else:
+        return skill_matcher.count(head)
+
+    def iter_parts():
+        yield from head
+        yield from parts
+
+    max_workers = app.config["MATCH_PARALLEL_WORKERS"] or os.cpu_count() or 1
+    if max_workers <= 1:
+        return skill_matcher.count(iter_parts())
+    return count_by_chunks(skill_matcher, iter_parts(), app.config["MATCH_PARALLEL_CHUNK_LENGTH"],
+                           max_workers)
+
+
+def count_by_chunks(skill_matcher: SkillMatcher, parts: Iterable[str], chunk_length: int,
+                    max_workers: int) -> Dict[str, int]:
+    """
+    Split the lowercase content in chunks which overlap by the longest pattern, find
+    matches of chunks in pool workers, then keep non-overlapping matches of each
+    pattern in order of position as SkillMatcher.count does.
+    """
+
+    if len(skill_matcher.patterns) == 0:
+        return dict()
+
+    lens = skill_matcher.pattern_lens
+    context_length = max(lens) + 1  # characters after a chunk to match to its end
+
+    try:
+        executor = matcher_pool.get_executor(skill_matcher, max_workers)
+    except (AssertionError, OSError) as e:
+        app.logger.debug("Error {}: Match chunks serially".format(e.__class__.__name__))
+        executor = None
+
+    counts = dict()
+    last_ends = dict()
+    window = deque()  # (future or None, chunk args) in order of chunk
+
+    def merge(starts_by_pattern: Dict[int, List[int]]):
+        for pattern_id, starts in starts_by_pattern.items():
+            last_end = last_ends.get(pattern_id, 0)
+            n = 0
+            for start in starts:
+                if start >= last_end:
+                    n += 1
+                    last_end = start + lens[pattern_id]
+            last_ends[pattern_id] = last_end
+            if n > 0:
+                counts[pattern_id] = counts.get(pattern_id, 0) + n
+
+    def read_first():
+        nonlocal executor
+        future, args = window.popleft()
+        if future is not None:
+            try:
+                merge(future.result())
+                return
+            except BrokenProcessPool as e:
+                app.logger.warning("Error {}: Match chunks serially".format(
+                    e.__class__.__name__))
+                matcher_pool.discard()
+                executor = None
+        merge(skill_matcher.find_starts(*args))
+
+    def submit(args):
+        nonlocal executor
+        future = None
+        if executor is not None:
+            try:
+                future = executor.submit(find_chunk_starts, *args)
+            except (BrokenProcessPool, RuntimeError) as e:
+                app.logger.warning("Error {}: Match chunks serially".format(
+                    e.__class__.__name__))
+                matcher_pool.discard()
+                executor = None
+        window.append((future, args))
+        # At most 2 chunks for each worker are matched or wait to be merged
+        while len(window) > max_workers * 2:
+            read_first()
+
+    buffer = []  # lowercase text from buffer_offset
+    buffer_offset = 0
+    buffer_length = 0
+    chunk_start = 0
+    for part in parts:
+        if not part:
+            continue
+        text = part.lower()
+        buffer.append(text)
+        buffer_length += len(text)
+
+        if buffer_offset + buffer_length < chunk_start + chunk_length + context_length:
+            continue
+
+        text = "".join(buffer)
+        while buffer_offset + len(text) >= chunk_start + chunk_length + context_length:
+            stop = chunk_start + chunk_length
+            text_from = max(0, chunk_start - 1)
+            submit((text[text_from - buffer_offset:stop + context_length - buffer_offset],
+                    text_from, chunk_start, stop))
+            chunk_start = stop
+
+        # Keep one character before the next chunk for \b
+        keep_from = max(0, chunk_start - 1)
+        text = text[keep_from - buffer_offset:]
+        buffer = [text]
+        buffer_offset = keep_from
+        buffer_length = len(text)
+
+    text = "".join(buffer)
+    if buffer_offset + len(text) > chunk_start:
+        text_from = max(0, chunk_start - 1)
+        submit((text[text_from - buffer_offset:], text_from, chunk_start, None))
+
+    while len(window) > 0:
+        read_first()
+
+    return dict((skill_matcher.patterns[pattern_id], n) for pattern_id, n in counts.items())
+
+
+def find_chunk_starts(text, offset, start, stop) -> Dict[int, List[int]]:
+    """
+    Run in pool workers on the matcher inherited from the parent
+    """
+
+    return _skill_matcher.find_starts(text, offset, start, stop)
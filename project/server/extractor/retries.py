@@ -0,0 +1,103 @@
+# project/server/extractor/retries.py
+
+import json
+import time
+import random
+import datetime
+from typing import List, Set
+
+from flask import current_app as app
+from sqlalchemy import exc as sqlalchemy_exc
+from elasticsearch.exceptions import ConnectionError as ElasticsearchConnectionError
+from elasticsearch.exceptions import TransportError as ElasticsearchTransportError
+
+from project.server import db
+from project.server.models import DeadLetter, DocumentJob
+from project.server.extractor.jobs import set_jobs_state
+
+# Errors which may succeed later: cluster or database unavailable, overloaded or timed out
+TRANSIENT_ERRORS = (ElasticsearchConnectionError, sqlalchemy_exc.OperationalError,
+                    sqlalchemy_exc.DisconnectionError, sqlalchemy_exc.TimeoutError)
+TRANSIENT_STATUS_CODES = {429, 502, 503, 504}
+
+
+def is_transient_error(ex: BaseException) -> bool:
+    if isinstance(ex, TRANSIENT_ERRORS):
+        return True
+    return isinstance(ex, ElasticsearchTransportError) \
+        and ex.status_code in TRANSIENT_STATUS_CODES
+
+
+def get_retry_delay(retries: int) -> float:
+    """
+    Seconds before the next retry: exponential backoff capped to TASK_RETRY_MAX_DELAY,
+    with jitter so tasks failed together do not retry together
+    """
+
+    delay = min(app.config["TASK_RETRY_MAX_DELAY"],
+                app.config["TASK_RETRY_BASE_DELAY"] * 2 ** retries)
+    return random.uniform(delay / 2, delay)
+
+
+def get_retry_deadline() -> float:
+    return time.time() + app.config["TASK_RETRY_DEADLINE"]
+
+
+def retry_or_dead_letter(task, ex: Exception, document_ids: List[int], deadline: float,
+                         args: tuple = None):
+    """
+    Retry the task later if the error is transient and the retry is before deadline,
+    else save dead letters of its documents. Raise celery Retry to retry.
+    """
+
+    db.session.rollback()
+
+    retries = task.request.retries or 0
+    if is_transient_error(ex) and retries < app.config["TASK_MAX_RETRIES"]:
+        countdown = get_retry_delay(retries)
+        if time.time() + countdown < deadline:
+            app.logger.warning("Error {}: Retry {} of documents {} in {:.0f}s".format(
+                ex.__class__.__name__, retries + 1, document_ids, countdown))
+            kwargs = dict(task.request.kwargs or {}, deadline=deadline)
+            set_jobs_state(document_ids, DocumentJob.QUEUED, error="Retry {}: {}".format(
+                retries + 1, ex.__class__.__name__))
+            raise task.retry(args=args, kwargs=kwargs, exc=ex, countdown=countdown)
+
+    save_dead_letters(document_ids, ex, retries=retries)
+
+
+def save_dead_letters(document_ids: List[int], ex: BaseException, retries=0, commit=True):
+    """
+    Save a dead letter of index_and_extract_skills for each document
+    """
+
+    app.logger.warning("Error {}: Dead letter of documents {}: {}".format(
+        ex.__class__.__name__, document_ids, ex))
+    for document_id in document_ids:
+        db.session.add(DeadLetter(task_name="tasks.index_and_extract_skills",
+                                  args=json.dumps([document_id]), document_id=document_id,
+                                  error_type=ex.__class__.__name__, error=str(ex)[:10000],
+                                  retries=retries))
+    if commit:
+        db.session.commit()
+    set_jobs_state(document_ids, DocumentJob.FAILED,
+                   error="{}: {}".format(ex.__class__.__name__, str(ex)[:1000]))
+
+
+def get_open_circuit_document_ids(document_ids: List[int]) -> Set[int]:
+    """
+    Documents which failed DOCUMENT_CIRCUIT_THRESHOLD times in the last
+    DOCUMENT_CIRCUIT_COOLDOWN seconds, they are not processed until the cooldown
+    or a replay of their dead letters
+    """
+
+    if len(document_ids) == 0:
+        return set()
+
+    since = datetime.datetime.now() - datetime.timedelta(
+        seconds=app.config["DOCUMENT_CIRCUIT_COOLDOWN"])
+    rows = db.session.query(DeadLetter.document_id) \
+        .filter(DeadLetter.document_id.in_(document_ids), DeadLetter.created_on >= since) \
+        .group_by(DeadLetter.document_id) \
+        .having(db.func.count(DeadLetter.id) >= app.config["DOCUMENT_CIRCUIT_THRESHOLD"]).all()
+    return set(row[0] for row in rows)
@@ -3,107 +3,717 @@
 import os
 import re
 import json
-from typing import List
+import heapq
+import hashlib
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
 
-import PyPDF2
 from flask import current_app as app
-from elasticsearch import Elasticsearch
+from sqlalchemy import and_, or_, distinct, func
 from elasticsearch.exceptions import NotFoundError as ElasticsearchNotFoundError
+from elasticsearch.helpers import bulk
+from celery.exceptions import Retry
 
 from project.server import db
-from project.server.models import Document
+from project.server.models import Document, DocumentJob, DocumentSkill
 from project.server import celery
-from project.server.extractor.indexes import extract_skills_in_document
+from project.server import es_client
+from project.server.ttl_cache import TTLCache
+from project.server.metrics import (
+    StageTimer, bytes_total, characters_total, pages_total, skills_matched_total, stage_seconds)
+from project.server.extractor.contents import (
+    ContentStream, get_document_path, is_pdf, iter_document_content)
+from project.server.extractor.matcher import SkillMatcher
+from project.server.extractor.ontologies import Ontology, get_ontology, get_skills_resource_dir
+from project.server.extractor.batcher import IdBatcher
+from project.server.extractor.jobs import iter_marking_matching, set_jobs_state
+from project.server.extractor.retries import (
+    get_open_circuit_document_ids, get_retry_deadline, is_transient_error, retry_or_dead_letter,
+    save_dead_letters)
+from project.server.extractor.mappings import ensure_index
+from project.server.extractor.indexes import (
+    SkillExtract, aggregate_index_skills, extract_skills_in_content, extract_skills_in_document)
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+CURSOR_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+documents_count_cache = TTLCache()  # dict by user id to number of documents
+skills_aggregations_cache = TTLCache(max_size=256)  # dict by query to skill aggregations
+
+
+def send_documents_to_extract(document_ids: List[int]):
+    if len(document_ids) == 1:
+        queue_task(index_and_extract_skills, (document_ids[0],))
+    else:
+        queue_task(index_and_extract_skills_batch, (document_ids,))
+
+
+def queue_task(task, args: tuple, bulk=False):
+    """
+    Queue a task with the priority of interactive or bulk work, its queue is set by
+    CELERY_ROUTES
+    """
+
+    priority = app.config["BULK_TASK_PRIORITY"] if bulk else app.config["INTERACTIVE_TASK_PRIORITY"]
+    return task.apply_async(args=args, priority=priority)
+
+
+upload_batcher = IdBatcher(send_documents_to_extract)  # ids of uploaded documents
 
 
 class DocumentService():
 
     def __init__(self):
-        self.es_host = app.config["ELASTICSEARCH_HOST"]
         self.es_index = app.config["ELASTICSEARCH_INDEX"]
 
-    def create(self, content_type, title, created_by, filename, path) -> Document:
+    def create(self, content_type, title, created_by, filename, path,
+               content_hash=None) -> Document:
         document = Document(content_type=content_type, title=title,
-                            created_by=created_by, filename=filename, path=path)
+                            created_by=created_by, filename=filename, path=path,
+                            content_hash=content_hash)
         db.session.add(document)
+        db.session.flush()
+        db.session.add(DocumentJob(document.id))
         db.session.commit()
+        documents_count_cache.delete(created_by)
 
         return document
 
+    def create_many(self, rows: List[dict], created_by) -> List[int]:
+        """
+        Insert documents of a batch upload in one statement, with a multi-row INSERT
+        RETURNING where the database supports it
+        - **param**::
+            :param rows: dicts of content_type, title, filename, path and content_hash
+        - **return**::
+            :return: ids of the documents in the order of rows
+        """
+
+        if len(rows) == 0:
+            return []
+
+        created_on = datetime.datetime.now()
+        values = [dict(row, created_by=created_by, created_on=created_on) for row in rows]
+        if db.engine.dialect.implicit_returning and db.engine.dialect.supports_multivalues_insert:
+            table = Document.__table__
+            result = db.session.execute(table.insert().values(values).returning(table.c.id))
+            ids = [row[0] for row in result]
+        else:
+            documents = [Document(created_by=created_by, **row) for row in rows]
+            for document in documents:
+                document.created_on = created_on
+            db.session.add_all(documents)
+            db.session.flush()
+            ids = [document.id for document in documents]
+        db.session.bulk_save_objects([DocumentJob(id) for id in ids])
+        db.session.commit()
+        documents_count_cache.delete(created_by)
+
+        return ids
+
     def find_indexed(self, id):
-        es = Elasticsearch(self.es_host)
+        es = es_client.get_client()
         res = es.get(index=self.es_index, doc_type='document', id=id)
         app.logger.debug(res['_source'])
         return json.loads(res['_source'])
 
+    def find_page_by_user(self, user_id, page_size, after: str = None) -> Tuple[List, str]:
+        """
+        Documents of a user, newest first, paged by the (created_on, id) of the last
+        document of previous page.
+        - **return**::
+            :return: documents of the page, and cursor of next page or None if it is the last
+        """
+
+        query = Document.query.filter(Document.created_by == user_id)
+
+        cursor = parse_documents_cursor(after)
+        if cursor is not None:
+            created_on, id = cursor
+            query = query.filter(or_(
+                Document.created_on < created_on,
+                and_(Document.created_on == created_on, Document.id < id)))
+
+        documents = query.order_by(Document.created_on.desc(), Document.id.desc()) \
+            .limit(page_size + 1).all()
+
+        next_cursor = None
+        if len(documents) > page_size:
+            documents = documents[0:page_size]
+            next_cursor = format_documents_cursor(documents[-1])
+
+        return documents, next_cursor
+
+    def count_by_user(self, user_id) -> int:
+        """
+        Number of documents of a user, cached for DOCUMENTS_COUNT_CACHE_TTL seconds
+        """
+
+        return documents_count_cache.get_or_set(
+            user_id, lambda: Document.query.filter(Document.created_by == user_id).count(),
+            ttl=app.config["DOCUMENTS_COUNT_CACHE_TTL"])
+
+    def find_ids_by_skills(self, skills: List[str], user_id=None, limit=None) -> List[int]:
+        """
+        Ids of documents which have all the skills, of a user if user_id is passed
+        """
+
+        query = query_documents_by_skills(skills, user_id) \
+            .order_by(DocumentSkill.document_id.desc()).limit(limit)
+        return [row[0] for row in query]
+
+    def count_skills(self, user_id=None, skills: List[str] = None,
+                     limit=20) -> List[Tuple[str, int]]:
+        """
+        Most frequent skills with their number of documents, of a user if user_id is
+        passed, among documents which have all the skills if skills are passed
+        - **return**::
+            :return: list of (skill, number of documents)
+        """
+
+        n_documents = func.count(distinct(DocumentSkill.document_id))
+        query = db.session.query(DocumentSkill.skill, n_documents)
+        if user_id is not None:
+            query = query.filter(DocumentSkill.created_by == user_id)
+        if skills:
+            query = query.filter(DocumentSkill.document_id.in_(
+                query_documents_by_skills(skills, user_id)))
+
+        rows = query.group_by(DocumentSkill.skill) \
+            .order_by(n_documents.desc(), DocumentSkill.skill).limit(limit).all()
+        return [(skill, n) for skill, n in rows]
+
+    def aggregate_skills(self, user_id=None, skill: str = None, size=20,
+                         after: str = None) -> dict:
+        """
+        Numbers of documents by skill counted by Elasticsearch aggregations, cached
+        for SKILLS_AGGREGATIONS_CACHE_TTL seconds
+        """
+
+        return skills_aggregations_cache.get_or_set(
+            (user_id, skill, size, after),
+            lambda: aggregate_index_skills(user_id=user_id, skill=skill, size=size, after=after),
+            ttl=app.config["SKILLS_AGGREGATIONS_CACHE_TTL"])
+
     def index_and_extract_skills_async(self, document_id):
-        tuple([document_id])
-        index_and_extract_skills.apply_async(args=(document_id,), )
+        upload_batcher.add(document_id, max_size=app.config["UPLOAD_BATCH_SIZE"],
+                           window=app.config["UPLOAD_BATCH_WINDOW"])
 
+    def index_and_extract_skills_batch_async(self, document_ids: List[int]):
+        """
+        Queue documents of a batch upload as one job, they are already a batch
+        """
 
-# @celery.task(bind=True, default_retry_delay=60, max_retries=180, acks_late=True)
-@celery.task(name='tasks.index_and_extract_skills', default_retry_delay=60, max_retries=200,
-             acks_late=True)
-def index_and_extract_skills(document_id):
+        if len(document_ids) > 0:
+            send_documents_to_extract(document_ids)
+
+
+@celery.task(bind=True, name='tasks.index_and_extract_skills', max_retries=None, acks_late=True)
+def index_and_extract_skills(self, document_id, deadline=None):
     if document_id is None:
         app.logger.info('Document id is required')
         return
 
-    document = Document.query.filter_by(id=document_id).first()
-    if (document is None):
-        app.logger.info('Document {} is not found'.format(document_id))
+    if deadline is None:
+        deadline = get_retry_deadline()
+
+    try:
+        if document_id in get_open_circuit_document_ids([document_id]):
+            app.logger.info('Document {} failed too many times, skip it'.format(document_id))
+            return
+
+        document = Document.query.filter_by(id=document_id).first()
+        if (document is None):
+            app.logger.info('Document {} is not found'.format(document_id))
+            return
+
+        set_jobs_state([document_id], DocumentJob.PARSING)
+        if app.config["SKILLS_EXTRACT_MODE"] == "elasticsearch":
+            index_and_extract_skills_by_elasticsearch(document)
+        else:
+            index_and_extract_skills_local(document)
+    except Retry:
+        raise
+    except Exception as ex:
+        retry_or_dead_letter(self, ex, [document_id], deadline)
+        return
+
+    set_jobs_state([document_id], DocumentJob.INDEXED)
+
+    app.logger.debug("Elasticsearch client: {}".format(es_client.metrics()))
+
+
+@celery.task(bind=True, name='tasks.index_and_extract_skills_batch', max_retries=None,
+             acks_late=True)
+def index_and_extract_skills_batch(self, document_ids: List[int], deadline=None) -> dict:
+    """
+    Index and extract skills of uploaded documents coalesced by upload_batcher
+    """
+
+    return index_and_extract_documents_task(self, document_ids, deadline)
+
+
+@celery.task(bind=True, name='tasks.reextract_skills', max_retries=None, acks_late=True)
+def reextract_skills(self, document_ids: List[int], deadline=None) -> dict:
+    """
+    Index and extract skills of many documents, write them by bulk requests
+    """
+
+    return index_and_extract_documents_task(self, document_ids, deadline)
+
+
+def index_and_extract_documents_task(task, document_ids: List[int], deadline=None) -> dict:
+    """
+    Run index_and_extract_documents, retry the documents which failed by transient
+    errors with backoff
+    """
+
+    if deadline is None:
+        deadline = get_retry_deadline()
+
+    try:
+        result = index_and_extract_documents(document_ids)
+    except Retry:
+        raise
+    except Exception as ex:
+        retry_or_dead_letter(task, ex, document_ids, deadline, args=(document_ids,))
+        return {"documents": len(document_ids), "failed": len(document_ids), "bulk_errors": 0}
+
+    if len(result["transient_failed_ids"]) > 0:
+        retry_ids = result["transient_failed_ids"]
+        retry_or_dead_letter(task, result["transient_errors"][0], retry_ids, deadline,
+                             args=(retry_ids,))
+
+    return {key: value for key, value in result.items() if key != "transient_errors"}
+
+
+def query_documents_by_skills(skills: List[str], user_id=None):
+    """
+    Query of ids of documents which have all the skills
+    """
+
+    skills = set(skills)
+    query = db.session.query(DocumentSkill.document_id) \
+        .filter(DocumentSkill.skill.in_(skills))
+    if user_id is not None:
+        query = query.filter(DocumentSkill.created_by == user_id)
+    return query.group_by(DocumentSkill.document_id) \
+        .having(func.count(distinct(DocumentSkill.skill)) == len(skills))
+
+
+def save_document_skills(document: Document, skill_extracts: List[SkillExtract], commit=True):
+    """
+    Replace skills of a document in database by one bulk insert
+    """
+
+    n_matches = dict()
+    for skill_extract in skill_extracts:
+        key = (skill_extract.name, skill_extract.match_str)
+        n_matches[key] = n_matches.get(key, 0) + skill_extract.n_match
+
+    DocumentSkill.query.filter(DocumentSkill.document_id == document.id) \
+        .delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(DocumentSkill, [{
+        "document_id": document.id,
+        "created_by": document.created_by,
+        "skill": skill,
+        "match_str": match_str,
+        "n_match": n_match
+    } for (skill, match_str), n_match in n_matches.items()])
+
+    if commit:
+        db.session.commit()
+
+
+def iter_document_ids(chunk_size=1000, after_id=0):
+    """
+    Iterate ids of all documents by chunks, ordered by id and paged by the last id
+    """
+
+    while True:
+        rows = db.session.query(Document.id).filter(Document.id > after_id) \
+            .order_by(Document.id).limit(chunk_size).all()
+        if len(rows) == 0:
+            return
+
+        ids = [row[0] for row in rows]
+        yield ids
+        after_id = ids[-1]
+
+
+class ExtractSkillsError(Exception):
+    """
+    Skills extraction of a document failed, doc is its index data without skills
+    """
+
+    def __init__(self, doc: dict, cause: Exception):
+        super().__init__(str(cause))
+        self.doc = doc
+        self.cause = cause
+
+
+def index_and_extract_skills_local(document: Document, bulk_indexer: "BulkIndexer" = None):
+    """
+    Extract skills on the parsed text of document, then index the document
+    with its skills by one write, which is buffered if bulk_indexer is passed.
+    Skills are saved to database too, committed by the caller if bulk_indexer is passed.
+    """
+
+    skills_resource_dir = get_skills_resource_dir()
+    ontology = get_ontology(skills_resource_dir)
+
+    try:
+        doc, skill_extracts = extract_index_doc(document, ontology)
+    except ExtractSkillsError as ex:
+        index_doc(document.id, ex.doc, bulk_indexer=bulk_indexer)
+        raise ex.cause from None
+
+    save_document_skills(document, skill_extracts, commit=bulk_indexer is None)
+    index_doc(document.id, doc, bulk_indexer=bulk_indexer)
+
+
+def extract_index_doc(document: Document, ontology: Ontology) -> Tuple[dict, List[SkillExtract]]:
+    """
+    Parse the document and extract its skills, nothing is written.
+    - **return**::
+        :return: index data of the document with its skills, and skill extracts
+    """
+
+    # Same file was uploaded before, reuse its text and skills
+    duplicate = find_indexed_duplicate(document, ontology_version=ontology.version)
+    if duplicate is not None:
+        app.logger.debug('Reuse skills of document {} for document {}'.format(
+            duplicate["id"], document.id))
+        skill_extracts = [SkillExtract(**item) for item in duplicate["skill_extracts"]]
+        doc = build_index_doc(document, duplicate.get("content"), duplicate.get("n_words"))
+        with stage_seconds.time(stage="ranking"):
+            doc.update(rank_skill_extracts(document, skill_extracts, ontology.skill_matcher))
+        doc["ontology_version"] = ontology.version
+        return doc, skill_extracts
+
+    # Pages are matched as they are read, only the indexed part of content is kept.
+    # Stages interleave, each one is timed by the time its consumer waits for it.
+    timer = StageTimer()
+    parts = iter_marking_matching(document.id, iter_document_content(document))
+    content_stream = ContentStream(timer.iter("text_extraction", parts),
+                                   max_length=app.config["INDEX_CONTENT_MAX_LENGTH"])
+
+    app.logger.debug(
+        'Extract skill for document {}: {} '.format(document.id, document.title))
+
+    try:
+        with timer.time("extract"):
+            skill_extracts = extract_skills_in_content(
+                timer.iter("content_stream", content_stream), ontology=ontology)
+        with timer.time("ranking"):
+            skills_data = rank_skill_extracts(document, skill_extracts, ontology.skill_matcher)
+        skills_data["ontology_version"] = ontology.version
+    except Exception as ex:
+        doc = build_index_doc(document, content_stream.get_content(), content_stream.n_words)
+        doc["skill_extracts_exception"] = str(ex)
+        raise ExtractSkillsError(doc, ex)
+
+    observe_extract_stages(document, timer, content_stream, skill_extracts)
+    doc = build_index_doc(document, content_stream.get_content(), content_stream.n_words)
+    doc.update(skills_data)
+    return doc, skill_extracts
+
+
+def observe_extract_stages(document: Document, timer: StageTimer, content_stream: ContentStream,
+                           skill_extracts: List[SkillExtract]):
+    """
+    Observe exclusive seconds of each stage of extract_index_doc, and count what was processed
+    """
+
+    stage_seconds.observe(timer.get("text_extraction"), stage="text_extraction")
+    stage_seconds.observe(timer.get("content_stream") - timer.get("text_extraction"),
+                          stage="word_count")
+    stage_seconds.observe(timer.get("extract") - timer.get("content_stream"), stage="matching")
+    stage_seconds.observe(timer.get("ranking"), stage="ranking")
+
+    path = get_document_path(document)
+    if path is not None and os.path.isfile(path):
+        bytes_total.inc(os.path.getsize(path))
+    if is_pdf(document):
+        pages_total.inc(content_stream.n_parts)
+    characters_total.inc(content_stream.length)
+    skills_matched_total.inc(len(skill_extracts))
+
+
+def index_and_extract_documents(document_ids: List[int]) -> dict:
+    """
+    Index and extract skills of many documents: load them by one query, parse them
+    by EXTRACT_BATCH_WORKERS threads, then write them by bulk requests and one commit.
+    Documents failed by other than transient errors are saved as dead letters, the
+    others are returned in transient_failed_ids to retry.
+    """
+
+    open_ids = get_open_circuit_document_ids(document_ids)
+    if len(open_ids) > 0:
+        app.logger.info('Documents {} failed too many times, skip them'.format(open_ids))
+    documents = Document.query.filter(Document.id.in_(document_ids)).all()
+    documents = [document for document in documents if document.id not in open_ids]
+    set_jobs_state([document.id for document in documents], DocumentJob.PARSING)
+
+    transient_errors = []  # documents to retry
+    n_failed = 0
+
+    def failed(document, ex):
+        nonlocal n_failed
+        n_failed += 1
+        app.logger.warning("Error {}: Failed extract skills of document {}: {}".format(
+            ex.__class__.__name__, document.id, ex))
+        if is_transient_error(ex):
+            transient_errors.append((document.id, ex))
+        else:
+            save_dead_letters([document.id], ex, commit=False)
+
+    if app.config["SKILLS_EXTRACT_MODE"] == "elasticsearch":
+        indexed_ids = []
+        for document in documents:
+            try:
+                index_and_extract_skills_by_elasticsearch(document)
+                indexed_ids.append(document.id)
+            except Exception as ex:
+                failed(document, ex)
+        db.session.commit()  # dead letters
+        set_jobs_state(indexed_ids, DocumentJob.INDEXED)
+        return {"documents": len(documents), "failed": n_failed, "bulk_errors": 0,
+                "transient_failed_ids": [id for id, ex in transient_errors],
+                "transient_errors": [ex for id, ex in transient_errors]}
+
+    skills_resource_dir = get_skills_resource_dir()
+    ontology = get_ontology(skills_resource_dir)
+
+    indexed_ids = []
+    with BulkIndexer() as bulk_indexer:
+        for document, result in iter_extract_index_docs(documents, ontology):
+            if isinstance(result, Exception):
+                if isinstance(result, ExtractSkillsError):
+                    bulk_indexer.index(document.id, result.doc)
+                    result = result.cause
+                failed(document, result)
+                continue
+
+            doc, skill_extracts = result
+            save_document_skills(document, skill_extracts, commit=False)
+            bulk_indexer.index(document.id, doc)
+            indexed_ids.append(document.id)
+    db.session.commit()  # skills and dead letters of the batch
+
+    bulk_error_ids = get_bulk_error_ids(bulk_indexer.errors)
+    set_jobs_state([id for id in indexed_ids if id not in bulk_error_ids], DocumentJob.INDEXED)
+    set_jobs_state(bulk_error_ids, DocumentJob.FAILED, error="Index failed")
+
+    return {
+        "documents": len(documents),
+        "failed": n_failed,
+        "bulk_errors": len(bulk_indexer.errors),
+        "transient_failed_ids": [id for id, ex in transient_errors],
+        "transient_errors": [ex for id, ex in transient_errors]
+    }
+
+
+def get_bulk_error_ids(errors: List[dict]) -> set:
+    """
+    Document ids of failed bulk actions, errors are {op_type: {"_id": ..., ...}}
+    """
+
+    ids = set()
+    for error in errors:
+        for item in error.values():
+            if isinstance(item, dict) and "_id" in item:
+                ids.add(int(item["_id"]))
+    return ids
+
+
+def iter_extract_index_docs(documents: List[Document], ontology: Ontology) -> Iterator[Tuple]:
+    """
+    Extract index data of documents by a thread pool, a few documents at once to
+    bound memory. Yield (document, (doc, skill_extracts) or the exception) in order.
+    """
+
+    max_workers = min(app.config["EXTRACT_BATCH_WORKERS"], len(documents))
+    if max_workers <= 1:
+        for document in documents:
+            try:
+                yield document, extract_index_doc(document, ontology)
+            except Exception as ex:
+                yield document, ex
         return
 
-    index_document(document=document)
+    flask_app = app._get_current_object()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        next_document = 0
+        for document in documents:
+            while next_document < len(documents) and len(futures) < max_workers * 2:
+                futures.append(executor.submit(
+                    extract_index_doc_in_app, flask_app, documents[next_document], ontology))
+                next_document += 1
+
+            try:
+                yield document, futures.pop(0).result()
+            except Exception as ex:
+                yield document, ex
+
+
+def extract_index_doc_in_app(flask_app, document: Document, ontology: Ontology):
+    # Threads have their own app context, so their own database session
+    with flask_app.app_context():
+        return extract_index_doc(document, ontology)
+
+
+def format_documents_cursor(document: Document) -> str:
+    return "{}_{}".format(document.created_on.strftime(CURSOR_DATETIME_FORMAT), document.id)
+
+
+def parse_documents_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """
+    (created_on, id) of a documents cursor, None if cursor is empty or invalid
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        created_on, id = cursor.rsplit("_", 1)
+        return datetime.datetime.strptime(created_on, CURSOR_DATETIME_FORMAT), int(id)
+    except ValueError:
+        app.logger.debug("Invalid documents cursor {}".format(cursor))
+        return None
+
+
+def find_indexed_duplicate(document: Document, ontology_version=None) -> dict:
+    """
+    Find an indexed document of the same file content whose skills were extracted
+    by the ontology version.
+    - **return**::
+        :return: indexed document with id, content, n_words and skill_extracts or None
+    """
+
+    if document.content_hash is None:
+        return None
+
+    rows = db.session.query(Document.id).filter(
+        Document.content_hash == document.content_hash, Document.id != document.id) \
+        .order_by(Document.id.desc()).limit(10).all()
+    if len(rows) == 0:
+        return None
+
+    es = es_client.get_client()
+    try:
+        res = es.mget(index=app.config["ELASTICSEARCH_INDEX"], doc_type='document',
+                      body={"ids": [row[0] for row in rows]},
+                      _source_includes=["id", "content", "n_words", "skill_extracts",
+                                        "ontology_version"])
+    except ElasticsearchNotFoundError:
+        return None
+
+    for doc in res["docs"]:
+        source = doc.get("_source")
+        if doc.get("found") and "skill_extracts" in source \
+                and source.get("ontology_version") == ontology_version:
+            return source
+
+    return None
+
+
+def save_upload(file, path) -> str:
+    """
+    Save an uploaded file by chunks and hash its content on the way.
+    - **return**::
+        :return: SHA-256 of the file content
+    """
+
+    sha256 = hashlib.sha256()
+    with open(path, "wb") as f:
+        for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            f.write(chunk)
+    return sha256.hexdigest()
+
+
+def index_and_extract_skills_by_elasticsearch(document: Document):
+    """
+    Index the document, query its skills on Elasticsearch, then update the document
+    with its skills
+    """
+
+    # Skills are queried on the document right after
+    index_document(document=document, refresh="wait_for")
 
     app.logger.debug(
         'Extract skill for document {}: {} '.format(document.id, document.title))
 
     try:
-        skill_extracts = extract_skills_in_document(document_id)
-
-        # Sort match items by number of match
-        matches = list()
-        names = set(skill_extract.name for skill_extract in skill_extracts)
-        for name in names:
-            n_match = sum(item.n_match for item in skill_extracts if item.name == name)
-            regex = re.compile(r"\b{}\b".format(re.escape(name.lower())))
-            # Skill is more confident based on title
-            n_match += n_match * 2 * len(regex.findall(document.title.lower()))
-
-            matches.append({
-                "name": name,
-                "n_match": n_match
-            })
-
-        matches_sorted = sorted(matches, key=lambda item: item["n_match"], reverse=True)
-
-        skills = list(match["name"] for match in matches_sorted)
-        skills = skills[0:5]  # Top 5 match items only
-
-        skill_extracts_list = [skill_extract.__dict__ for skill_extract in skill_extracts]
-        update_data = {
-            "skills": skills,
-            "skill_extracts": skill_extracts_list
-        }
-
-        app.logger.debug(
-            "Extracted skills for document {}:\n skills: {} \n skill_extracts: {}"
-            .format(document.id, skills, skill_extracts_list))
-        update_index_doc(document_id, update_data)
+        skill_extracts = extract_skills_in_document(document.id)
+        save_document_skills(document, skill_extracts)
+        with stage_seconds.time(stage="ranking"):
+            skills_data = rank_skill_extracts(document, skill_extracts)
+        update_index_doc(document.id, skills_data)
     except BaseException as ex:
-        update_index_doc(document_id, {"skill_extracts_exception": str(ex)})
+        update_index_doc(document.id, {"skill_extracts_exception": str(ex)})
         raise
 
 
-def index_document(document: Document):
-    es_host = app.config["ELASTICSEARCH_HOST"]
-    index = app.config["ELASTICSEARCH_INDEX"]
+def rank_skill_extracts(document: Document, skill_extracts: List[SkillExtract],
+                        skill_matcher: SkillMatcher = None) -> dict:
+    """
+    Rank skills by number of match, weighted by matches in the title, and return
+    index data of the SKILLS_TOP_N first skills
+    """
+
+    # Sum matches of each skill by one pass
+    n_matches = dict()
+    for skill_extract in skill_extracts:
+        n_matches[skill_extract.name] = n_matches.get(skill_extract.name, 0) + skill_extract.n_match
+
+    if skill_matcher is None:
+        skills_resource_dir = get_skills_resource_dir()
+        skill_matcher = get_ontology(skills_resource_dir).skill_matcher
+
+    # Skill is more confident based on title, all skills are matched on title by one scan
+    title = document.title.lower()
+    title_counts = skill_matcher.count(title)
+    title_weight = app.config["SKILLS_TITLE_WEIGHT"]
+    for name, n_match in n_matches.items():
+        pattern = name.lower()
+        if pattern in skill_matcher.pattern_ids:
+            n_title = title_counts.get(pattern, 0)
+        else:
+            regex = re.compile(r"\b{}\b".format(re.escape(pattern)))
+            n_title = len(regex.findall(title))
+        n_matches[name] = n_match + n_match * title_weight * n_title
+
+    top_matches = heapq.nlargest(app.config["SKILLS_TOP_N"], n_matches.items(),
+                                 key=lambda item: item[1])
+    skills = [name for name, n_match in top_matches]
+
+    skill_extracts_list = [skill_extract.__dict__ for skill_extract in skill_extracts]
+    update_data = {
+        "skills": skills,
+        "skill_extracts": skill_extracts_list
+    }
+
+    app.logger.debug(
+        "Extracted skills for document {}:\n skills: {} \n skill_extracts: {}"
+        .format(document.id, skills, skill_extracts_list))
+    return update_data
+
+
+def index_document(document: Document, refresh=None):
+    with stage_seconds.time(stage="text_extraction"):
+        document_content = get_document_content(document)
+    index_doc(document.id, build_index_doc(document, document_content), refresh=refresh)
 
-    document_content = get_document_content(document)
-    n_words = 0 if document_content is None else len(document_content.split())
 
-    doc = {
+def build_index_doc(document: Document, document_content: str, n_words: int = None) -> dict:
+    if n_words is None:
+        n_words = 0 if document_content is None else len(document_content.split())
+
+    return {
         "id": document.id,
         "title": document.title,
         "content_type": document.content_type,
@@ -113,30 +723,112 @@ def index_document(document: Document):
         "n_words": n_words
     }
 
-    es = Elasticsearch(es_host)
-    es.index(index=index, doc_type='document', id=document.id, body=doc)
-    es.indices.refresh(index=index)
 
+def index_doc(id, doc, doc_type='document', refresh=None, bulk_indexer=None):
+    """
+    Index a document. Pass refresh="wait_for" only if the document is read right after,
+    pass bulk_indexer to buffer the write and send it by a bulk request.
+    """
+
+    if bulk_indexer is not None:
+        bulk_indexer.index(id, doc, doc_type=doc_type)
+        return
+
+    index = app.config["ELASTICSEARCH_INDEX"]
+    ensure_index(index)
+
+    es = es_client.get_client()
+    es.index(index=index, doc_type=doc_type, id=id, body=doc, refresh=refresh)
+
+
+def update_index_doc(id, update_data, doc_type='document', refresh=None, bulk_indexer=None):
+    """
+    Partial update an indexed document. Pass refresh="wait_for" only if the document is
+    read right after, pass bulk_indexer to buffer the write and send it by a bulk request.
+    """
+
+    if bulk_indexer is not None:
+        bulk_indexer.update(id, update_data, doc_type=doc_type)
+        return
 
-def update_index_doc(id, update_data, doc_type='document'):
-    es_host = app.config["ELASTICSEARCH_HOST"]
     index = app.config["ELASTICSEARCH_INDEX"]
 
     body = {"doc": update_data}
 
-    es = Elasticsearch(es_host)
-    es.update(index=index, doc_type=doc_type, id=id, body=body)
-    es.indices.refresh(index=index)
+    es = es_client.get_client()
+    es.update(index=index, doc_type=doc_type, id=id, body=body, refresh=refresh)
+
+
+class BulkIndexer(object):
+    """
+    Buffer index and update of documents, send them by bulk requests of chunk_size
+    actions. Documents are visible to search after the next refresh interval
+    unless refresh="wait_for".
+    """
+
+    def __init__(self, chunk_size: int = None, refresh=None):
+        self.index_name = app.config["ELASTICSEARCH_INDEX"]
+        self.chunk_size = chunk_size or app.config["ELASTICSEARCH_BULK_SIZE"]
+        self.refresh = refresh
+        self.actions = []
+        self.n_success = 0
+        self.errors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def index(self, id, doc, doc_type='document'):
+        self.add({
+            "_op_type": "index",
+            "_index": self.index_name,
+            "_type": doc_type,
+            "_id": id,
+            "_source": doc
+        })
+
+    def update(self, id, update_data, doc_type='document'):
+        self.add({
+            "_op_type": "update",
+            "_index": self.index_name,
+            "_type": doc_type,
+            "_id": id,
+            "doc": update_data
+        })
+
+    def add(self, action: dict):
+        self.actions.append(action)
+        if len(self.actions) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.actions) == 0:
+            return
+
+        actions = self.actions
+        self.actions = []
+
+        ensure_index(self.index_name)
+        es = es_client.get_client()
+        n_success, errors = bulk(es, actions, chunk_size=self.chunk_size,
+                                 raise_on_error=False, refresh=self.refresh)
+        self.n_success += n_success
+        self.errors.extend(errors)
+
+        app.logger.debug("Bulk {} actions, {} errors".format(len(actions), len(errors)))
+        for error in errors:
+            app.logger.warning("Bulk action failed: {}".format(error))
 
 
 def search_index_skills(ids: List = None) -> dict:
     if len(ids) == 0:
         return dict()
 
-    es_host = app.config["ELASTICSEARCH_HOST"]
     index = app.config["ELASTICSEARCH_INDEX"]
 
-    es = Elasticsearch(es_host)
+    es = es_client.get_client()
     result = dict()
 
     try:
@@ -162,57 +854,11 @@ def search_index_skills(ids: List = None) -> dict:
 
 
 def get_document_content(document: Document) -> str:
-    content = None
-
-    path = document.path
-    if path is not None and not os.path.isabs(path):
-        path = os.path.join(app.instance_path, path)
-
-    app.logger.debug('get_document_content from {}'.format(path))
-
-    if document.content_type.endswith("/pdf") or document.content_type.endswith("x-pdf"):
-        try:
-            content = get_document_content_by_PyPDF2(document=document)
-        except (IOError, FileNotFoundError) as e:
-            app.logger.warning("Error {}: Failed parse file {}".format(
-                e.__class__.__name__, document.filename))
-    elif os.path.isabs(path):
-        try:
-            f = open(path, "r")
-            content = f.read()
-        except (IOError, FileNotFoundError) as e:
-            app.logger.warning("Error {}: Failed read file {}".format(
-                e.__class__.__name__, document.filename))
-        finally:
-            if f is not None:
-                f.close()
-
-    return content
-
-
-def get_document_content_by_PyPDF2(document: Document) -> str:
-    content = None
-
-    path = document.path
-    if path is not None and not os.path.isabs(path):
-        path = os.path.join(app.instance_path, path)
-
-    app.logger.debug('get_document_content_by_PyPDF2 from {}'.format(path))
-
-    if os.path.isabs(path):
-        try:
-            pdfFileObject = open(path, 'rb')
-            pdfReader = PyPDF2.PdfFileReader(pdfFileObject)
-            count = pdfReader.numPages
-            app.logger.debug('Document has {} page'.format(count))
-            pagesText = ""
-            for i in range(count):
-                page = pdfReader.getPage(i)
-                pageText = page.extractText()
-                pagesText += pageText
-            content = pagesText
-        except (IOError, FileNotFoundError) as e:
-            app.logger.warning("Error {}: PyPDF2 failed on file {}".format(
-                e.__class__.__name__, document.filename))
-
-    return content
+    """
+    Whole content of a document, None if it could not be read
+    """
+
+    content_stream = ContentStream(iter_document_content(document))
+    for part in content_stream:
+        pass
+    return content_stream.get_content()
@@ -0,0 +1,185 @@
+# project/server/extractor/text_cache.py
+
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+from typing import Iterable, Iterator, List, Tuple
+
+from flask import current_app as app
+
+READ_SIZE = 1024 * 1024
+
+
+def hash_file(path) -> str:
+    """
+    SHA-256 of a file content, read by chunks
+    """
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class TextCache(object):
+    """
+    Extracted text of documents stored gzip compressed by SHA-256 of the document file,
+    so a file already parsed, even uploaded by another user, is not parsed again.
+    Least recently used texts are removed when the store is over TEXT_CACHE_MAX_SIZE bytes.
+    """
+
+    def __init__(self):
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_writes = 0
+        self.n_evictions = 0
+        self._size = None  # bytes of the store, counted at first write
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return app.config["TEXT_CACHE_MAX_SIZE"] > 0
+
+    def get_dir(self) -> str:
+        cache_dir = app.config["TEXT_CACHE_FOLDER"]
+        if not os.path.isabs(cache_dir):
+            cache_dir = os.path.join(app.instance_path, cache_dir)
+        return cache_dir
+
+    def get_path(self, content_hash) -> str:
+        return os.path.join(self.get_dir(), content_hash[0:2], "{}.txt.gz".format(content_hash))
+
+    def iter_text(self, content_hash) -> Iterator[str]:
+        """
+        Cached text of a file content hash, None if it is not cached
+        """
+
+        path = self.get_path(content_hash)
+        if not os.path.isfile(path):
+            self.n_misses += 1
+            return None
+
+        self.n_hits += 1
+        try:
+            os.utime(path)  # recently used
+        except OSError:
+            pass
+        return self._read(path)
+
+    def _read(self, path) -> Iterator[str]:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8", errors="surrogatepass") as f:
+                for chunk in iter(lambda: f.read(READ_SIZE), ""):
+                    yield chunk
+        except (EOFError, OSError, zlib.error) as e:
+            app.logger.warning("Error {}: Remove broken cached text {}".format(
+                e.__class__.__name__, path))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            raise IOError("Broken cached text {}".format(path))
+
+    def write_through(self, content_hash, parts: Iterable[str]) -> Iterator[str]:
+        """
+        Pass parts of a text through and cache the text if all parts are read
+        """
+
+        path = self.get_path(content_hash)
+        tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+
+        f = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = gzip.open(tmp_path, "wt", encoding="utf-8", errors="surrogatepass")
+        except OSError as e:
+            app.logger.warning("Error {}: Failed cache text to {}".format(
+                e.__class__.__name__, tmp_path))
+
+        completed = False
+        try:
+            for part in parts:
+                if f is not None:
+                    try:
+                        f.write(part)
+                    except OSError as e:
+                        app.logger.warning("Error {}: Failed cache text to {}".format(
+                            e.__class__.__name__, tmp_path))
+                        f.close()
+                        f = None
+                yield part
+            completed = True
+        finally:
+            if f is not None:
+                try:
+                    f.close()
+                    if completed:
+                        os.replace(tmp_path, path)
+                        self.n_writes += 1
+                        self._added(os.path.getsize(path))
+                    else:
+                        os.remove(tmp_path)
+                except OSError as e:
+                    app.logger.warning("Error {}: Failed cache text to {}".format(
+                        e.__class__.__name__, path))
+
+    def _added(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(item[1] for item in self._scan())
+            else:
+                self._size += size
+
+            max_size = app.config["TEXT_CACHE_MAX_SIZE"]
+            if self._size <= max_size:
+                return
+
+            # Other processes write to the store too, count again before evict
+            items = sorted(self._scan())
+            self._size = sum(item[1] for item in items)
+            for mtime, size, path in items:
+                if self._size <= max_size * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    self._size -= size
+                    self.n_evictions += 1
+                except OSError:
+                    pass
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """
+        (modified time, size, path) of cached texts
+        """
+
+        items = []
+        for dirpath, dirnames, filenames in os.walk(self.get_dir()):
+            for filename in filenames:
+                if not filename.endswith(".txt.gz"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat_result = os.stat(path)
+                except OSError:
+                    continue
+                items.append((stat_result.st_mtime, stat_result.st_size, path))
+        return items
+
+    def metrics(self) -> dict:
+        n_reads = self.n_hits + self.n_misses
+        return {
+            "pid": os.getpid(),
+            "hits": self.n_hits,
+            "misses": self.n_misses,
+            "hit_ratio": self.n_hits / n_reads if n_reads > 0 else None,
+            "writes": self.n_writes,
+            "evictions": self.n_evictions,
+            "size": self._size,
+            "max_size": app.config["TEXT_CACHE_MAX_SIZE"],
+        }
+
+
+text_cache = TextCache()
@@ -0,0 +1,246 @@
+# project/server/extractor/uploads.py
+
+import os
+import hashlib
+import zipfile
+import tempfile
+from typing import Iterator, Tuple
+
+from flask import Request
+from flask import current_app as app
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge, UnsupportedMediaType
+
+ALLOWED_UPLOAD_EXTENSIONS = set(['txt', 'pdf', 'md'])
+ARCHIVE_EXTENSIONS = set(['zip'])  # of batch upload only
+BATCH_UPLOAD_ENDPOINTS = set(["extractor.document_upload_batch"])
+SNIFF_SIZE = 1024  # first bytes of a file to detect its content type
+READ_SIZE = 64 * 1024
+
+
+def get_extension(filename) -> str:
+    if filename is None or '.' not in filename:
+        return None
+    return filename.rsplit('.', 1)[1].lower()
+
+
+def get_upload_folder() -> str:
+    upload_dir = app.config['UPLOAD_FOLDER']
+    if not os.path.isabs(upload_dir):
+        upload_dir = os.path.join(app.instance_path, upload_dir)
+    return upload_dir
+
+
+def get_expected_content_type(filename) -> str:
+    extension = get_extension(filename)
+    if extension == "pdf":
+        return "application/pdf"
+    if extension in ARCHIVE_EXTENSIONS:
+        return "application/zip"
+    return "text/plain"
+
+
+def sniff_content_type(head: bytes) -> str:
+    """
+    Content type detected from the first bytes of a file: application/pdf, text/plain
+    or application/octet-stream
+    """
+
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "application/zip"
+    if b"\x00" in head:
+        return "application/octet-stream"
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # a character may be cut at the end of head
+        if e.start < len(head) - 3:
+            return "application/octet-stream"
+    return "text/plain"
+
+
+class UploadStream(object):
+    """
+    File of an uploaded file written chunk by chunk as the request body is parsed:
+    it is hashed, its content type is sniffed from the first bytes, and it is rejected
+    as soon as it is over max_size bytes or its content does not match its extension.
+    The file is removed when it is closed unless it was moved by move_to.
+    If strict is False, errors are kept in error instead of raised, and next writes
+    are ignored.
+    """
+
+    def __init__(self, dir, filename, max_size: int = None, strict=True):
+        os.makedirs(dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=dir, suffix=".upload")
+        self.file = os.fdopen(fd, "w+b")
+        self.filename = filename
+        self.max_size = max_size
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.head = b""
+        self.content_type = None  # sniffed
+        self.moved = False
+        self.strict = strict
+        self.error = None  # HTTPException which rejected the file
+
+    def reject(self, error: HTTPException):
+        self.close()
+        if self.strict:
+            raise error
+        self.error = error
+
+    def write(self, data: bytes):
+        if self.error is not None:
+            return
+
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.reject(RequestEntityTooLarge("File {} is larger than {} bytes".format(
+                self.filename, self.max_size)))
+            return
+
+        if self.content_type is None:
+            self.head += data[:SNIFF_SIZE - len(self.head)]
+            if len(self.head) >= SNIFF_SIZE and self.check_content_type() is None:
+                return
+
+        self.sha256.update(data)
+        self.file.write(data)
+
+    def check_content_type(self) -> str:
+        """
+        Sniff content type from the first bytes, reject the file if it is not the
+        content type of the file extension
+        - **return**::
+            :return: sniffed content type, None if the file is rejected
+        """
+
+        if self.error is not None:
+            return None
+        if self.content_type is not None:
+            return self.content_type
+
+        content_type = sniff_content_type(self.head)
+        expected = get_expected_content_type(self.filename)
+        if content_type != expected:
+            self.reject(UnsupportedMediaType("Content of {} is not {}".format(
+                self.filename, expected)))
+            return None
+        self.content_type = content_type
+        return content_type
+
+    @property
+    def content_hash(self) -> str:
+        return self.sha256.hexdigest()
+
+    def flush(self):
+        self.file.flush()
+
+    def move_to(self, path):
+        self.file.close()
+        os.replace(self.path, path)
+        self.path = path
+        self.moved = True
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        if not self.moved and os.path.exists(self.path):
+            os.remove(self.path)
+
+    # File of a rejected stream is removed, it reads as empty
+
+    def read(self, *args):
+        return b"" if self.error is not None else self.file.read(*args)
+
+    def readline(self, *args):
+        return b"" if self.error is not None else self.file.readline(*args)
+
+    def seek(self, *args):
+        return 0 if self.error is not None else self.file.seek(*args)
+
+    def tell(self):
+        return 0 if self.error is not None else self.file.tell()
+
+    def __iter__(self):
+        return iter([]) if self.error is not None else iter(self.file)
+
+
+def iter_zip_entries(path, dir, max_files: int, max_size: int = None) \
+        -> Iterator[Tuple[str, UploadStream]]:
+    """
+    Extract files of a zip archive one by one, each by chunks into an UploadStream
+    which checks its size and content as uploaded files. Entries over max_files,
+    of other extensions or declared larger than max_size are rejected unread.
+    Raise zipfile.BadZipFile if the archive is broken.
+    """
+
+    with zipfile.ZipFile(path) as archive:
+        n_files = 0
+        for info in archive.infolist():
+            filename = os.path.basename(info.filename)
+            if info.filename.endswith("/") or filename.startswith(".") \
+                    or info.filename.startswith("__MACOSX/"):
+                continue
+
+            n_files += 1
+            stream = UploadStream(dir, filename, max_size=max_size, strict=False)
+            if n_files > max_files:
+                stream.reject(RequestEntityTooLarge("Archive has more than {} files".format(
+                    max_files)))
+            elif get_extension(filename) not in ALLOWED_UPLOAD_EXTENSIONS:
+                stream.reject(UnsupportedMediaType("Please upload file extensions {}".format(
+                    ALLOWED_UPLOAD_EXTENSIONS)))
+            elif max_size is not None and info.file_size > max_size:
+                stream.reject(RequestEntityTooLarge("File {} is larger than {} bytes".format(
+                    filename, max_size)))
+            else:
+                # Sizes declared by the archive are not trusted, stream checks written bytes
+                with archive.open(info) as entry:
+                    for chunk in iter(lambda: entry.read(READ_SIZE), b""):
+                        stream.write(chunk)
+                        if stream.error is not None:
+                            break
+                stream.check_content_type()
+
+            yield filename, stream
+
+
+class UploadRequest(Request):
+    """
+    Request whose uploaded files are streamed by UploadStream into UPLOAD_FOLDER,
+    instead of buffered then copied. Files of a batch upload are not rejected
+    by an error, which is kept in their UploadStream.
+    """
+
+    @property
+    def is_batch_upload(self) -> bool:
+        return self.endpoint in BATCH_UPLOAD_ENDPOINTS
+
+    @property
+    def max_content_length(self):
+        if self.is_batch_upload:
+            return app.config["BATCH_UPLOAD_MAX_CONTENT_LENGTH"]
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        if not filename:
+            # no file selected
+            return super()._get_file_stream(total_content_length, content_type, filename,
+                                            content_length)
+
+        stream = UploadStream(os.path.join(get_upload_folder(), "tmp"), filename,
+                              max_size=app.config["MAX_CONTENT_LENGTH"],
+                              strict=not self.is_batch_upload)
+
+        allowed_extensions = ALLOWED_UPLOAD_EXTENSIONS
+        if self.is_batch_upload:
+            allowed_extensions = allowed_extensions | ARCHIVE_EXTENSIONS
+            stream.max_size = app.config["BATCH_UPLOAD_MAX_CONTENT_LENGTH"] \
+                if get_extension(filename) in ARCHIVE_EXTENSIONS else stream.max_size
+        if get_extension(filename) not in allowed_extensions:
+            stream.reject(UnsupportedMediaType("Please upload file extensions {}".format(
+                allowed_extensions)))
+        return stream
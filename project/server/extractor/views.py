@@ -2,29 +2,42 @@
 
 
 import os
+import json
+import zipfile
 import datetime
 
-from flask import render_template, Blueprint, flash, request, send_file
+from flask import (render_template, Blueprint, flash, request, send_file, jsonify, Response,
+                   stream_with_context)
 from flask import current_app as app
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import CombinedMultiDict
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
 
 from project.server.models import Document
 from project.server.extractor.forms import UploadForm, SearchForm
-from project.server.extractor.services import DocumentService, search_index_skills
-from project.server.extractor.indexes import search_index_content
+from project.server.extractor.services import DocumentService, save_upload, search_index_skills
+from project.server.extractor.indexes import search_user_documents
+from project.server.extractor.jobs import (
+    FINAL_STATES, find_jobs, format_jobs_cursor, iter_job_events, job_to_dict, parse_jobs_cursor,
+    wait_for_jobs)
+from project.server.extractor.uploads import (
+    ALLOWED_UPLOAD_EXTENSIONS, ARCHIVE_EXTENSIONS, UploadStream, get_extension, get_upload_folder,
+    iter_zip_entries)
 
 extractor_blueprint = Blueprint("extractor", __name__)
 
-ALLOWED_UPLOAD_EXTENSIONS = set(['txt', 'pdf', 'md'])
-
 
 @extractor_blueprint.route("/upload", methods=["GET", "POST"])
 @login_required
 def document_upload():
     """Upload document"""
-    form = UploadForm(CombinedMultiDict((request.files, request.form)))
+    try:
+        # Files are streamed to disk while the body is parsed, and rejected early
+        form = UploadForm(CombinedMultiDict((request.files, request.form)))
+    except (RequestEntityTooLarge, UnsupportedMediaType) as e:
+        flash(e.description, "danger")
+        return render_template("extractor/upload.html", form=UploadForm(formdata=None)), e.code
 
     if request.method == 'POST':
         if form.validate_on_submit():
@@ -44,22 +57,29 @@ def document_upload():
 
             filename = secure_filename(file.filename)
 
-            save_to_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(current_user.id))
-            if not os.path.isabs(save_to_dir):
-                save_to_dir = os.path.join(app.instance_path, save_to_dir)
-            if not os.path.exists(save_to_dir):
-                os.makedirs(save_to_dir)
+            save_to_dir = get_user_upload_dir(current_user.id)
 
             current_milli_time = datetime.datetime.now().microsecond
             save_to = os.path.join(save_to_dir, "{}-{}".format(str(current_milli_time), filename))
-            file.save(save_to)
+            content_type = file.content_type
+            if isinstance(file.stream, UploadStream):
+                try:
+                    sniffed_type = file.stream.check_content_type()
+                except UnsupportedMediaType as e:
+                    flash(e.description, "danger")
+                    return render_template("extractor/upload.html", form=form), e.code
+                content_type = choose_content_type(content_type, sniffed_type)
+                file.stream.move_to(save_to)
+                content_hash = file.stream.content_hash
+            else:
+                content_hash = save_upload(file, save_to)
 
             app.logger.info('{} uploaded file to {}'.format(current_user.email, save_to))
 
             documentService = DocumentService()
-            document = documentService.create(content_type=file.content_type, title=filename,
+            document = documentService.create(content_type=content_type, title=filename,
                                               created_by=current_user.id, filename=filename,
-                                              path=save_to)
+                                              path=save_to, content_hash=content_hash)
             app.logger.info("Call index_and_extract_skills asynch")
             documentService.index_and_extract_skills_async(document.id)
 
@@ -68,6 +88,94 @@ def document_upload():
     return render_template("extractor/upload.html", form=form)
 
 
+@extractor_blueprint.route("/upload/batch", methods=["POST"])
+@login_required
+def document_upload_batch():
+    """
+    Upload several files of field "files", zip archives are extracted. Documents are
+    inserted at once and extracted by one batched job.
+    - **return**::
+        :return: json of status of each file, and numbers of uploaded and rejected files
+    """
+
+    try:
+        # Each file is streamed to disk, a rejected file does not reject the others
+        files = request.files.getlist("files")
+    except RequestEntityTooLarge as e:
+        return jsonify(error=e.description), e.code
+
+    streams = [file.stream for file in files if isinstance(file.stream, UploadStream)]
+    if len(streams) == 0:
+        return jsonify(error="No selected file"), 400
+
+    save_to_dir = get_user_upload_dir(current_user.id)
+    max_files = app.config["BATCH_UPLOAD_MAX_FILES"]
+    prefix = datetime.datetime.now().microsecond
+    statuses = []  # status of each file, with row of its document if it is uploaded
+    rows = []
+
+    def add_file(filename, stream: UploadStream, content_type=None):
+        status = {"filename": filename}
+        statuses.append(status)
+        try:
+            if len(statuses) > max_files and stream.error is None:
+                stream.reject(RequestEntityTooLarge("Upload has more than {} files".format(
+                    max_files)))
+            sniffed_type = stream.check_content_type()
+            if stream.error is not None:
+                status.update(status="rejected", error=stream.error.description)
+                return
+
+            name = secure_filename(filename)
+            save_to = os.path.join(save_to_dir, "{}-{}-{}".format(prefix, len(statuses), name))
+            stream.move_to(save_to)
+        finally:
+            stream.close()
+
+        status["status"] = "uploaded"
+        rows.append((status, dict(content_type=choose_content_type(content_type, sniffed_type),
+                                  title=name, filename=name, path=save_to,
+                                  content_hash=stream.content_hash)))
+
+    try:
+        for file in files:
+            stream = file.stream
+            if not isinstance(stream, UploadStream):
+                continue
+            if get_extension(stream.filename) not in ARCHIVE_EXTENSIONS or stream.error is not None:
+                add_file(stream.filename, stream, file.content_type)
+                continue
+
+            if stream.check_content_type() is None:
+                statuses.append({"filename": stream.filename, "status": "rejected",
+                                 "error": stream.error.description})
+                continue
+            stream.flush()
+            try:
+                for filename, entry in iter_zip_entries(
+                        stream.path, os.path.dirname(stream.path),
+                        max_files=max(0, max_files - len(statuses)),
+                        max_size=app.config["MAX_CONTENT_LENGTH"]):
+                    add_file(filename, entry)
+            except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError) as e:
+                app.logger.warning("Error {}: Batch upload of {}".format(
+                    e.__class__.__name__, stream.filename))
+                statuses.append({"filename": stream.filename, "status": "rejected",
+                                 "error": "Archive is broken or not supported"})
+    finally:
+        for stream in streams:
+            stream.close()
+
+    documentService = DocumentService()
+    ids = documentService.create_many([row for status, row in rows], created_by=current_user.id)
+    for (status, row), id in zip(rows, ids):
+        status["id"] = id
+    app.logger.info("{} uploaded {} files by batch".format(current_user.email, len(ids)))
+    documentService.index_and_extract_skills_batch_async(ids)
+
+    return jsonify(files=statuses, uploaded=len(ids), rejected=len(statuses) - len(ids))
+
+
 @extractor_blueprint.route("/mydocuments", methods=["GET"])
 @login_required
 def mydocuments():
@@ -76,40 +184,145 @@ def mydocuments():
     form = SearchForm(request.form)
 
     q = request.args.get("q")
+    after = request.args.get("after")
+    start = request.args.get("start", 0, type=int)
     documents = None
-    total_documents = 0
+    next_cursor = None
+
+    documentService = DocumentService()
+    total_documents = documentService.count_by_user(current_user.id)
 
     if q is not None and len(q.strip()) > 0:
         form.q.data = q
-        ids = search_index_content(q)
-        ids = list(map(int, ids))
-
-        app.logger.debug("q: {}. ids: {}".format(q, ids))
-
-        documents = Document.query.filter(
-            Document.id.in_(ids)).order_by(Document.created_on.desc()).all()
-        total_documents = Document.query.filter_by(
-            created_by=current_user.id).count()
+        # Hits come with their skills, no query to database
+        documents, next_cursor = search_user_documents(
+            q, current_user.id, size=app.config["DOCUMENTS_PAGE_SIZE"], after=after)
+        app.logger.debug("q: {}. ids: {}".format(q, [doc.id for doc in documents]))
     else:
-        documents = Document.query.filter_by(
-            created_by=current_user.id).order_by(Document.created_on.desc()).all()
-        total_documents = len(documents)
+        documents, next_cursor = documentService.find_page_by_user(
+            current_user.id, app.config["DOCUMENTS_PAGE_SIZE"], after=after)
+        # Cached count may miss documents uploaded from other processes
+        total_documents = max(total_documents, start + len(documents))
+
+        ids = [doc.id for doc in documents]
+        skills_dict = search_index_skills(ids)
+        jobs = dict((job.document_id, job) for job in find_jobs(ids))
+        for document in documents:
+            document.path = None  # hide
+            try:
+                document.skills = skills_dict[document.id]
+            except KeyError:
+                document.skills = "Wait for index the document"
+            job = jobs.get(document.id)
+            document.job_state = job.state if job is not None else None
 
     app.logger.debug("Found {} my documents".format(len(documents)))
 
-    ids = [doc.id for doc in documents]
-    skills_dict = search_index_skills(ids)
     for document in documents:
-        document.path = None  # hide
-        try:
-            document.skills = skills_dict[document.id]
-            if len(document.skills) == 0:
-                document.skills = "Not found"
-        except KeyError:
-            document.skills = "Wait for index the document"
+        if document.skills is None:
+            document.skills = "Skills've not extracted yet"
+        elif len(document.skills) == 0:
+            document.skills = "Not found"
+
+    # Jobs not finished are followed by server-sent events instead of reloads
+    pending_ids = [document.id for document in documents
+                   if getattr(document, "job_state", None) not in FINAL_STATES | set([None])]
 
     return render_template("extractor/mydocuments.html", documents=documents,
-                           form=form, total_documents=total_documents)
+                           form=form, total_documents=total_documents, q=q,
+                           next_cursor=next_cursor, after=after, start=start,
+                           pending_ids=pending_ids)
+
+
+@extractor_blueprint.route("/jobs", methods=["GET"])
+@login_required
+def jobs_status():
+    """
+    Extraction jobs of my documents ?ids=1,2,... With ?wait=seconds, long poll: answer
+    when a job was updated after ?since=<cursor of previous response>, all jobs are
+    finished, or after wait seconds.
+    """
+
+    ids = parse_ids(request.args.get("ids"))
+    if len(ids) == 0:
+        return jsonify(error="ids is required"), 400
+
+    wait = max(0, min(request.args.get("wait", 0, type=float), app.config["JOB_STATUS_MAX_WAIT"]))
+    jobs, cursor = wait_for_jobs(ids, user_id=current_user.id,
+                                 since=parse_jobs_cursor(request.args.get("since")), timeout=wait)
+
+    return jsonify(jobs=[job_to_dict(job) for job in jobs], cursor=format_jobs_cursor(cursor),
+                   done=all(job.state in FINAL_STATES for job in jobs))
+
+
+@extractor_blueprint.route("/jobs/events", methods=["GET"])
+@login_required
+def jobs_events():
+    """
+    Server-sent events "job" of extraction jobs of my documents ?ids=1,2,... each time
+    they are updated, then "end" when all of them are finished. The stream is closed
+    after JOB_STATUS_MAX_WAIT seconds, EventSource reconnects from Last-Event-ID.
+    """
+
+    ids = parse_ids(request.args.get("ids"))
+    if len(ids) == 0:
+        return jsonify(error="ids is required"), 400
+
+    user_id = current_user.id
+    since = parse_jobs_cursor(request.headers.get("Last-Event-ID") or request.args.get("since"))
+
+    def generate():
+        yield "retry: {}\n\n".format(int(app.config["JOB_STATUS_POLL_INTERVAL"] * 1000))
+        for jobs, cursor in iter_job_events(ids, user_id=user_id, since=since,
+                                            timeout=app.config["JOB_STATUS_MAX_WAIT"]):
+            for job in jobs:
+                yield "id: {}\nevent: job\ndata: {}\n\n".format(
+                    format_jobs_cursor(cursor), json.dumps(job_to_dict(job)))
+
+        if all(job.state in FINAL_STATES for job in find_jobs(ids, user_id=user_id)):
+            yield "event: end\ndata: {}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@extractor_blueprint.route("/mydocuments/skills", methods=["GET"])
+@login_required
+def mydocuments_skills():
+    """Top skills of my documents, and my documents which have all skills of ?skill=..."""
+
+    skills = [skill for skill in request.args.getlist("skill") if len(skill) > 0]
+    limit = min(request.args.get("limit", 20, type=int), 1000)
+
+    documentService = DocumentService()
+    result = {
+        "skills": [{"name": name, "documents": n_documents}
+                   for name, n_documents in documentService.count_skills(
+                       current_user.id, skills=skills, limit=limit)]
+    }
+    if len(skills) > 0:
+        result["document_ids"] = documentService.find_ids_by_skills(
+            skills, user_id=current_user.id, limit=app.config["DOCUMENTS_PAGE_SIZE"])
+
+    return jsonify(result)
+
+
+@extractor_blueprint.route("/skills/aggregations", methods=["GET"])
+@login_required
+def skills_aggregations():
+    """
+    Numbers of my documents by skill, of all documents with ?all=true.
+    ?skill=... counts skills of documents which have the skill,
+    ?after=... continues all_skills from the "after" of the previous response.
+    """
+
+    user_id = None if request.args.get("all") == "true" else current_user.id
+    size = max(1, min(request.args.get("size", 20, type=int), 1000))
+
+    documentService = DocumentService()
+    return jsonify(documentService.aggregate_skills(
+        user_id=user_id, skill=request.args.get("skill") or None, size=size,
+        after=request.args.get("after") or None))
 
 
 @extractor_blueprint.route("/mydocuments/<id>", methods=["GET"])
@@ -131,6 +344,38 @@ def download_my_document(id):
     return render_template("errors/404.html")
 
 
+def parse_ids(ids: str) -> list:
+    """
+    Ids of a comma separated list, at most DOCUMENTS_PAGE_SIZE of them
+    """
+
+    result = []
+    for id in (ids or "").split(","):
+        try:
+            result.append(int(id))
+        except ValueError:
+            continue
+    return result[:app.config["DOCUMENTS_PAGE_SIZE"]]
+
+
+def get_user_upload_dir(user_id) -> str:
+    save_to_dir = os.path.join(get_upload_folder(), str(user_id))
+    if not os.path.exists(save_to_dir):
+        os.makedirs(save_to_dir)
+    return save_to_dir
+
+
+def choose_content_type(content_type, sniffed_type) -> str:
+    """
+    Content type sent by the client, unless it does not match the sniffed content
+    """
+
+    if sniffed_type == "application/pdf" or content_type is None \
+            or not content_type.startswith("text/"):
+        return sniffed_type
+    return content_type
+
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_UPLOAD_EXTENSIONS
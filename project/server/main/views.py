@@ -1,7 +1,12 @@
 # project/server/main/views.py
 
 
-from flask import render_template, Blueprint
+from flask import render_template, Blueprint, jsonify, Response
+from flask import current_app as app
+
+from project.server import es_client
+from project.server.metrics import get_metrics_dir, registry, render_text
+from project.server.extractor.text_cache import text_cache
 
 
 main_blueprint = Blueprint("main", __name__)
@@ -15,3 +20,26 @@ def home():
 @main_blueprint.route("/about/")
 def about():
     return render_template("main/about.html")
+
+
+@main_blueprint.route("/metrics")
+def metrics():
+    """
+    Stage timings and counters of web and celery worker processes of this host,
+    in the Prometheus text format
+    """
+
+    snapshot = registry.collect(get_metrics_dir(), max_age=app.config["METRICS_MAX_AGE"])
+    return Response(render_text(snapshot), mimetype="text/plain; version=0.0.4")
+
+
+@main_blueprint.route("/metrics/elasticsearch")
+def elasticsearch_metrics():
+    """Connection reuse of the shared Elasticsearch client of this process"""
+    return jsonify(es_client.metrics())
+
+
+@main_blueprint.route("/metrics/text-cache")
+def text_cache_metrics():
+    """Hits and misses of the extracted text cache of this process"""
+    return jsonify(text_cache.metrics())
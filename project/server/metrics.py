@@ -0,0 +1,392 @@
+# project/server/metrics.py
+
+
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List
+
+from flask import g, request
+from flask import current_app as app
+
+# seconds, from fast stages of small documents to whole tasks of large ones
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+                   60, 120, 300, 600)
+QUEUE_WAIT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200,
+                      21600)
+
+
+class Counter(object):
+    """
+    Sum of values by label values, as a Prometheus counter
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = dict()  # dict by label values to sum
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {"type": self.type, "help": self.help, "labelnames": list(self.labelnames),
+                "samples": samples}
+
+
+class Histogram(object):
+    """
+    Number of observations in buckets, their sum and count by label values,
+    as a Prometheus histogram. Quantiles are estimated from buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = dict()  # dict by label values to [counts of buckets and +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                item = self._values[key] = [[0] * (len(self.buckets) + 1), 0]
+            item[0][i] += 1
+            item[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = [[list(key), {"counts": list(counts), "sum": total}]
+                       for key, (counts, total) in self._values.items()]
+        return {"type": self.type, "help": self.help, "labelnames": list(self.labelnames),
+                "buckets": list(self.buckets), "samples": samples}
+
+
+class StageTimer(object):
+    """
+    Seconds spent in named stages of one job. Time spent by a consumer in next() of
+    an iterator is counted to a stage too, e.g. parsing of pages read while matching.
+    """
+
+    def __init__(self):
+        self.seconds = dict()
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+
+    @contextmanager
+    def time(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def iter(self, stage, iterable: Iterable) -> Iterator:
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - started)
+                return
+            self.add(stage, time.perf_counter() - started)
+            yield item
+
+    def get(self, stage) -> float:
+        return self.seconds.get(stage, 0)
+
+
+class MetricsRegistry(object):
+    """
+    Metrics of this process. Each process dumps them to METRICS_FOLDER every
+    METRICS_DUMP_INTERVAL seconds, so the metrics endpoint of any web process
+    sums metrics of all web and celery worker processes of the host.
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.app = None
+        self._last_dump = 0
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelnames: Iterable[str] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames: Iterable[str] = (),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(start_request_timer)
+        app.after_request(observe_request)
+
+        from celery.signals import task_prerun, task_postrun
+        task_prerun.connect(start_task_timer, weak=False)
+        task_postrun.connect(observe_task, weak=False)
+
+    def snapshot(self) -> dict:
+        return OrderedDict((name, metric.snapshot()) for name, metric in self.metrics.items())
+
+    def dump(self, metrics_dir):
+        """
+        Write metrics of this process to <pid>.json of metrics_dir
+        """
+
+        os.makedirs(metrics_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=metrics_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, os.path.join(metrics_dir, "{}.json".format(os.getpid())))
+
+    def dump_if_due(self, metrics_dir, interval):
+        now = time.time()
+        if now - self._last_dump < interval or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_dump = now
+            self.dump(metrics_dir)
+        except OSError as e:
+            app.logger.warning("Error {}: Failed dump metrics to {}".format(
+                e.__class__.__name__, metrics_dir))
+        finally:
+            self._lock.release()
+
+    def collect(self, metrics_dir, max_age=None) -> dict:
+        """
+        Sum of metrics of this process and metrics dumped by other processes.
+        Dumps older than max_age seconds, of processes which are gone, are removed.
+        """
+
+        snapshots = [self.snapshot()]
+        own_file = "{}.json".format(os.getpid())
+        try:
+            filenames = os.listdir(metrics_dir)
+        except FileNotFoundError:
+            filenames = []
+        for filename in filenames:
+            if not filename.endswith(".json") or filename == own_file:
+                continue
+            path = os.path.join(metrics_dir, filename)
+            try:
+                if max_age is not None and time.time() - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                app.logger.debug("Error {}: Skip metrics {}".format(e.__class__.__name__, path))
+        return merge_snapshots(snapshots)
+
+
+def merge_snapshots(snapshots: List[dict]) -> dict:
+    """
+    Sum counters and histograms of the same name and label values
+    """
+
+    merged = OrderedDict()
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = dict(metric, samples=[])
+                target["_by_key"] = dict()
+            elif metric.get("buckets") != target.get("buckets"):
+                continue  # buckets changed between versions of processes
+
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                current = target["_by_key"].get(key)
+                if current is None:
+                    value = dict(value, counts=list(value["counts"])) \
+                        if isinstance(value, dict) else value
+                    sample = [labels, value]
+                    target["_by_key"][key] = sample
+                    target["samples"].append(sample)
+                elif isinstance(value, dict):
+                    current[1]["counts"] = [a + b for a, b in zip(current[1]["counts"],
+                                                                  value["counts"])]
+                    current[1]["sum"] += value["sum"]
+                else:
+                    current[1] += value
+
+    for metric in merged.values():
+        del metric["_by_key"]
+    return merged
+
+
+def render_text(snapshot: dict) -> str:
+    """
+    Metrics in the Prometheus text exposition format
+    """
+
+    def format_labels(names, values, extra=None):
+        pairs = ['{}="{}"'.format(name, escape_label(value)) for name, value in zip(names, values)]
+        if extra is not None:
+            pairs.append('{}="{}"'.format(*extra))
+        return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append("# HELP {} {}".format(name, metric["help"]))
+        lines.append("# TYPE {} {}".format(name, metric["type"]))
+        names = metric["labelnames"]
+        for labels, value in metric["samples"]:
+            if metric["type"] == "counter":
+                lines.append("{}{} {}".format(name, format_labels(names, labels), value))
+                continue
+
+            cumulative = 0
+            for le, count in zip(metric["buckets"] + ["+Inf"], value["counts"]):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(
+                    name, format_labels(names, labels, ("le", le)), cumulative))
+            lines.append("{}_sum{} {}".format(name, format_labels(names, labels), value["sum"]))
+            lines.append("{}_count{} {}".format(name, format_labels(names, labels), cumulative))
+    return "\n".join(lines) + "\n"
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def estimate_quantile(buckets: List[float], counts: List[int], q: float) -> float:
+    """
+    Quantile q of a histogram interpolated in its bucket, as Prometheus
+    histogram_quantile does. Observations above the last bucket count as the last bucket.
+    """
+
+    total = sum(counts)
+    if total == 0:
+        return None
+
+    rank = q * total
+    cumulative = 0
+    for i, count in enumerate(counts):
+        if count > 0 and cumulative + count >= rank:
+            if i >= len(buckets):
+                return buckets[-1]
+            lower = buckets[i - 1] if i > 0 else 0
+            return lower + (buckets[i] - lower) * (rank - cumulative) / count
+        cumulative += count
+    return buckets[-1]
+
+
+def summarize_histograms(snapshot: dict, quantiles=(0.5, 0.99)) -> List[dict]:
+    """
+    Count, mean and quantiles of each histogram and label values
+    """
+
+    result = []
+    for name, metric in snapshot.items():
+        if metric["type"] != "histogram":
+            continue
+        for labels, value in metric["samples"]:
+            count = sum(value["counts"])
+            item = OrderedDict([("metric", name)])
+            item.update(zip(metric["labelnames"], labels))
+            item["count"] = count
+            item["mean"] = value["sum"] / count if count > 0 else None
+            for q in quantiles:
+                item["p{}".format(int(q * 100))] = estimate_quantile(
+                    metric["buckets"], value["counts"], q)
+            result.append(item)
+    return result
+
+
+def get_metrics_dir() -> str:
+    metrics_dir = app.config["METRICS_FOLDER"]
+    if not os.path.isabs(metrics_dir):
+        metrics_dir = os.path.join(app.instance_path, metrics_dir)
+    return metrics_dir
+
+
+def dump_metrics_if_due():
+    if app.config["METRICS_DUMP_INTERVAL"] >= 0:
+        registry.dump_if_due(get_metrics_dir(), app.config["METRICS_DUMP_INTERVAL"])
+
+
+def start_request_timer():
+    g.metrics_request_started = time.perf_counter()
+
+
+def observe_request(response):
+    started = g.pop("metrics_request_started", None)
+    if started is not None:
+        endpoint = request.endpoint or "none"
+        http_request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+        http_requests_total.inc(endpoint=endpoint, status=response.status_code)
+    dump_metrics_if_due()
+    return response
+
+
+_task_started = dict()  # dict by task id to perf_counter at start
+
+
+def start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+def observe_task(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        task_seconds.observe(time.perf_counter() - started, task=task.name, state=state)
+    if registry.app is not None:
+        # Tasks run in an app context which is popped before task_postrun
+        with registry.app.app_context():
+            dump_metrics_if_due()
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    "extractor_stage_seconds", "Seconds of each stage of the skills extraction of a document",
+    ["stage"])
+elasticsearch_request_seconds = registry.histogram(
+    "elasticsearch_request_seconds", "Seconds of each Elasticsearch request", ["operation"])
+queue_wait_seconds = registry.histogram(
+    "extractor_queue_wait_seconds", "Seconds from queueing a document to the start of its job",
+    buckets=QUEUE_WAIT_BUCKETS)
+task_seconds = registry.histogram(
+    "celery_task_seconds", "Seconds of each celery task run", ["task", "state"])
+http_request_seconds = registry.histogram(
+    "http_request_seconds", "Seconds of each HTTP request", ["endpoint"])
+http_requests_total = registry.counter(
+    "http_requests_total", "HTTP requests", ["endpoint", "status"])
+jobs_total = registry.counter(
+    "extractor_jobs_total", "Jobs of documents entering each state", ["state"])
+bytes_total = registry.counter("extractor_bytes_total", "Bytes of document files parsed")
+characters_total = registry.counter(
+    "extractor_characters_total", "Characters of document text matched")
+pages_total = registry.counter("extractor_pages_total", "Pages of pdf documents parsed")
+skills_matched_total = registry.counter(
+    "extractor_skills_matched_total", "Skills and matched strings extracted from documents")
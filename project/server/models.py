@@ -48,6 +48,9 @@ class Document(db.Model):
     """
 
     __tablename__ = "documents"
+    __table_args__ = (
+        db.Index("ix_documents_created_by_created_on_id", "created_by", "created_on", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     content_type = db.Column(db.String(255), nullable=False)
@@ -56,14 +59,16 @@ class Document(db.Model):
     created_by = db.Column(db.Integer, nullable=True)  # User.id
     filename = db.Column(db.String(1000), nullable=True)
     path = db.Column(db.String(1255), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 of file
 
-    def __init__(self, content_type, title, created_by, filename, path):
+    def __init__(self, content_type, title, created_by, filename, path, content_hash=None):
         self.content_type = content_type
         self.title = title
         self.created_on = datetime.datetime.now()
         self.created_by = created_by
         self.filename = filename
         self.path = path
+        self.content_hash = content_hash
 
     def get_id(self):
         return self.id
@@ -76,3 +81,95 @@ class Document(db.Model):
 
     def get_content(self):
         return self.content
+
+
+class DocumentSkill(db.Model):
+    """
+    Skill extracted from a document, one row by skill and matched string
+    """
+
+    __tablename__ = "document_skills"
+    __table_args__ = (
+        db.Index("ix_document_skills_skill_document_id", "skill", "document_id"),
+        db.Index("ix_document_skills_created_by_skill_document_id",
+                 "created_by", "skill", "document_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    document_id = db.Column(db.Integer, nullable=False, index=True)  # Document.id
+    created_by = db.Column(db.Integer, nullable=True)  # Document.created_by
+    skill = db.Column(db.String(255), nullable=False)
+    match_str = db.Column(db.String(255), nullable=False)
+    n_match = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, document_id, created_by, skill, match_str, n_match):
+        self.document_id = document_id
+        self.created_by = created_by
+        self.skill = skill
+        self.match_str = match_str
+        self.n_match = n_match
+
+    def __repr__(self):
+        return "<DocumentSkill {0} {1}>".format(self.document_id, self.skill)
+
+
+class DeadLetter(db.Model):
+    """
+    Task of a document which failed for good, to inspect and replay
+    """
+
+    __tablename__ = "dead_letters"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    task_name = db.Column(db.String(255), nullable=False)
+    args = db.Column(db.Text, nullable=False)  # JSON list
+    document_id = db.Column(db.Integer, nullable=False, index=True)  # Document.id
+    error_type = db.Column(db.String(255), nullable=False)
+    error = db.Column(db.Text, nullable=True)
+    retries = db.Column(db.Integer, nullable=False, default=0)
+    created_on = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, task_name, args, document_id, error_type, error, retries=0):
+        self.task_name = task_name
+        self.args = args
+        self.document_id = document_id
+        self.error_type = error_type
+        self.error = error
+        self.retries = retries
+        self.created_on = datetime.datetime.now()
+
+    def __repr__(self):
+        return "<DeadLetter {0} {1}>".format(self.task_name, self.document_id)
+
+
+class DocumentJob(db.Model):
+    """
+    State of the last extraction job of a document, with the time it entered each state
+    """
+
+    __tablename__ = "document_jobs"
+
+    QUEUED = "queued"
+    PARSING = "parsing"
+    MATCHING = "matching"
+    INDEXED = "indexed"
+    FAILED = "failed"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    document_id = db.Column(db.Integer, nullable=False, unique=True)  # Document.id
+    state = db.Column(db.String(32), nullable=False)
+    error = db.Column(db.Text, nullable=True)
+    queued_on = db.Column(db.DateTime, nullable=False)
+    parsing_on = db.Column(db.DateTime, nullable=True)
+    matching_on = db.Column(db.DateTime, nullable=True)
+    finished_on = db.Column(db.DateTime, nullable=True)  # indexed or failed
+    updated_on = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, document_id, state=QUEUED):
+        self.document_id = document_id
+        self.state = state
+        self.queued_on = datetime.datetime.now()
+        self.updated_on = self.queued_on
+
+    def __repr__(self):
+        return "<DocumentJob {0} {1}>".format(self.document_id, self.state)
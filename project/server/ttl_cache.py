@@ -0,0 +1,48 @@
+# project/server/ttl_cache.py
+
+
+import threading
+import time
+
+
+class TTLCache(object):
+    """
+    Small in-process cache, values expire after ttl seconds. The oldest value is
+    dropped when there are more than max_size values.
+    """
+
+    def __init__(self, ttl=60, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._values = dict()  # dict by key to (expire time, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        item = self._values.get(key)
+        if item is None or item[0] < time.time():
+            return default
+        return item[1]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            if key not in self._values and len(self._values) >= self.max_size:
+                oldest_key = min(self._values, key=lambda k: self._values[k][0])
+                del self._values[oldest_key]
+            self._values[key] = (time.time() + ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def get_or_set(self, key, func, ttl=None):
+        """
+        Cached value of key, or call func to get the value and cache it
+        """
+
+        value = self.get(key, self)
+        if value is self:
+            value = func()
+            self.set(key, value, ttl=ttl)
+        return value
@@ -34,6 +34,12 @@ class TestTestingConfig(TestCase):
         self.assertTrue(app.config["BCRYPT_LOG_ROUNDS"] == 4)
         self.assertTrue(app.config["WTF_CSRF_ENABLED"] is False)
 
+    def test_task_routes(self):
+        routes = app.config["CELERY_ROUTES"]
+        self.assertEqual(routes["tasks.index_and_extract_skills"]["queue"], "interactive")
+        self.assertEqual(routes["tasks.reextract_skills"]["queue"], "bulk")
+        self.assertTrue(app.config["INTERACTIVE_TASK_PRIORITY"] > app.config["BULK_TASK_PRIORITY"])
+
 
 class TestProductionConfig(TestCase):
     def create_app(self):
@@ -1,11 +1,42 @@
 # project/server/tests/test_user.py
 
 
+import io
+import os
+import hashlib
+import tempfile
+import time
+import zipfile
 import unittest
 
+from werkzeug.datastructures import FileStorage
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import bulk
+
 from base import BaseTestCase
-from project.server.models import User, Document
-from project.server.extractor.services import index_and_extract_skills
+from project.server import db
+from project.server.models import User, Document, DocumentJob, DocumentSkill
+from project.server.extractor.services import (
+    BulkIndexer, DocumentService, get_document_content, index_and_extract_skills, index_doc,
+    iter_document_ids, iter_extract_index_docs, rank_skill_extracts, save_document_skills,
+    save_upload, update_index_doc)
+from project.server.extractor.contents import ContentStream
+from project.server.extractor.batcher import IdBatcher
+from project.server.extractor.jobs import find_jobs, job_to_dict, set_jobs_state
+from project.server.extractor.uploads import UploadStream, iter_zip_entries, sniff_content_type
+from project.server.extractor.parallel import count_by_chunks
+from project.server.extractor.retries import (
+    get_open_circuit_document_ids, get_retry_delay, is_transient_error, save_dead_letters)
+from project.server.extractor.text_cache import text_cache
+from project.server.extractor.ontologies import (
+    OntNode, OntologyRegistry, compile_ontology, load_ontology)
+from project.server.extractor.matcher import SkillMatcher
+from project.server.extractor.benchmarks import (
+    compare_results, create_stand_in_client, regex_match, run_suite)
+from project.server.extractor.indexes import (
+    SkillExtract, build_content_query, build_skills_aggregations_body, extract_skills_in_content,
+    format_search_cursor, parse_search_cursor)
+from project.server.extractor.mappings import INDEX_MAPPINGS, get_versioned_index
 
 
 class TestUserBlueprint(BaseTestCase):
@@ -67,5 +98,517 @@ class TestUserBlueprint(BaseTestCase):
             )
 
 
+class TestExtractSkills(BaseTestCase):
+
+    def test_extract_skills_in_content(self):
+        """Test extract skills on text without Elasticsearch."""
+        skill_extracts = extract_skills_in_content(
+            "This is a file for java developer. You should see skill java")
+
+        self.assertIn("Java", [skill_extract.name for skill_extract in skill_extracts])
+        self.assertIsNotNone(skill_extracts[0].ontology_version)
+        self.assertEqual(extract_skills_in_content(None), [])
+
+    def test_compile_ontology(self):
+        """Test compiled ontology is loaded with the same skills."""
+        skills_resource_dir = os.path.join(self.app.root_path, "resources/ontologies")
+        with tempfile.TemporaryDirectory() as artifact_dir:
+            artifact_path, ontology = compile_ontology(skills_resource_dir, artifact_dir)
+            self.assertTrue(os.path.isfile(artifact_path))
+
+            loaded = load_ontology(skills_resource_dir, artifact_dir)
+            self.assertEqual(loaded.version, ontology.version)
+            self.assertEqual(loaded.skill_matcher.terms, ontology.skill_matcher.terms)
+            self.assertEqual([node.parents for node in loaded.skill_nodes],
+                             [node.parents for node in ontology.skill_nodes])
+
+    def test_ontology_registry_reloads_changed_files(self):
+        """Test ontology is replaced after its files change, the old one is kept by callers."""
+        ontology_file = os.path.join(self.app.root_path,
+                                     "resources/ontologies/skills-example.owl.ttl")
+        with tempfile.TemporaryDirectory() as skills_resource_dir:
+            with open(ontology_file, "rb") as f:
+                content = f.read()
+            with open(os.path.join(skills_resource_dir, "skills.ttl"), "wb") as f:
+                f.write(content)
+
+            registry = OntologyRegistry(skills_resource_dir)
+            ontology = registry.get()
+            self.assertEqual(len([n for n in ontology.skill_nodes if n.name == "Kotlin"]), 0)
+
+            with open(os.path.join(skills_resource_dir, "skills.ttl"), "ab") as f:
+                f.write(b"\n:Kotlin rdf:type owl:Class ;\n    rdfs:subClassOf :Java .\n")
+            registry.check()
+            while registry._reloading:
+                time.sleep(0.01)
+
+            self.assertNotEqual(registry.get().version, ontology.version)
+            self.assertEqual(
+                len([n for n in registry.get().skill_nodes if n.name == "Kotlin"]), 1)
+            self.assertEqual(len([n for n in ontology.skill_nodes if n.name == "Kotlin"]), 0)
+
+    def test_get_document_content_by_page_chunks(self):
+        """Test pdf pages extracted by a process pool give the same content."""
+        path = os.path.abspath("project/tests/upload_files/codeconventions-150003.pdf")
+        document = Document(content_type="application/pdf", title="codeconventions.pdf",
+                            created_by=1, filename="codeconventions.pdf", path=path)
+        content = get_document_content(document)
+        self.assertTrue(len(content) > 0)
+
+        config = dict(self.app.config)
+        self.app.config.update(PDF_PARALLEL_MIN_PAGES=1, PDF_PARALLEL_CHUNK_PAGES=5)
+        try:
+            self.assertEqual(get_document_content(document), content)
+        finally:
+            self.app.config.update(
+                PDF_PARALLEL_MIN_PAGES=config["PDF_PARALLEL_MIN_PAGES"],
+                PDF_PARALLEL_CHUNK_PAGES=config["PDF_PARALLEL_CHUNK_PAGES"])
+
+    def test_text_cache(self):
+        """Test text of a file is parsed once, then read from cache until evicted."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            config = dict(self.app.config)
+            self.app.config.update(TEXT_CACHE_FOLDER=cache_dir)
+            try:
+                path = os.path.join(cache_dir, "java.txt")
+                with open(path, "w") as f:
+                    f.write("java developer")
+                document = Document(content_type="text/plain", title="java.txt",
+                                    created_by=1, filename="java.txt", path=path)
+                n_hits = text_cache.n_hits
+
+                self.assertEqual(get_document_content(document), "java developer")
+                self.assertEqual(get_document_content(document), "java developer")
+                self.assertEqual(text_cache.n_hits, n_hits + 1)
+
+                self.app.config.update(TEXT_CACHE_MAX_SIZE=1)
+                with open(path, "w") as f:
+                    f.write("docker")
+                self.assertEqual(get_document_content(document), "docker")
+                self.assertEqual(text_cache._scan(), [])
+            finally:
+                self.app.config.update(TEXT_CACHE_FOLDER=config["TEXT_CACHE_FOLDER"],
+                                       TEXT_CACHE_MAX_SIZE=config["TEXT_CACHE_MAX_SIZE"])
+
+    def test_save_upload_hashes_content(self):
+        """Test uploaded file is saved with SHA-256 of its content."""
+        with tempfile.TemporaryDirectory() as upload_dir:
+            path = os.path.join(upload_dir, "java.txt")
+            content_hash = save_upload(FileStorage(io.BytesIO(b"java developer")), path)
+
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"java developer")
+            self.assertEqual(content_hash, hashlib.sha256(b"java developer").hexdigest())
+
+    def test_content_stream(self):
+        """Test words are counted across parts and indexed content is cut."""
+        content_stream = ContentStream(["java deve", "loper and ", "docker"], max_length=12)
+
+        self.assertEqual("".join(content_stream), "java developer and docker")
+        self.assertEqual(content_stream.n_words, 4)
+        self.assertEqual(content_stream.get_content(), "java develop")
+
+    def test_bulk_indexer_buffers_writes(self):
+        """Test index and update are buffered until flush."""
+        bulk_indexer = BulkIndexer(chunk_size=10)
+        index_doc(1, {"id": 1, "title": "java.txt"}, bulk_indexer=bulk_indexer)
+        update_index_doc(1, {"skills": ["Java"]}, bulk_indexer=bulk_indexer)
+
+        self.assertEqual([action["_op_type"] for action in bulk_indexer.actions],
+                         ["index", "update"])
+        self.assertEqual(bulk_indexer.actions[1]["doc"], {"skills": ["Java"]})
+
+    def test_build_content_query(self):
+        """Test substring search uses n-gram fields of the index mappings."""
+        properties = INDEX_MAPPINGS["document"]["properties"]
+        self.assertEqual(properties["content"]["fields"]["ngram"]["analyzer"], "trigram")
+        self.assertEqual(get_versioned_index("prod-index"), "prod-index-v1")
+
+        should = build_content_query("ava")["bool"]["should"]
+        self.assertEqual(should[1]["multi_match"]["fields"], ["title.ngram^2", "content.ngram"])
+        should = build_content_query("ja")["bool"]["should"]
+        self.assertEqual(should[1]["multi_match"]["type"], "phrase_prefix")
+
+    def test_document_skills(self):
+        """Test documents are filtered and skills are counted on saved skills."""
+        documentService = DocumentService()
+        documents = [documentService.create(content_type="text/plain", title="{}.txt".format(i),
+                                            created_by=1, filename="{}.txt".format(i), path=None)
+                     for i in range(3)]
+        save_document_skills(documents[0], [SkillExtract("Java", "java", 2),
+                                            SkillExtract("Docker", "docker", 1)])
+        save_document_skills(documents[1], [SkillExtract("Java", "jvm", 1),
+                                            SkillExtract("Java", "jvm", 1)])
+        save_document_skills(documents[2], [SkillExtract("Docker", "docker", 1)])
+        save_document_skills(documents[2], [SkillExtract("Python", "python", 3)])
+
+        document_skill = DocumentSkill.query.filter_by(document_id=documents[1].id).one()
+        self.assertEqual(document_skill.n_match, 2)
+        self.assertEqual(documentService.find_ids_by_skills(["Java", "Docker"]), [documents[0].id])
+        self.assertEqual(documentService.find_ids_by_skills(["Java"], user_id=2), [])
+        self.assertEqual(documentService.count_skills(user_id=1),
+                         [("Java", 2), ("Docker", 1), ("Python", 1)])
+        self.assertEqual(documentService.count_skills(user_id=1, skills=["Docker"]),
+                         [("Docker", 1), ("Java", 1)])
+
+    def test_build_skills_aggregations_body(self):
+        """Test skill aggregations are on keyword fields and filtered by user and skill."""
+        body = build_skills_aggregations_body(user_id=1, skill="Java", size=10, after="Docker")
+
+        self.assertEqual(body["query"]["bool"]["filter"], [
+            {"term": {"created_by": 1}}, {"term": {"skill_extracts.name.keyword": "Java"}}])
+        self.assertEqual(body["aggs"]["skills"]["terms"]["field"], "skills.keyword")
+        self.assertEqual(body["aggs"]["skills"]["terms"]["exclude"], ["Java"])
+        self.assertEqual(body["aggs"]["all_skills"]["composite"]["after"], {"skill": "Docker"})
+
+    def test_rank_skill_extracts(self):
+        """Test skills are ranked by matches weighted by the title, top N only."""
+        document = Document(content_type="text/plain", title="docker-notes.txt", created_by=1,
+                            filename="docker-notes.txt", path=None)
+        skill_extracts = [SkillExtract("Java", "java", 3), SkillExtract("Java", "jvm", 2),
+                          SkillExtract("Docker", "docker", 2), SkillExtract("Python", "python", 1)]
+
+        self.app.config["SKILLS_TOP_N"] = 2
+        try:
+            ranked = rank_skill_extracts(document, skill_extracts)
+        finally:
+            self.app.config["SKILLS_TOP_N"] = 5
+
+        self.assertEqual(ranked["skills"], ["Docker", "Java"])
+        self.assertEqual(len(ranked["skill_extracts"]), 4)
+
+    def test_iter_extract_index_docs(self):
+        """Test documents of a batch extracted by threads give the same docs in order."""
+        ontology = load_ontology(os.path.join(self.app.root_path, "resources/ontologies"))
+        documents = []
+        for i, text in enumerate(["java developer", "python and docker", "no skill"]):
+            path = os.path.join(tempfile.mkdtemp(), "{}.txt".format(i))
+            with open(path, "w") as f:
+                f.write(text)
+            documents.append(Document(content_type="text/plain", title="{}.txt".format(i),
+                                      created_by=1, filename="{}.txt".format(i), path=path))
+        documents.append(Document(content_type="text/plain", title="none.txt", created_by=1,
+                                  filename="none.txt", path=None))
+
+        config = dict(self.app.config)
+        self.app.config.update(EXTRACT_BATCH_WORKERS=1, TEXT_CACHE_MAX_SIZE=0)
+        try:
+            serial = [(document, result[0]) for document, result
+                      in iter_extract_index_docs(documents, ontology)]
+            self.app.config.update(EXTRACT_BATCH_WORKERS=2)
+            parallel = [(document, result[0]) for document, result
+                        in iter_extract_index_docs(documents, ontology)]
+        finally:
+            self.app.config.update(EXTRACT_BATCH_WORKERS=config["EXTRACT_BATCH_WORKERS"],
+                                   TEXT_CACHE_MAX_SIZE=config["TEXT_CACHE_MAX_SIZE"])
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual([document for document, doc in parallel], documents)
+        self.assertIn("Java", serial[0][1]["skills"])
+
+    def test_count_by_chunks(self):
+        """Test chunks matched by a process pool give the same counts."""
+        ontology = load_ontology(os.path.join(self.app.root_path, "resources/ontologies"))
+        skill_matcher = ontology.skill_matcher
+        content = "java,java-developer; c++ and docker. " * 50
+        parts = [content[i:i + 7] for i in range(0, len(content), 7)]
+
+        for chunk_length in (1, 5, 64, len(content)):
+            self.assertEqual(count_by_chunks(skill_matcher, parts, chunk_length, 2),
+                             skill_matcher.count(content))
+
+    def test_id_batcher(self):
+        """Test ids are sent by batches of max size, or after the window."""
+        batches = []
+        batcher = IdBatcher(batches.append)
+
+        for id in range(5):
+            batcher.add(id, max_size=2, window=60)
+        self.assertEqual(batches, [[0, 1], [2, 3]])
+        batcher.flush()
+        self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+
+        batcher.add(5, max_size=2, window=0.01)
+        time.sleep(0.2)
+        self.assertEqual(batches[-1], [5])
+        batcher.add(6, max_size=2, window=0)
+        self.assertEqual(batches[-1], [6])
+
+    def test_classified_retries(self):
+        """Test transient errors are retried with backoff, documents failing often are skipped."""
+        from elasticsearch.exceptions import ConnectionError, TransportError
+        from PyPDF2.utils import PdfReadError
+
+        self.assertTrue(is_transient_error(ConnectionError("N/A", "refused", None)))
+        self.assertTrue(is_transient_error(TransportError(429, "too many requests", None)))
+        self.assertFalse(is_transient_error(TransportError(400, "bad request", None)))
+        self.assertFalse(is_transient_error(PdfReadError("EOF marker not found")))
+
+        max_delay = self.app.config["TASK_RETRY_MAX_DELAY"]
+        for retries in range(20):
+            delay = get_retry_delay(retries)
+            backoff = min(max_delay, self.app.config["TASK_RETRY_BASE_DELAY"] * 2 ** retries)
+            self.assertTrue(backoff / 2 <= delay <= backoff)
+
+        for i in range(self.app.config["DOCUMENT_CIRCUIT_THRESHOLD"]):
+            self.assertEqual(get_open_circuit_document_ids([1, 2]), set())
+            save_dead_letters([1], PdfReadError("EOF marker not found"))
+        self.assertEqual(get_open_circuit_document_ids([1, 2]), {1})
+
+    def test_upload_stream(self):
+        """Test uploaded file is hashed, sniffed and size limited while it is written."""
+        from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+        self.assertEqual(sniff_content_type(b"%PDF-1.4 ..."), "application/pdf")
+        self.assertEqual(sniff_content_type("java développeur".encode("utf-8")[:-1]),
+                         "text/plain")
+        self.assertEqual(sniff_content_type(b"MZ\x90\x00\x03"), "application/octet-stream")
+
+        upload_dir = tempfile.mkdtemp()
+        stream = UploadStream(upload_dir, "cv.txt", max_size=10000)
+        for i in range(10):
+            stream.write(b"java developer " * 50)
+        self.assertEqual(stream.check_content_type(), "text/plain")
+        self.assertEqual(stream.content_hash,
+                         hashlib.sha256(b"java developer " * 500).hexdigest())
+        path = os.path.join(upload_dir, "cv.txt")
+        stream.move_to(path)
+        stream.close()
+        self.assertEqual(os.path.getsize(path), 7500)
+
+        stream = UploadStream(upload_dir, "cv.txt", max_size=1000)
+        with self.assertRaises(RequestEntityTooLarge):
+            stream.write(b"java developer " * 100)
+        stream = UploadStream(upload_dir, "cv.pdf")
+        with self.assertRaises(UnsupportedMediaType):
+            stream.write(b"java developer " * 100)
+        self.assertEqual(os.listdir(upload_dir), ["cv.txt"])
+
+    def test_upload_rejects_content(self):
+        """Test upload of a file whose content does not match its extension is rejected."""
+        self.login("test@min.com", "test_user")
+
+        for filename in ("cv.exe", "cv.pdf"):
+            response = self.client.post(
+                "/upload", data=dict(file=(io.BytesIO(b"java developer"), filename)),
+                content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 415)
+        self.assertEqual(Document.query.count(), 0)
+
+    def test_zip_entries(self):
+        """Test zip entries are extracted one by one, disallowed entries are rejected."""
+        upload_dir = tempfile.mkdtemp()
+        path = os.path.join(upload_dir, "cvs.zip")
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("cvs/", b"")
+            archive.writestr("cvs/java.txt", b"java developer " * 200)
+            archive.writestr("cvs/fake.pdf", b"java developer")
+            archive.writestr("cvs/tool.exe", b"MZ\x90\x00")
+            archive.writestr("cvs/large.md", b"python " * 1000)
+            archive.writestr("cvs/more.txt", b"python")
+
+        with open(path, "rb") as f:
+            self.assertEqual(sniff_content_type(f.read(4)), "application/zip")
+
+        entries = list(iter_zip_entries(path, upload_dir, max_files=4, max_size=5000))
+        self.assertEqual([filename for filename, stream in entries],
+                         ["java.txt", "fake.pdf", "tool.exe", "large.md", "more.txt"])
+        self.assertEqual([stream.error.code if stream.error else None for _, stream in entries],
+                         [None, 415, 415, 413, 413])
+
+        stream = entries[0][1]
+        self.assertEqual(stream.content_type, "text/plain")
+        self.assertEqual(stream.content_hash,
+                         hashlib.sha256(b"java developer " * 200).hexdigest())
+        stream.close()
+        self.assertEqual(os.listdir(upload_dir), ["cvs.zip"])
+
+    def test_upload_batch_rejects_files(self):
+        """Test batch upload reports status of each file and rejects only bad files."""
+        self.login("test@min.com", "test_user")
+
+        response = self.client.post(
+            "/upload/batch", data=dict(files=[(io.BytesIO(b"java developer"), "cv.exe"),
+                                              (io.BytesIO(b"java developer"), "cv.pdf"),
+                                              (io.BytesIO(b"not a zip"), "cvs.zip")]),
+            content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["uploaded"], 0)
+        self.assertEqual(response.json["rejected"], 3)
+        self.assertEqual([file["filename"] for file in response.json["files"]],
+                         ["cv.exe", "cv.pdf", "cvs.zip"])
+        self.assertTrue(all(file["status"] == "rejected" for file in response.json["files"]))
+        self.assertEqual(Document.query.count(), 0)
+
+        response = self.client.post("/upload/batch", data=dict(),
+                                    content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+
+    def test_create_many(self):
+        """Test documents of a batch upload are inserted at once, in order."""
+        rows = [dict(content_type="text/plain", title="{}.txt".format(i),
+                     filename="{}.txt".format(i), path=None, content_hash=None)
+                for i in range(3)]
+        ids = DocumentService().create_many(rows, created_by=2)
+        self.assertEqual([Document.query.get(id).title for id in ids], ["0.txt", "1.txt", "2.txt"])
+        self.assertEqual(DocumentService().count_by_user(2), 3)
+
+    def test_document_jobs(self):
+        """Test jobs are queued with documents and record the time of each state."""
+        documentService = DocumentService()
+        document = documentService.create(content_type="text/plain", title="cv.txt",
+                                          created_by=1, filename="cv.txt", path=None)
+        self.assertEqual([job.state for job in find_jobs([document.id])], [DocumentJob.QUEUED])
+
+        for state in (DocumentJob.PARSING, DocumentJob.MATCHING, DocumentJob.INDEXED):
+            set_jobs_state([document.id], state)
+        db.session.expire_all()
+        job = job_to_dict(find_jobs([document.id], user_id=1)[0])
+        self.assertEqual(job["state"], DocumentJob.INDEXED)
+        self.assertTrue(all(seconds is not None and seconds >= 0
+                            for seconds in job["timings"].values()))
+        self.assertEqual(find_jobs([document.id], user_id=2), [])
+
+        # Documents uploaded before jobs were tracked get a job
+        set_jobs_state([document.id, document.id + 1], DocumentJob.FAILED, error="Broken")
+        db.session.expire_all()
+        jobs = find_jobs([document.id, document.id + 1])
+        self.assertEqual([(job.state, job.error) for job in jobs],
+                         [(DocumentJob.FAILED, "Broken")] * 2)
+
+    def test_jobs_status(self):
+        """Test job status by long poll and server-sent events."""
+        self.login("test@min.com", "test_user")
+        user = User.query.filter_by(email="test@min.com").first()
+        document = DocumentService().create(content_type="text/plain", title="cv.txt",
+                                            created_by=user.id, filename="cv.txt", path=None)
+
+        response = self.client.get("/jobs?ids={}".format(document.id))
+        self.assertEqual(response.json["jobs"][0]["state"], DocumentJob.QUEUED)
+        self.assertFalse(response.json["done"])
+
+        set_jobs_state([document.id], DocumentJob.INDEXED)
+        started = time.time()
+        response = self.client.get("/jobs?ids={}&wait=10&since={}".format(
+            document.id, response.json["cursor"]))
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual(response.json["jobs"][0]["state"], DocumentJob.INDEXED)
+        self.assertTrue(response.json["done"])
+
+        response = self.client.get("/jobs/events?ids={}".format(document.id))
+        self.assertEqual(response.mimetype, "text/event-stream")
+        events = response.get_data(as_text=True)
+        self.assertIn('event: job\ndata: {"document_id": %d' % document.id, events)
+        self.assertTrue(events.endswith("event: end\ndata: {}\n\n"))
+
+        self.assertEqual(self.client.get("/jobs").status_code, 400)
+
+    def test_search_cursor(self):
+        """Test search_after values round trip through the search cursor."""
+        cursor = format_search_cursor([1.2345678, 42])
+        self.assertEqual(parse_search_cursor(cursor), [1.2345678, 42])
+        self.assertIsNone(parse_search_cursor("invalid"))
+        self.assertIsNone(parse_search_cursor(None))
+
+    def test_iter_document_ids(self):
+        """Test document ids are paged by the last id."""
+        documentService = DocumentService()
+        ids = [documentService.create(content_type="text/plain", title="{}.txt".format(i),
+                                      created_by=1, filename="{}.txt".format(i), path=None).id
+               for i in range(5)]
+
+        self.assertEqual(list(iter_document_ids(chunk_size=2)), [ids[0:2], ids[2:4], ids[4:]])
+        self.assertEqual(list(iter_document_ids(chunk_size=2, after_id=ids[2])), [ids[3:]])
+
+    def test_find_page_by_user(self):
+        """Test documents of a user are paged newest first by cursor."""
+        documentService = DocumentService()
+        ids = [documentService.create(content_type="text/plain", title="{}.txt".format(i),
+                                      created_by=2, filename="{}.txt".format(i), path=None).id
+               for i in range(5)]
+        documentService.create(content_type="text/plain", title="other.txt",
+                               created_by=1, filename="other.txt", path=None)
+
+        documents, next_cursor = documentService.find_page_by_user(2, 3)
+        self.assertEqual([document.id for document in documents], ids[:1:-1])
+        documents, next_cursor = documentService.find_page_by_user(2, 3, after=next_cursor)
+        self.assertEqual([document.id for document in documents], ids[1::-1])
+        self.assertIsNone(next_cursor)
+        self.assertEqual(documentService.count_by_user(2), 5)
+
+    def test_stand_in_elasticsearch(self):
+        """Test the in-process Elasticsearch stand-in serves requests of the pipeline."""
+        es = create_stand_in_client()
+        self.assertFalse(es.indices.exists(index="bench"))
+        es.indices.create(index="bench-v1", body={"aliases": {"bench": {}}})
+        es.index(index="bench", doc_type="document", id=1, body={"id": 1, "title": "cv"})
+        es.update(index="bench", doc_type="document", id=1, body={"doc": {"skills": ["Java"]}})
+        n_success, errors = bulk(es, [{"_index": "bench", "_type": "document", "_id": 2,
+                                       "_source": {"id": 2}}], raise_on_error=False)
+        self.assertEqual((n_success, errors), (1, []))
+
+        self.assertEqual(es.get(index="bench", doc_type="document", id=1)["_source"],
+                         {"id": 1, "title": "cv", "skills": ["Java"]})
+        res = es.mget(index="bench", doc_type="document", body={"ids": [1, 3]},
+                      _source_includes=["id"])
+        self.assertEqual([doc["found"] for doc in res["docs"]], [True, False])
+        self.assertEqual(res["docs"][0]["_source"], {"id": 1})
+        res = es.search(index="bench", body={"query": {"terms": {"id": [2]}}})
+        self.assertEqual([hit["_id"] for hit in res["hits"]["hits"]], ["2"])
+        with self.assertRaises(TransportError):
+            es.search(index="bench", body={"query": {"match": {"content": "java"}}})
+
+    def test_bench_suite(self):
+        """Test the benchmark suite runs every stage on a synthetic corpus."""
+        result = run_suite(n_documents=4, n_words=300, n_labels=30, pdf_ratio=1.0, batch_size=2,
+                           repeat=1)
+        results = result["results"]
+        self.assertEqual(set(results), set(["ontology_compile", "ontology_load", "text_extraction",
+                                            "matching", "ranking", "end_to_end"]))
+        self.assertGreater(results["text_extraction"]["pages"], 0)
+        self.assertGreater(results["matching"]["skills"], 0)
+        self.assertEqual((results["end_to_end"]["indexed"], results["end_to_end"]["failed"]),
+                         (4, 0))
+        self.assertEqual(self.app.config["ELASTICSEARCH_INDEX"], "test-index")
+
+        comparisons = compare_results(result, result)
+        self.assertFalse(any(item["regression"] for item in comparisons))
+
+
+class TestSkillMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.skill_matcher = SkillMatcher([
+            OntNode(None, "Java", type="Class", labels=["J2EE"]),
+            OntNode(None, "C++", type="Class", labels=[]),
+            OntNode(None, "DotNet", type="Class", labels=[".NET", "dot net"]),
+            OntNode(None, "Spring", type="NamedIndividual", labels=["spring boot"],
+                    parents=["Java"]),
+            OntNode(None, "a a", type="Class", labels=[]),
+        ])
+
+    def test_match_same_as_regex(self):
+        """Test matcher finds the same skills as a regex scan per skill."""
+        content = ("Java developer, javascript is not java_ee. J2EE and C++ or c++11, "
+                   "x.NET .net dot net dotnet. Spring boot, spring-boot, SPRING. a a a a")
+
+        self.assertEqual(self.skill_matcher.match(content),
+                         regex_match(self.skill_matcher, content))
+        self.assertIn(("Java", 1), self.skill_matcher.match(content))
+
+    def test_match_parts(self):
+        """Test matcher on content parts gives the same result as on joined content."""
+        parts = ["I like Ja", "va and c", "++11, J2", "EE", ".", "net and spring b", "oot"]
+
+        self.assertEqual(self.skill_matcher.match(parts),
+                         self.skill_matcher.match("".join(parts)))
+        self.assertIn(("spring boot", 1), self.skill_matcher.match(parts))
+
+    def test_match_empty_content(self):
+        """Test matcher on empty content."""
+        self.assertEqual(self.skill_matcher.match(""), [])
+        self.assertEqual(self.skill_matcher.match(None), [])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,9 +1,15 @@
 # project/server/tests/test_main.py
 
 
+import os
+import tempfile
 import unittest
 
 from base import BaseTestCase
+from project.server import es_client
+from project.server.es_client import get_operation
+from project.server.metrics import (
+    Histogram, MetricsRegistry, StageTimer, estimate_quantile, merge_snapshots, render_text)
 
 
 class TestMainBlueprint(BaseTestCase):
@@ -26,6 +32,72 @@ class TestMainBlueprint(BaseTestCase):
         self.assert404(response)
         self.assertTemplateUsed("errors/404.html")
 
+    def test_elasticsearch_client_is_shared(self):
+        # Ensure the same Elasticsearch client is reused between calls.
+        client = es_client.get_client()
+        self.assertIs(es_client.get_client(), client)
+
+        response = self.client.get("/metrics/elasticsearch")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["clients"], 1)
+        self.assertIn("connection_reuse_ratio", response.json)
+
+    def test_metrics(self):
+        # Ensure metrics of processes are summed and rendered in the Prometheus format.
+        registry = MetricsRegistry()
+        histogram = registry.histogram("stage_seconds", "Stage", ["stage"], buckets=(1, 2, 4))
+        counter = registry.counter("pages_total", "Pages")
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.observe(value, stage="matching")
+        counter.inc(3)
+
+        # Dump of another process
+        metrics_dir = tempfile.mkdtemp()
+        registry.dump(metrics_dir)
+        os.replace(os.path.join(metrics_dir, "{}.json".format(os.getpid())),
+                   os.path.join(metrics_dir, "1.json"))
+        other = MetricsRegistry()
+        other.counter("pages_total", "Pages").inc(2)
+
+        snapshot = other.collect(metrics_dir)
+        text = render_text(snapshot)
+        self.assertIn("pages_total 5\n", text)
+        self.assertIn('stage_seconds_bucket{stage="matching",le="2"} 3\n', text)
+        self.assertIn('stage_seconds_bucket{stage="matching",le="+Inf"} 5\n', text)
+        self.assertIn('stage_seconds_count{stage="matching"} 5\n', text)
+
+        merged = merge_snapshots([registry.snapshot(), registry.snapshot()])
+        self.assertEqual(merged["stage_seconds"]["samples"][0][1]["counts"], [2, 4, 2, 2])
+        self.assertEqual(estimate_quantile([1, 2, 4], [1, 2, 1, 1], 0.5), 1.75)
+        self.assertEqual(estimate_quantile([1, 2, 4], [1, 2, 1, 1], 0.99), 4)
+        self.assertIsNone(estimate_quantile([1, 2, 4], [0, 0, 0, 0], 0.5))
+
+    def test_stage_timer(self):
+        # Ensure time spent in an iterator is counted to its stage.
+        timer = StageTimer()
+        with timer.time("outer"):
+            self.assertEqual(list(timer.iter("inner", range(3))), [0, 1, 2])
+        self.assertLessEqual(timer.get("inner"), timer.get("outer"))
+        self.assertEqual(timer.get("missing"), 0)
+
+        histogram = Histogram("seconds", "Seconds", buckets=(1,))
+        with histogram.time():
+            pass
+        self.assertEqual(histogram.snapshot()["samples"][0][1]["counts"], [1, 0])
+
+    def test_metrics_endpoint(self):
+        # Ensure web metrics are exposed with Elasticsearch operations named.
+        self.client.get("/about/")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_requests_total{endpoint="main.about",status="200"}', response.data)
+        self.assertIn(b"# TYPE extractor_stage_seconds histogram", response.data)
+
+        self.assertEqual(get_operation("POST", "/documents/_search"), "search")
+        self.assertEqual(get_operation("POST", "/_bulk?refresh=wait_for"), "bulk")
+        self.assertEqual(get_operation("PUT", "/documents/_doc/1"), "index")
+        self.assertEqual(get_operation("GET", "/documents/document/1"), "get")
+
 
 if __name__ == "__main__":
     unittest.main()